@@ -0,0 +1,42 @@
+import argparse
+import time
+
+from benchmarks.synthetic import create_cluster
+from src.diff_utils import generate_cluster_diff
+
+
+def time_diff(total_collections: int, collections_per_db: int, changed_every: int):
+    databases = total_collections // collections_per_db
+    cluster1 = create_cluster(databases, collections_per_db)
+    cluster2 = create_cluster(databases, collections_per_db, changed_every=changed_every)
+
+    start = time.perf_counter()
+    diff = generate_cluster_diff(cluster1, cluster2)
+    first = time.perf_counter() - start
+
+    # Fingerprints are cached on the models, so a repeated diff only walks the changed subtrees
+    start = time.perf_counter()
+    generate_cluster_diff(cluster1, cluster2)
+    repeated = time.perf_counter() - start
+
+    changed = sum(len(collection_diff.changed) for collection_diff in diff.databases.changed.values())
+    print(f"{total_collections:>7} collections ({collections_per_db:>5} per db), {changed:>6} changed: "
+          f"first diff {first:.3f}s, "
+          f"repeated diff {repeated:.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time generate_cluster_diff on synthetic clusters")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--collections-per-db", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--changed-every", type=int, default=100,
+                        help="Add an index to every n-th collection of the second cluster (0 for identical)")
+    args = parser.parse_args()
+    for size in args.sizes:
+        for collections_per_db in args.collections_per_db:
+            time_diff(size, collections_per_db, 0)
+            time_diff(size, collections_per_db, args.changed_every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import gc
+import random
+import tracemalloc
+from typing import List, Dict, Iterator
+
+from pydantic import SecretStr
+
+from src.cluster_to_data_model import collection_from_index_specs, user_info_to_datamodel
+from src.compact_model import Interner, CompactCluster, CompactDatabase, compact_user_from_info
+from src.diff_utils import generate_cluster_diff
+from src.mongo_data_model import MongoCluster, MongoDatabase
+
+
+def index_specs(rng: random.Random, count: int, field_names: List[str]) -> List[Dict]:
+    # listIndexes documents as the driver decodes them: fresh strings for every name and field, drawn from a
+    # vocabulary of field names the way real schemas reuse them across collections
+    specs = [{"v": 2, "key": {"_id": 1}, "name": "_id_"}]
+    for _ in range(count):
+        fields = rng.sample(field_names, rng.choice((1, 1, 2, 3)))
+        # "".join makes a copy of the name, as decoding it from BSON would
+        key = {"".join(field): rng.choice((1, -1)) for field in fields}
+        specs.append({"v": 2, "key": key, "name": "_".join(f"{field}_{order}" for field, order in key.items()),
+                      "unique": rng.random() < 0.2})
+    return specs
+
+
+def server_documents(args: argparse.Namespace) -> Iterator[tuple]:
+    # (db_name, [(collection_name, index specs)], usersInfo documents) per database, produced lazily so that only
+    # the models built from them stay in memory
+    rng = random.Random(args.seed)
+    field_names = [f"field_{k}" for k in range(args.field_names)]
+    collections = args.indexes // args.indexes_per_collection
+    for i in range(max(1, collections // args.collections_per_db)):
+        db_name = f"db_{i}"
+        yield (db_name,
+               [(f"collection_{j}", index_specs(rng, args.indexes_per_collection, field_names))
+                for j in range(min(args.collections_per_db, collections - i * args.collections_per_db))],
+               [{"user": f"{db_name}_user_{k}", "db": db_name,
+                 "roles": [{"role": "readWrite", "db": db_name}, {"role": "read", "db": "shared"}]}
+                for k in range(args.users_per_db)])
+
+
+def build_pydantic(args: argparse.Namespace) -> MongoCluster:
+    return MongoCluster(
+        name="bench", host="localhost", port=27017, username="user", password=SecretStr("pass"),
+        authentication_database="admin",
+        databases=[MongoDatabase(name=db_name,
+                                 collections=[collection_from_index_specs(name, specs) for name, specs in collections],
+                                 users=[user_info_to_datamodel(user) for user in users])
+                   for db_name, collections, users in server_documents(args)])
+
+
+def build_compact(args: argparse.Namespace) -> CompactCluster:
+    interner = Interner()
+    return CompactCluster(
+        "bench", "localhost", 27017, "user", SecretStr("pass"), "admin",
+        [CompactDatabase(db_name,
+                         [collection_from_index_specs(name, specs, interner) for name, specs in collections],
+                         [compact_user_from_info(user, interner) for user in users])
+         for db_name, collections, users in server_documents(args)])
+
+
+def measure(build, args: argparse.Namespace) -> Dict:
+    gc.collect()
+    tracemalloc.start()
+    cluster = build(args)
+    built = tracemalloc.get_traced_memory()[0]
+    # Diffing caches a fingerprint on every object, which is part of what a snapshot costs
+    generate_cluster_diff(cluster, cluster)
+    for db in cluster.databases:
+        db.fingerprint
+        for collection in db.collections:
+            collection.fingerprint
+    fingerprinted = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    indexes = sum(len(collection.indexes) for db in cluster.databases for collection in db.collections)
+    return {"indexes": indexes, "built": built, "fingerprinted": fingerprinted}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the memory held by pydantic and compact snapshots")
+    parser.add_argument("--indexes", type=int, default=100_000)
+    parser.add_argument("--indexes-per-collection", type=int, default=4)
+    parser.add_argument("--collections-per-db", type=int, default=1000)
+    parser.add_argument("--users-per-db", type=int, default=5)
+    parser.add_argument("--field-names", type=int, default=500, help="Size of the vocabulary of field names")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = {"pydantic": measure(build_pydantic, args), "compact": measure(build_compact, args)}
+    for name, result in results.items():
+        print(f"{name:<10}{result['indexes']:>9} indexes: {result['built'] / 2 ** 20:>8.1f} MiB built, "
+              f"{result['fingerprinted'] / 2 ** 20:>8.1f} MiB fingerprinted, "
+              f"{result['fingerprinted'] / result['indexes']:>7.0f} bytes per index")
+    print(f"compact/pydantic: {results['compact']['fingerprinted'] / results['pydantic']['fingerprinted']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
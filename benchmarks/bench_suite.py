@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import List, Dict, Callable, Optional
+
+from benchmarks.local_mongod import LocalMongod
+from benchmarks.synthetic import create_cluster, write_config_file
+from src.cluster_to_data_model import mongo_to_datamodel, datamodel_to_config
+from src.config_export import write_config_file as stream_config_file
+from src.config_to_mongo import parse_config_file, setup_cluster
+from src.diff_utils import generate_cluster_diff
+
+
+def time_runs(function: Callable, repeat: int, prepare: Optional[Callable] = None) -> List[float]:
+    # prepare runs untimed before every run and its result is passed to function,
+    # so each run starts from the same state (fresh models, empty server, ...)
+    runs = []
+    for _ in range(repeat):
+        arguments = prepare() if prepare else ()
+        start = time.perf_counter()
+        function(*arguments)
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def summarize(runs: List[float]) -> Dict:
+    return {"runs": runs, "best": min(runs), "mean": sum(runs) / len(runs)}
+
+
+def run_offline_benchmarks(args: argparse.Namespace, directory: str) -> Dict[str, Dict]:
+    def cluster(changed_every: int = 0):
+        return create_cluster(args.databases, args.collections_per_db, args.indexes_per_collection, args.users_per_db,
+                              changed_every=changed_every)
+
+    config_path = os.path.join(directory, "config.yml")
+    write_config_file([cluster()], config_path)
+    return {
+        "parse_config_file": summarize(time_runs(lambda: parse_config_file(config_path), args.repeat)),
+        "generate_cluster_diff": summarize(time_runs(
+            generate_cluster_diff, args.repeat, lambda: (cluster(), cluster(args.changed_every)))),
+        "datamodel_to_config": summarize(time_runs(datamodel_to_config, args.repeat, lambda: ([cluster()],))),
+        "stream_config_file": summarize(time_runs(
+            lambda clusters: stream_config_file(os.path.join(directory, "export.yml"),
+                                                ((cluster, cluster.databases) for cluster in clusters)),
+            args.repeat, lambda: ([cluster()],))),
+    }
+
+
+def reset_server(mongod: LocalMongod, db_names: List[str]):
+    client = mongod.client()
+    try:
+        for db_name in db_names:
+            # Users outlive dropDatabase, and setup_cluster has to create them again
+            client[db_name].command("dropAllUsersFromDatabase")
+            client.drop_database(db_name)
+    finally:
+        client.close()
+
+
+def run_mongod_benchmarks(args: argparse.Namespace) -> Dict[str, Dict]:
+    with LocalMongod(args.mongod, args.port) as mongod:
+        desired = create_cluster(args.databases, args.collections_per_db, args.indexes_per_collection,
+                                 args.users_per_db, host="127.0.0.1", port=mongod.port, username=mongod.username,
+                                 password=mongod.password)
+        db_names = [db.name for db in desired.databases]
+        results = {"setup_cluster": summarize(time_runs(
+            lambda: setup_cluster(desired, args.workers), args.repeat,
+            lambda: reset_server(mongod, db_names) or ()))}
+
+        # The server now holds the last setup_cluster run
+        def introspect(use_catalog: bool):
+            return lambda: mongo_to_datamodel(desired.name, desired.host, desired.port, desired.username,
+                                              desired.password.get_secret_value(), desired.authentication_database,
+                                              max_workers=args.workers, use_catalog=use_catalog)
+
+        results["mongo_to_datamodel"] = summarize(time_runs(introspect(False), args.repeat))
+        results["mongo_to_datamodel (catalog)"] = summarize(time_runs(introspect(True), args.repeat))
+        return results
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(previous: Dict, current: Dict) -> str:
+    lines = [f"{'benchmark':<32}{'previous':>12}{'current':>12}{'ratio':>9}"]
+    for name, result in current["results"].items():
+        before = previous["results"].get(name)
+        if before is None:
+            lines.append(f"{name:<32}{'-':>12}{result['best']:>11.3f}s{'-':>9}")
+        else:
+            lines.append(f"{name:<32}{before['best']:>11.3f}s{result['best']:>11.3f}s"
+                         f"{result['best'] / before['best']:>8.2f}x")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time parsing, diffing, export, introspection and apply "
+                                                 "on synthetic clusters")
+    parser.add_argument("--databases", type=int, default=10)
+    parser.add_argument("--collections-per-db", type=int, default=100)
+    parser.add_argument("--indexes-per-collection", type=int, default=3)
+    parser.add_argument("--users-per-db", type=int, default=2)
+    parser.add_argument("--changed-every", type=int, default=100,
+                        help="Add an index to every n-th collection of the diffed cluster (0 for identical)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark; the best one is compared")
+    parser.add_argument("--workers", type=int, default=8, help="max_workers for setup_cluster and mongo_to_datamodel")
+    parser.add_argument("--mongod", default="mongod", help="mongod binary to start for the server benchmarks")
+    parser.add_argument("--port", type=int, default=27117, help="Port for the benchmark mongod")
+    parser.add_argument("--skip-mongod", action="store_true", help="Only run the benchmarks that need no server")
+    parser.add_argument("--output", default="benchmark-results.json", help="Write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="Print how the results compare to this earlier results file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run_offline_benchmarks(args, directory)
+    if not args.skip_mongod:
+        results.update(run_mongod_benchmarks(args))
+
+    report = {
+        "commit": current_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "parameters": {name: getattr(args, name) for name in ("databases", "collections_per_db",
+                                                              "indexes_per_collection", "users_per_db",
+                                                              "changed_every", "repeat", "workers")},
+        "results": results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    for name, result in results.items():
+        print(f"{name:<32}best {result['best']:.3f}s, mean {result['mean']:.3f}s over {len(result['runs'])} run(s)")
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            print(compare_results(json.load(file), report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import shutil
+import subprocess
+import tempfile
+import time
+
+from pymongo import MongoClient, errors
+
+
+class LocalMongod:
+    # Starts a throwaway mongod with --auth on a temporary dbpath. The first user is created through the
+    # localhost exception, which only applies while the server has no users at all.
+    def __init__(self, mongod: str = "mongod", port: int = 27117, username: str = "bench",
+                 password: str = "bench-password", startup_timeout: float = 30.0):
+        self.mongod = mongod
+        self.port = port
+        self.username = username
+        self.password = password
+        self.startup_timeout = startup_timeout
+        self.dbpath = None
+        self.process = None
+
+    def start(self):
+        self.dbpath = tempfile.mkdtemp(prefix="bench-mongod-")
+        self.process = subprocess.Popen(
+            [self.mongod, "--auth", "--port", str(self.port), "--dbpath", self.dbpath, "--bind_ip", "127.0.0.1"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        client = MongoClient(host="127.0.0.1", port=self.port, directConnection=True, serverSelectionTimeoutMS=500)
+        deadline = time.monotonic() + self.startup_timeout
+        try:
+            while True:
+                try:
+                    client.admin.command("ping")
+                    break
+                except errors.ConnectionFailure:
+                    if self.process.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError(f"mongod did not start on port {self.port}")
+            client.admin.command("createUser", self.username, pwd=self.password, roles=["root"])
+        finally:
+            client.close()
+
+    def client(self) -> MongoClient:
+        return MongoClient(host="127.0.0.1", port=self.port, username=self.username, password=self.password,
+                           authSource="admin", directConnection=True)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        if self.dbpath is not None:
+            shutil.rmtree(self.dbpath, ignore_errors=True)
+            self.dbpath = None
+
+    def __enter__(self):
+        try:
+            self.start()
+        except BaseException:
+            self.stop()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,49 @@
+from typing import List
+
+from pydantic import SecretStr
+
+from src.cluster_to_data_model import datamodel_to_config, config_json_to_yml_file
+from src.mongo_data_model import MongoCluster, MongoDatabase, MongoCollection, MongoIndex, MongoUser, MongoRole
+
+
+def create_index(k: int) -> MongoIndex:
+    # Alternating single-field and compound indexes, every third one unique
+    fields = {f"field_{k}": 1} if k % 2 == 0 else {f"field_{k}": 1, f"field_{k - 1}": -1}
+    return MongoIndex(name=f"index_{k}", fields=fields, unique=k % 3 == 2)
+
+
+def create_user(db_name: str, k: int) -> MongoUser:
+    roles = ["readWrite"] if k % 2 == 0 else ["read", MongoRole(role="read", db="shared")]
+    return MongoUser(username=f"{db_name}_user_{k}", password=SecretStr(f"password_{k}"), roles=roles)
+
+
+def create_cluster(databases: int, collections_per_db: int = 100, indexes_per_collection: int = 3,
+                   users_per_db: int = 1, changed_every: int = 0, name: str = "bench", host: str = "localhost",
+                   port: int = 27017, username: str = "user", password: str = "pass") -> MongoCluster:
+    # changed_every > 0 adds an extra index to every n-th collection, so two clusters can be made to differ there
+    return MongoCluster(
+        name=name,
+        host=host,
+        port=port,
+        username=username,
+        password=SecretStr(password),
+        authentication_database="admin",
+        databases=[
+            MongoDatabase(
+                name=f"db_{i}",
+                collections=[
+                    MongoCollection(
+                        name=f"collection_{j}",
+                        indexes=[create_index(k) for k in range(indexes_per_collection)] + (
+                            [MongoIndex(name="extra_index", fields={"extra": 1})]
+                            if changed_every and (i * collections_per_db + j) % changed_every == 0 else [])
+                    ) for j in range(collections_per_db)
+                ],
+                users=[create_user(f"db_{i}", k) for k in range(users_per_db)]
+            ) for i in range(databases)
+        ]
+    )
+
+
+def write_config_file(clusters: List[MongoCluster], file_path: str):
+    config_json_to_yml_file(datamodel_to_config(clusters), file_path)
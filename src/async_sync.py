@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import List, Dict, Optional, Iterable, Set
+
+from pymongo import AsyncMongoClient, errors
+from pymongo.asynchronous.database import AsyncDatabase
+from pydantic import SecretStr
+
+from src.client_registry import registry
+from src.cluster_to_data_model import collection_from_index_specs, catalog_from_list_catalog, list_catalog_pipeline, \
+    SYSTEM_DATABASES, CATALOG_BATCH_SIZE
+from src.compact_model import Interner, CompactCluster, CompactCollection, CompactDatabase, compact_user_from_info
+from src.config_directory import load_manifest, save_manifest
+from src.config_to_mongo import iter_config_file, index_to_spec, ConfigChange, ConfigDirectoryLoader
+from src.diff_utils import generate_cluster_diff
+from src.instrumentation import metrics
+from src.mongo_data_model import MongoCluster, MongoIndex
+from src.namespace_filter import NamespaceFilter, merge_filters, filter_database_names
+from src.plan_apply import Operation, OperationError, generate_plan, format_plan
+
+logger = logging.getLogger(__name__)
+
+
+class ClusterSyncResult:
+    def __init__(self, cluster_name: str):
+        self.cluster_name = cluster_name
+        self.status = "pending"  # "ok", "failed" or "timeout" once finished
+        self.plan = []
+        self.errors = []
+        self.message = ""
+        self.elapsed = 0.0
+
+
+class FleetSyncReport:
+    def __init__(self):
+        self.results = []
+        self.elapsed = 0.0
+
+    def format(self) -> str:
+        lines = [f"{len(self.results)} cluster(s) in {self.elapsed:.1f}s"]
+        for result in self.results:
+            line = f"  {result.cluster_name}: {result.status}, {len(result.plan)} operation(s), " \
+                   f"{len(result.errors)} error(s) in {result.elapsed:.1f}s"
+            lines.append(f"{line} - {result.message}" if result.message else line)
+            lines.extend(f"    {error}" for error in result.errors)
+        return "\n".join(lines)
+
+
+def create_async_client(cluster: MongoCluster) -> AsyncMongoClient:
+    # Async clients are bound to the running event loop, so they are not shared through the registry;
+    # they still use its pool settings and are closed by async_sync_cluster
+    return AsyncMongoClient(
+        host=cluster.host,
+        port=cluster.port,
+        username=cluster.username,
+        password=cluster.password.get_secret_value(),
+        authSource=cluster.authentication_database,
+        event_listeners=registry.event_listeners(cluster.name),
+        **registry.client_options()
+    )
+
+
+async def async_get_mongo_catalog(client: AsyncMongoClient, db_names: List[str],
+                                  namespace_filter: Optional[NamespaceFilter] = None,
+                                  interner: Optional[Interner] = None) -> Dict[str, List[CompactCollection]]:
+    interner = interner or Interner()
+    try:
+        cursor = await client.admin.aggregate(list_catalog_pipeline(db_names), batchSize=CATALOG_BATCH_SIZE)
+        catalog = catalog_from_list_catalog(await cursor.to_list(), db_names, namespace_filter, interner)
+    except errors.OperationFailure:
+        # Same fallback as get_mongo_catalog, with every listIndexes in flight at once
+        namespaces = []
+        for db_name in db_names:
+            query = merge_filters({'type': 'collection'},
+                                  namespace_filter.collection_filter(db_name) if namespace_filter else {})
+            cursor = await client[db_name].list_collections(filter=query, nameOnly=True)
+            namespaces.extend((db_name, info['name']) for info in await cursor.to_list()
+                              if not info['name'].startswith('system.') and
+                              (namespace_filter is None or namespace_filter.includes_collection(db_name, info['name'])))
+
+        async def list_indexes(db_name: str, collection_name: str) -> List[Dict]:
+            cursor = await client[db_name][collection_name].list_indexes()
+            return await cursor.to_list()
+
+        index_specs = await asyncio.gather(*(list_indexes(db_name, collection_name)
+                                             for db_name, collection_name in namespaces))
+        catalog = {db_name: [] for db_name in db_names}
+        for (db_name, collection_name), collection_index_specs in zip(namespaces, index_specs):
+            catalog[db_name].append(collection_from_index_specs(collection_name, collection_index_specs, interner))
+    return {db_name: sorted(collections, key=lambda collection: collection.name)
+            for db_name, collections in catalog.items()}
+
+
+async def async_mongo_to_datamodel(client: AsyncMongoClient, cluster: MongoCluster,
+                                   databases: Optional[Iterable[str]] = None,
+                                   namespace_filter: Optional[NamespaceFilter] = None,
+                                   interner: Optional[Interner] = None) -> CompactCluster:
+    # A read-only snapshot like mongo_to_compact_datamodel's, so text or 2dsphere keys are read as the sync path does
+    interner = interner or Interner()
+    query = merge_filters({'name': {'$in': sorted(databases)}} if databases is not None else {},
+                          namespace_filter.database_filter() if namespace_filter else {})
+    cursor = await client.list_databases(nameOnly=True, **({'filter': query} if query else {}))
+    db_names = sorted(db_name for db_name in filter_database_names((db['name'] for db in await cursor.to_list()),
+                                                                   namespace_filter)
+                      if db_name not in SYSTEM_DATABASES)
+
+    catalog, users_info = await asyncio.gather(
+        async_get_mongo_catalog(client, db_names, namespace_filter, interner),
+        client.admin.command("usersInfo", {"forAllDBs": True})
+    )
+    users = defaultdict(list)
+    for user in users_info['users']:
+        users[user['db']].append(compact_user_from_info(user, interner))
+
+    return CompactCluster(cluster.name, cluster.host, cluster.port, cluster.username,
+                          SecretStr(cluster.password.get_secret_value()), cluster.authentication_database,
+                          [CompactDatabase(sys.intern(db_name), catalog[db_name], users[db_name])
+                           for db_name in db_names])
+
+
+async def async_create_indexes(db: AsyncDatabase, operation: Operation,
+                               indexes: List[MongoIndex]) -> List[OperationError]:
+    try:
+        await db.command("createIndexes", operation.collection, indexes=[index_to_spec(index) for index in indexes])
+        return []
+    except errors.OperationFailure as e:
+        if len(indexes) == 1:
+            return [OperationError(operation, f"{indexes[0].name}: {e}")]
+    # Same per-index retry as config_to_mongo.create_indexes, to attribute failures to specific indexes
+    results = await asyncio.gather(*(async_create_indexes(db, operation, [index]) for index in indexes))
+    return [error for index_errors in results for error in index_errors]
+
+
+async def async_execute_operation(client: AsyncMongoClient, operation: Operation) -> List[OperationError]:
+    if not operation.command:
+        return []
+    if operation.kind == "create_indexes":
+        return await async_create_indexes(client[operation.database], operation, operation.indexes)
+    try:
+        await client[operation.database].command(operation.command)
+        return []
+    except errors.OperationFailure as e:
+        return [OperationError(operation, str(e))]
+
+
+async def async_apply_plan(client: AsyncMongoClient, plan: List[Operation],
+                           max_concurrent_builds: int = 4) -> List[OperationError]:
+    # Same ordering as apply_plan: users, grants and drops in sequence, then the index builds concurrently
+    operation_errors = []
+    for operation in plan:
+        if operation.kind != "create_indexes":
+            operation_errors.extend(await async_execute_operation(client, operation))
+
+    slots = asyncio.Semaphore(max_concurrent_builds)
+
+    async def build(operation: Operation) -> List[OperationError]:
+        async with slots:
+            return await async_execute_operation(client, operation)
+
+    results = await asyncio.gather(*(build(operation) for operation in plan if operation.kind == "create_indexes"))
+    return operation_errors + [error for index_errors in results for error in index_errors]
+
+
+async def async_sync_cluster(cluster: MongoCluster, result: ClusterSyncResult, prune: bool = False,
+                             dry_run: bool = False, database_scope: Optional[Set[str]] = None):
+    client = create_async_client(cluster)
+    namespace_filter = NamespaceFilter.from_rules(cluster.namespaces)
+    try:
+        with metrics.phase("introspect", cluster.name):
+            live_cluster = await async_mongo_to_datamodel(client, cluster, database_scope, namespace_filter)
+        with metrics.phase("diff", cluster.name):
+            result.plan = generate_plan(generate_cluster_diff(live_cluster, cluster, namespace_filter), prune)
+        logger.info(format_plan(cluster, result.plan), extra={"cluster": cluster.name, "operations": len(result.plan)})
+        if not dry_run:
+            with metrics.phase("apply", cluster.name):
+                result.errors = await async_apply_plan(client, result.plan)
+    finally:
+        await client.close()
+
+
+async def async_sync_fleet(changes: Iterable[ConfigChange], prune: bool = False, dry_run: bool = False,
+                           max_concurrent_clusters: int = 16,
+                           cluster_timeout: Optional[float] = None) -> FleetSyncReport:
+    # Clusters are pulled from the iterable only when a slot frees up, so a streamed config stays streamed
+    report = FleetSyncReport()
+    start = time.perf_counter()
+    slots = asyncio.Semaphore(max_concurrent_clusters)
+
+    async def run(change: ConfigChange, result: ClusterSyncResult):
+        cluster_start = time.perf_counter()
+        try:
+            await asyncio.wait_for(async_sync_cluster(change.cluster, result, prune, dry_run, change.database_scope),
+                                   cluster_timeout)
+            result.status = "failed" if result.errors else "ok"
+        except asyncio.TimeoutError:
+            # Index builds already started keep running on the server; the next sync picks up what is left
+            result.status = "timeout"
+            result.message = f"did not finish within {cluster_timeout}s"
+        except errors.PyMongoError as e:
+            result.status = "failed"
+            result.message = str(e)
+        except Exception as e:
+            # Any other error is confined to its cluster too, the rest of the fleet keeps syncing
+            logger.exception("Sync of %s failed", change.cluster.name, extra={"cluster": change.cluster.name})
+            result.status = "failed"
+            result.message = f"{type(e).__name__}: {e}"
+        finally:
+            result.elapsed = time.perf_counter() - cluster_start
+            slots.release()
+
+    tasks = []
+    for change in changes:
+        await slots.acquire()
+        result = ClusterSyncResult(change.cluster.name)
+        report.results.append(result)
+        tasks.append(asyncio.create_task(run(change, result)))
+    await asyncio.gather(*tasks)
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def async_plan_and_apply(config_file_path: str, dry_run: bool = False, prune: bool = False,
+                         max_concurrent_clusters: int = 16, cluster_timeout: Optional[float] = None,
+                         manifest_path: Optional[str] = None) -> FleetSyncReport:
+    directory_loader = None
+    if os.path.isdir(config_file_path):
+        directory_loader = ConfigDirectoryLoader(config_file_path, load_manifest(manifest_path) if manifest_path else None)
+        changes = directory_loader.changes()
+    else:
+        changes = (ConfigChange(cluster) for cluster in iter_config_file(config_file_path))
+
+    report = asyncio.run(async_sync_fleet(changes, prune, dry_run, max_concurrent_clusters, cluster_timeout))
+    if directory_loader and manifest_path and not dry_run and all(result.status == "ok" for result in report.results):
+        save_manifest(manifest_path, directory_loader.manifest)
+    return report
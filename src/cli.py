@@ -0,0 +1,150 @@
+import argparse
+import logging
+import sys
+
+from src.async_sync import async_plan_and_apply
+from src.client_registry import configure_registry
+from src.config_export import export_clusters
+from src.config_to_mongo import parse_config_file
+from src.drift_monitor import DriftMonitor
+from src.index_analysis import analyze_config_file, parse_timestamp
+from src.instrumentation import configure_logging, enable_command_metrics, write_report
+from src.index_scheduler import IndexBuildScheduler
+from src.plan_apply import plan_and_apply
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="mongo-as-a-code", description="Manage MongoDB clusters from YAML config")
+    parser.add_argument("--max-pool-size", type=int, default=100, help="Connections pooled per cluster")
+    parser.add_argument("--min-pool-size", type=int, default=0, help="Connections kept open per cluster")
+    parser.add_argument("--compressors", default=None,
+                        help="Comma separated wire compressors to offer, e.g. zstd,snappy,zlib")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--log-format", default="text", choices=["text", "json"],
+                        help="json writes one structured log record per line")
+    parser.add_argument("--report", default=None,
+                        help="Write per-phase timings and per-command counts, latencies and bytes to this file")
+    parser.add_argument("--report-format", default=None, choices=["json", "prometheus"],
+                        help="Report format, by default prometheus for a .prom file and json otherwise")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser("sync", help="Apply the differences between a config file and the clusters")
+    sync_parser.add_argument("config", help="Path to the YAML config file or config directory")
+    sync_parser.add_argument("--dry-run", action="store_true", help="Only print the plan")
+    sync_parser.add_argument("--prune", action="store_true",
+                             help="Also drop databases, collections, indexes, users and roles missing from the config")
+    sync_parser.add_argument("--workers", type=int, default=None, help="Concurrent introspection and index builds")
+    sync_parser.add_argument("--schedule-index-builds", action="store_true",
+                             help="Order index builds by estimated cost and throttle them")
+    sync_parser.add_argument("--max-index-builds", type=int, default=1,
+                             help="Concurrent index builds across the cluster when scheduling")
+    sync_parser.add_argument("--max-index-builds-per-db", type=int, default=None,
+                             help="Concurrent index builds per database when scheduling")
+    sync_parser.add_argument("--commit-quorum", default=None,
+                             help="commitQuorum for index builds, e.g. majority or votingMembers")
+    sync_parser.add_argument("--max-time-ms", type=int, default=None, help="maxTimeMS for index builds")
+    sync_parser.add_argument("--cache-dir", default=None,
+                             help="Cache the parsed config here, keyed by the config file's content hash")
+    sync_parser.add_argument("--manifest", default=None,
+                             help="For a config directory, only sync files changed since the run that wrote this "
+                                  "manifest of file hashes")
+    sync_parser.add_argument("--journal", default=None,
+                             help="Record planned and completed operations in this file as they are applied")
+    sync_parser.add_argument("--resume", action="store_true",
+                             help="Continue the interrupted run recorded in --journal, skipping completed operations")
+    sync_parser.add_argument("--async", dest="use_async", action="store_true",
+                             help="Introspect, diff and apply all clusters concurrently with asyncio")
+    sync_parser.add_argument("--max-concurrent-clusters", type=int, default=16,
+                             help="Clusters synced at the same time with --async")
+    sync_parser.add_argument("--cluster-timeout", type=float, default=None,
+                             help="Seconds after which a cluster's sync is abandoned with --async")
+
+    analyze_parser = subparsers.add_parser("analyze", help="Report unused and redundant indexes")
+    analyze_parser.add_argument("config", help="Path to the YAML config file listing the clusters")
+    analyze_parser.add_argument("--unused-since", type=parse_timestamp, default=None,
+                                help="Only flag indexes unused since this time, UTC unless it has an offset, "
+                                     "e.g. 2026-01-01T00:00:00")
+    analyze_parser.add_argument("--output-config", default=None,
+                                help="Write the live clusters without the flagged indexes to this YAML file")
+
+    monitor_parser = subparsers.add_parser("monitor", help="Watch the clusters for drift from the config")
+    monitor_parser.add_argument("config", help="Path to the YAML config file or config directory")
+    monitor_parser.add_argument("--interval", type=float, default=300.0, help="Seconds between polls of a cluster")
+    monitor_parser.add_argument("--jitter", type=float, default=0.2,
+                                help="Fraction of the interval by which each poll is randomly moved")
+    monitor_parser.add_argument("--workers", type=int, default=8, help="Clusters polled at the same time")
+    monitor_parser.add_argument("--output", default=None, help="Append drift events as JSON lines to this file")
+    monitor_parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+
+    export_parser = subparsers.add_parser("export", help="Write the live state of the clusters as YAML config")
+    export_parser.add_argument("config", help="Path to the YAML config file or config directory listing the clusters")
+    export_parser.add_argument("output", help="YAML file to write, or with --split-databases a directory")
+    export_parser.add_argument("--split-databases", action="store_true",
+                               help="Write <cluster>/cluster.yml and one <cluster>/<db>.yml file per database")
+    export_parser.add_argument("--omit-secrets", action="store_true", help="Leave all passwords out of the export")
+    export_parser.add_argument("--workers", type=int, default=None, help="Concurrent listIndexes per database")
+
+    args = parser.parse_args(argv)
+    if args.command == "sync" and args.resume and not args.journal:
+        parser.error("--resume requires --journal")
+    if args.command == "sync" and args.journal and args.use_async:
+        parser.error("--journal is not supported with --async")
+    configure_logging(args.log_level, args.log_format == "json")
+    configure_registry(max_pool_size=args.max_pool_size, min_pool_size=args.min_pool_size,
+                       compressors=args.compressors.split(",") if args.compressors else None)
+    if not args.report:
+        return run_command(args)
+    enable_command_metrics()
+    try:
+        return run_command(args)
+    finally:
+        write_report(args.report, args.report_format)
+
+
+def run_command(args: argparse.Namespace) -> int:
+    if args.command == "sync" and args.use_async:
+        report = async_plan_and_apply(args.config, dry_run=args.dry_run, prune=args.prune,
+                                      max_concurrent_clusters=args.max_concurrent_clusters,
+                                      cluster_timeout=args.cluster_timeout, manifest_path=args.manifest)
+        print(report.format())
+        return 0 if all(result.status == "ok" for result in report.results) else 1
+    if args.command == "sync":
+        scheduler = None
+        if args.schedule_index_builds:
+            commit_quorum = int(args.commit_quorum) if args.commit_quorum and args.commit_quorum.isdigit() \
+                else args.commit_quorum
+            scheduler = IndexBuildScheduler(max_concurrent_builds=args.max_index_builds,
+                                            max_concurrent_builds_per_database=args.max_index_builds_per_db,
+                                            commit_quorum=commit_quorum, max_time_ms=args.max_time_ms)
+        results = plan_and_apply(args.config, dry_run=args.dry_run, prune=args.prune, max_workers=args.workers,
+                                 scheduler=scheduler, cache_dir=args.cache_dir,
+                                 manifest_path=args.manifest, journal_path=args.journal, resume=args.resume)
+        failed = False
+        for cluster_name, operation_errors in results.items():
+            for error in operation_errors:
+                failed = True
+                logger.error("%s: %s", cluster_name, error,
+                             extra={"cluster": cluster_name, "operation": error.operation.describe()})
+        return 1 if failed else 0
+    if args.command == "analyze":
+        analyze_config_file(args.config, args.unused_since, args.output_config)
+        return 0
+    if args.command == "export":
+        export_clusters(args.config, args.output, split_databases=args.split_databases,
+                        include_secrets=not args.omit_secrets, max_workers=args.workers)
+        return 0
+    if args.command == "monitor":
+        output = open(args.output, 'a') if args.output else sys.stdout
+        try:
+            DriftMonitor(parse_config_file(args.config), interval=args.interval, jitter=args.jitter,
+                         max_workers=args.workers, output=output).run(args.duration)
+        finally:
+            if args.output:
+                output.close()
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
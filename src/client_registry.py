@@ -0,0 +1,80 @@
+import atexit
+import hashlib
+import threading
+from typing import List, Dict, Optional
+
+from pymongo import MongoClient
+
+from src.mongo_data_model import MongoCluster
+
+
+class ClientRegistry:
+    # Hands out one pooled MongoClient per set of connection parameters, so introspection and apply against the
+    # same cluster share connections and handshakes. The registry owns the pool settings and closes every client.
+    def __init__(self, max_pool_size: int = 100, min_pool_size: int = 0, compressors: Optional[List[str]] = None):
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.compressors = compressors
+        # Called with a cluster name, returns the pymongo event listeners for that cluster's clients
+        self.listener_factory = None
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client_options(self, max_pool_size: Optional[int] = None) -> Dict:
+        options = {
+            'maxPoolSize': max(self.max_pool_size, max_pool_size or 0),
+            'minPoolSize': self.min_pool_size,
+        }
+        if self.compressors:
+            options['compressors'] = ",".join(self.compressors)
+        return options
+
+    def event_listeners(self, name: str) -> List:
+        return self.listener_factory(name) if self.listener_factory else []
+
+    def get_client(self, host: str, port: int, username: str, password: str, auth_db: str,
+                   max_pool_size: Optional[int] = None, name: Optional[str] = None) -> MongoClient:
+        options = self.client_options(max_pool_size)
+        # The password is part of the identity but is only kept hashed in the key
+        key = (host, port, username, hashlib.sha256(password.encode()).hexdigest(), auth_db,
+               tuple(sorted(options.items())))
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                # Listeners are attributed to whichever name first created the client, host:port by default
+                client = MongoClient(host=host, port=port, username=username, password=password, authSource=auth_db,
+                                     event_listeners=self.event_listeners(name or f"{host}:{port}"), **options)
+                self._clients[key] = client
+            return client
+
+    def get_cluster_client(self, cluster: MongoCluster, max_pool_size: Optional[int] = None) -> MongoClient:
+        return self.get_client(cluster.host, cluster.port, cluster.username, cluster.password.get_secret_value(),
+                               cluster.authentication_database, max_pool_size, cluster.name)
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+
+registry = ClientRegistry()
+atexit.register(registry.close)
+
+
+def configure_registry(max_pool_size: int = 100, min_pool_size: int = 0, compressors: Optional[List[str]] = None):
+    # Later clients use the new settings; clients created with the old ones are closed first
+    registry.close()
+    registry.max_pool_size = max_pool_size
+    registry.min_pool_size = min_pool_size
+    registry.compressors = compressors
+
+
+def get_client(host: str, port: int, username: str, password: str, auth_db: str,
+               max_pool_size: Optional[int] = None, name: Optional[str] = None) -> MongoClient:
+    return registry.get_client(host, port, username, password, auth_db, max_pool_size, name)
+
+
+def get_cluster_client(cluster: MongoCluster, max_pool_size: Optional[int] = None) -> MongoClient:
+    return registry.get_cluster_client(cluster, max_pool_size)
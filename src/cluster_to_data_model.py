@@ -1,71 +1,117 @@
+import logging
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Iterable, Iterator
+
 import yaml
 from pymongo import MongoClient
 from pymongo.collection import Collection
-from typing import List, Dict
+from pymongo.errors import OperationFailure
 from pydantic import BaseModel, SecretStr
 
-from src.mongo_data_model import MongoIndex, MongoCollection, MongoUser, MongoCluster, MongoDatabase
+from src.client_registry import get_client
+from src.compact_model import Interner, CompactCluster, CompactCollection, CompactDatabase, compact_index_from_spec, \
+    compact_user_from_info
+from src.mongo_data_model import MongoIndex, MongoCollection, MongoUser, MongoCluster, MongoDatabase, \
+    MongoRole
+from src.namespace_filter import NamespaceFilter, merge_filters, filter_database_names
+from src.shard_indexes import get_shard_index_specs
+
+try:
+    # libyaml's emitter is many times faster than the pure-Python one
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
+
+logger = logging.getLogger(__name__)
+
+def cluster_settings_to_config(cluster: MongoCluster, include_secrets: bool = True) -> Dict:
+    cluster_config = {
+        'name': cluster.name,
+        'host': cluster.host,
+        'port': cluster.port,
+        'username': cluster.username,
+        'password': cluster.password.get_secret_value(),
+        'authentication_database': cluster.authentication_database,
+    }
+    if not include_secrets:
+        del cluster_config['password']
+    if cluster.namespaces:
+        cluster_config['namespaces'] = cluster.namespaces.model_dump(exclude_defaults=True)
+    if cluster.sharded:
+        cluster_config['sharded'] = True
+    return cluster_config
+
+
+def database_to_config(db: MongoDatabase, include_secrets: bool = True) -> Dict:
+    db_config = {
+        'name': db.name,
+        'users': [],
+        'collections': []
+    }
+    for user in db.users:
+        user_config = {'username': user.username}
+        if include_secrets:
+            user_config['password'] = user.password.get_secret_value()
+        user_config['roles'] = [role if isinstance(role, str) else role.model_dump() for role in user.roles]
+        db_config['users'].append(user_config)
+    for collection in db.collections:
+        collection_config = {
+            'name': collection.name,
+            'indexes': [],
+        }
+        for index in collection.indexes:
+            collection_config['indexes'].append({
+                'name': index.name,
+                'fields': [{field: order} for field, order in index.fields.items()],
+                'unique': index.unique
+            })
+        db_config['collections'].append(collection_config)
+    return db_config
 
-def datamodel_to_config(clusters: List[MongoCluster]):
+
+def datamodel_to_config(clusters: List[MongoCluster], include_secrets: bool = True):
     config = {'clusters': []}
     for cluster in clusters:
-        cluster_config = {
-            'name': cluster.name,
-            'host': cluster.host,
-            'port': cluster.port,
-            'username': cluster.username,
-            'password': cluster.password.get_secret_value(),
-            'authentication_database': cluster.authentication_database,
-            'databases': []
-        }
-        for db in cluster.databases:
-            db_config = {
-                'name': db.name,
-                'users': [],
-                'collections': []
-            }
-            for user in db.users:
-                db_config['users'].append({
-                    'username': user.username,
-                    'password': user.password.get_secret_value(),
-                    'roles': user.roles
-                })
-            for collection in db.collections:
-                collection_config = {
-                    'name': collection.name,
-                    'indexes': [],
-                }
-                for index in collection.indexes:
-                    collection_config['indexes'].append({
-                        'name': index.name,
-                        'fields': [{field: order} for field, order in index.fields.items()],
-                        'unique': index.unique
-                    })
-                db_config['collections'].append(collection_config)
-            cluster_config['databases'].append(db_config)
+        cluster_config = cluster_settings_to_config(cluster, include_secrets)
+        cluster_config['databases'] = [database_to_config(db, include_secrets) for db in cluster.databases]
         config['clusters'].append(cluster_config)
     return config
 
 def config_json_to_yml_file(config_json: Dict, file_path: str):
     with open(file_path, 'w') as file:
-        yaml.dump(config_json, file)
+        yaml.dump(config_json, file, Dumper=SafeDumper)
+
+def index_spec_to_datamodel(index: Dict) -> MongoIndex:
+    return MongoIndex(
+        name=index['name'],
+        fields={field: order for field, order in index['key'].items()},
+        unique=index.get('unique', False)
+    )
+
+
+def collection_from_index_specs(name: str, index_specs: Iterable[Dict], interner: Optional[Interner] = None):
+    # A CompactCollection built without validation with an interner, a MongoCollection otherwise
+    index_specs = [index for index in index_specs if index['name'] != '_id_']
+    if interner is not None:
+        return CompactCollection(sys.intern(name), tuple(compact_index_from_spec(index, interner)
+                                                         for index in index_specs))
+    return MongoCollection(name=name, indexes=[index_spec_to_datamodel(index) for index in index_specs])
+
 
 def get_mongo_indexes(collection: Collection) -> List[MongoIndex]:
     indexes = []
     for index in collection.list_indexes():
         # Skip the default '_id_' index
         if index['name'] != '_id_':
-            indexes.append(MongoIndex(
-                name=index['name'],
-                fields={field: order for field, order in index['key'].items()},
-                unique=index.get('unique', False)
-            ))
+            indexes.append(index_spec_to_datamodel(index))
     return indexes
 
 
-def get_mongo_collections(db) -> List[MongoCollection]:
+def get_mongo_collections(db, namespace_filter: Optional[NamespaceFilter] = None) -> List[MongoCollection]:
     collections = []
-    for collection_name in db.list_collection_names():
+    for collection_name in list_collection_names(db, namespace_filter):
         collection = db[collection_name]
         collections.append(MongoCollection(
             name=collection_name,
@@ -74,33 +120,229 @@ def get_mongo_collections(db) -> List[MongoCollection]:
     return collections
 
 
+def user_info_to_datamodel(user: Dict) -> MongoUser:
+    return MongoUser(
+        username=user['user'],
+        password=SecretStr(''),  # Passwords are not retrievable
+        roles=[role['role'] if role['db'] == user['db'] else MongoRole(role=role['role'], db=role['db'])
+               for role in user['roles']]
+    )
+
+
 def get_mongo_users(db) -> List[MongoUser]:
-    users = []
-    for user in db.command("usersInfo")['users']:
-        roles = [role['role'] for role in user['roles']]
-        users.append(MongoUser(
-            username=user['user'],
-            password=SecretStr(''),  # Passwords are not retrievable
-            roles=roles
-        ))
+    return [user_info_to_datamodel(user) for user in db.command("usersInfo")['users']]
+
+
+def get_all_mongo_users(client: MongoClient, interner: Optional[Interner] = None) -> Dict[str, List[MongoUser]]:
+    # One usersInfo round trip for the whole cluster, bucketed by the database each user is defined on
+    users = defaultdict(list)
+    for user in client.admin.command("usersInfo", {"forAllDBs": True})['users']:
+        users[user['db']].append(compact_user_from_info(user, interner) if interner is not None
+                                 else user_info_to_datamodel(user))
     return users
 
 
-def mongo_to_datamodel(cluster_name, host, port, username, password, auth_db) -> MongoCluster:
-    client = MongoClient(host=host, port=port, username=username, password=password, authSource=auth_db)
+SYSTEM_DATABASES = ["admin", "local", "config"]
+
+
+def list_database_names(client: MongoClient, databases: Optional[Iterable[str]] = None,
+                        namespace_filter: Optional[NamespaceFilter] = None) -> List[str]:
+    # Restricting to known names happens on the server, so unrelated databases are never even listed
+    query = merge_filters({'name': {'$in': sorted(databases)}} if databases is not None else {},
+                          namespace_filter.database_filter() if namespace_filter else {})
+    list_options = {'filter': query} if query else {}
+    return filter_database_names((db['name'] for db in client.list_databases(nameOnly=True, **list_options)),
+                                 namespace_filter)
+
+
+def list_collection_names(db, namespace_filter: Optional[NamespaceFilter] = None) -> List[str]:
+    if namespace_filter is None:
+        return db.list_collection_names()
+    return [collection_name for collection_name
+            in db.list_collection_names(filter=namespace_filter.collection_filter(db.name))
+            if namespace_filter.includes_collection(db.name, collection_name)]
+
+
+def get_mongo_databases_concurrently(client: MongoClient, db_names: List[str], max_workers: int,
+                                     namespace_filter: Optional[NamespaceFilter] = None) -> List[MongoDatabase]:
+    # Two phases so that no worker ever blocks on another task queued in the same bounded pool
+    db_names = sorted(db_names)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        users_future = executor.submit(get_all_mongo_users, client)
+        names_futures = {db_name: executor.submit(list_collection_names, client[db_name], namespace_filter)
+                         for db_name in db_names}
+        collection_names = {db_name: sorted(future.result()) for db_name, future in names_futures.items()}
 
-    databases = []
-    for db_name in client.list_database_names():
-        print(db_name)
-        # Skip system databases
-        if db_name not in ["admin", "local", "config"]:
+        indexes_futures = {
+            (db_name, collection_name): executor.submit(get_mongo_indexes, client[db_name][collection_name])
+            for db_name in db_names for collection_name in collection_names[db_name]
+        }
+        return [
+            MongoDatabase(
+                name=db_name,
+                collections=[
+                    MongoCollection(name=collection_name, indexes=indexes_futures[(db_name, collection_name)].result())
+                    for collection_name in collection_names[db_name]
+                ],
+                users=users_future.result()[db_name]
+            ) for db_name in db_names
+        ]
+
+
+CATALOG_BATCH_SIZE = 1000
+
+
+def list_catalog_pipeline(db_names: List[str]) -> List[Dict]:
+    # Run against admin, $listCatalog returns every collection of the cluster together with its index specs
+    return [
+        {'$listCatalog': {}},
+        {'$match': {'db': {'$in': db_names}, 'type': 'collection'}},
+        {'$project': {'db': 1, 'name': 1, 'md.indexes.spec': 1}},
+    ]
+
+
+def catalog_from_list_catalog(entries: Iterable[Dict], db_names: List[str],
+                              namespace_filter: Optional[NamespaceFilter] = None,
+                              interner: Optional[Interner] = None) -> Dict[str, List[MongoCollection]]:
+    # Shared by the sync and async readers. Through mongos there is one entry per shard holding the collection,
+    # so only the first one of each is kept.
+    catalog = {db_name: [] for db_name in db_names}
+    seen = set()
+    for entry in entries:
+        # The catalog arrives in bulk, so collection rules are only checked here rather than on the server
+        if (entry['db'], entry['name']) in seen or entry['name'].startswith('system.') or \
+                (namespace_filter and not namespace_filter.includes_collection(entry['db'], entry['name'])):
+            continue
+        seen.add((entry['db'], entry['name']))
+        catalog[entry['db']].append(collection_from_index_specs(
+            entry['name'], (index['spec'] for index in entry['md']['indexes']), interner))
+    return catalog
+
+
+def get_mongo_catalog_from_list_catalog(client: MongoClient, db_names: List[str],
+                                        namespace_filter: Optional[NamespaceFilter] = None,
+                                        interner: Optional[Interner] = None) -> Dict[str, List[MongoCollection]]:
+    return catalog_from_list_catalog(client.admin.aggregate(list_catalog_pipeline(db_names),
+                                                            batchSize=CATALOG_BATCH_SIZE),
+                                     db_names, namespace_filter, interner)
+
+
+def get_mongo_catalog_from_list_collections(client: MongoClient, db_names: List[str],
+                                            max_workers: Optional[int] = None,
+                                            namespace_filter: Optional[NamespaceFilter] = None,
+                                            interner: Optional[Interner] = None) -> Dict[str, List[MongoCollection]]:
+    # Older servers have no bulk source for index specs, so only listCollections is batched here
+    collection_names = {}
+    for db_name in db_names:
+        query = merge_filters({'type': 'collection'},
+                              namespace_filter.collection_filter(db_name) if namespace_filter else {})
+        cursor = client[db_name].list_collections(filter=query, nameOnly=True, cursor={'batchSize': CATALOG_BATCH_SIZE})
+        collection_names[db_name] = [
+            info['name'] for info in cursor.batch_size(CATALOG_BATCH_SIZE)
+            if not info['name'].startswith('system.')
+            and (namespace_filter is None or namespace_filter.includes_collection(db_name, info['name']))]
+
+    namespaces = [(db_name, collection_name) for db_name in db_names for collection_name in collection_names[db_name]]
+    collections = [client[db_name][collection_name] for db_name, collection_name in namespaces]
+    with ThreadPoolExecutor(max_workers=max_workers or 1) as executor:
+        index_specs = list(executor.map(lambda collection: list(collection.list_indexes()), collections))
+
+    catalog = {db_name: [] for db_name in db_names}
+    for (db_name, collection_name), collection_index_specs in zip(namespaces, index_specs):
+        catalog[db_name].append(collection_from_index_specs(collection_name, collection_index_specs, interner))
+    return catalog
+
+
+def get_mongo_catalog(client: MongoClient, db_names: List[str], max_workers: Optional[int] = None,
+                      namespace_filter: Optional[NamespaceFilter] = None,
+                      interner: Optional[Interner] = None) -> Dict[str, List[MongoCollection]]:
+    try:
+        catalog = get_mongo_catalog_from_list_catalog(client, db_names, namespace_filter, interner)
+    except OperationFailure:
+        # $listCatalog is unknown before MongoDB 6.0, or not permitted for this user
+        catalog = get_mongo_catalog_from_list_collections(client, db_names, max_workers, namespace_filter, interner)
+    return {db_name: sorted(collections, key=lambda collection: collection.name)
+            for db_name, collections in catalog.items()}
+
+
+def iter_mongo_databases(client: MongoClient, db_names: List[str], max_workers: Optional[int] = None,
+                         namespace_filter: Optional[NamespaceFilter] = None) -> Iterator[MongoDatabase]:
+    # One database at a time, so that a consumer writing each one out never holds more than a single database.
+    # With max_workers > 1 the listIndexes of a database's collections are issued from a bounded pool.
+    users = get_all_mongo_users(client)
+    with ThreadPoolExecutor(max_workers=max_workers or 1) as executor:
+        for db_name in db_names:
             db = client[db_name]
-            databases.append(MongoDatabase(
+            collection_names = sorted(list_collection_names(db, namespace_filter))
+            indexes = executor.map(lambda collection_name: get_mongo_indexes(db[collection_name]), collection_names)
+            yield MongoDatabase(
                 name=db_name,
-                collections=get_mongo_collections(db),
-                users=get_mongo_users(db)
-            ))
+                collections=[MongoCollection(name=collection_name, indexes=collection_indexes)
+                             for collection_name, collection_indexes in zip(collection_names, indexes)],
+                users=users[db_name]
+            )
+
 
+def attach_shard_indexes(client: MongoClient, databases: List[MongoDatabase], cluster_name: str, username: str,
+                         password: str, auth_db: str, max_workers: Optional[int] = None,
+                         namespace_filter: Optional[NamespaceFilter] = None, interner: Optional[Interner] = None):
+    # Sets shard_indexes while the snapshot is being built, before its fingerprints are computed or shared
+    shard_index_specs = get_shard_index_specs(client, [db.name for db in databases], cluster_name, username,
+                                              password, auth_db, max_workers, namespace_filter)
+    for db in databases:
+        for collection in db.collections:
+            specs = shard_index_specs.get(f"{db.name}.{collection.name}")
+            if specs is not None:
+                # Unreadable shards keep None, which diff_utils reports
+                collection.shard_indexes = {shard: collection_from_index_specs(collection.name, shard_specs,
+                                                                               interner).indexes
+                                            if shard_specs is not None else None
+                                            for shard, shard_specs in specs.items()}
+
+
+# With max_workers > 1 the per-database and per-collection commands are issued from a bounded thread pool
+# sharing one MongoClient, and databases/collections come back sorted by name. With use_catalog the collections
+# and indexes of the whole cluster are read through get_mongo_catalog in a handful of bulk commands instead.
+# databases restricts the snapshot to the given database names, and namespace_filter to the namespaces it includes;
+# both are applied server-side before any per-namespace command is sent.
+# With sharded, every sharded collection also gets the indexes each of its shards reports in shard_indexes.
+def mongo_to_datamodel(cluster_name, host, port, username, password, auth_db,
+                       max_workers: Optional[int] = None, use_catalog: bool = False,
+                       databases: Optional[Iterable[str]] = None,
+                       namespace_filter: Optional[NamespaceFilter] = None,
+                       sharded: bool = False) -> MongoCluster:
+    # Keep enough pooled connections for every worker to have one in flight
+    client = get_client(host, port, username, password, auth_db, max_pool_size=max_workers, name=cluster_name)
+
+    all_db_names = list_database_names(client, databases, namespace_filter)
+    if use_catalog:
+        db_names = sorted(db_name for db_name in all_db_names if db_name not in SYSTEM_DATABASES)
+        catalog = get_mongo_catalog(client, db_names, max_workers, namespace_filter)
+        users = get_all_mongo_users(client)
+        databases = [
+            MongoDatabase(name=db_name, collections=catalog[db_name], users=users[db_name])
+            for db_name in db_names
+        ]
+    elif max_workers and max_workers > 1:
+        db_names = [db_name for db_name in all_db_names if db_name not in SYSTEM_DATABASES]
+        databases = get_mongo_databases_concurrently(client, db_names, max_workers, namespace_filter)
+    else:
+        databases = []
+        users = get_all_mongo_users(client)
+        for db_name in all_db_names:
+            logger.debug("Reading database %s", db_name, extra={"cluster": cluster_name, "database": db_name})
+            # Skip system databases
+            if db_name not in SYSTEM_DATABASES:
+                db = client[db_name]
+                databases.append(MongoDatabase(
+                    name=db_name,
+                    collections=get_mongo_collections(db, namespace_filter),
+                    users=users[db_name]
+                ))
+
+    if sharded:
+        attach_shard_indexes(client, databases, cluster_name, username, password, auth_db, max_workers,
+                             namespace_filter)
     return MongoCluster(
         name=cluster_name,
         host=host,
@@ -108,10 +350,32 @@ def mongo_to_datamodel(cluster_name, host, port, username, password, auth_db) ->
         username=username,
         password=SecretStr(password),
         authentication_database=auth_db,
-        databases=databases
+        databases=databases,
+        sharded=sharded
     )
 
 
+# Like mongo_to_datamodel with use_catalog, but the snapshot is a read-only CompactCluster built from the server's
+# documents without validation; it can be diffed against a MongoCluster but not mutated. An interner shared
+# between snapshots deduplicates across them.
+def mongo_to_compact_datamodel(cluster_name, host, port, username, password, auth_db,
+                               max_workers: Optional[int] = None, databases: Optional[Iterable[str]] = None,
+                               namespace_filter: Optional[NamespaceFilter] = None,
+                               interner: Optional[Interner] = None, sharded: bool = False) -> CompactCluster:
+    client = get_client(host, port, username, password, auth_db, max_pool_size=max_workers, name=cluster_name)
+    interner = interner or Interner()
+    db_names = sorted(db_name for db_name in list_database_names(client, databases, namespace_filter)
+                      if db_name not in SYSTEM_DATABASES)
+    catalog = get_mongo_catalog(client, db_names, max_workers, namespace_filter, interner)
+    users = get_all_mongo_users(client, interner)
+    databases = [CompactDatabase(sys.intern(db_name), catalog[db_name], users[db_name]) for db_name in db_names]
+    if sharded:
+        attach_shard_indexes(client, databases, cluster_name, username, password, auth_db, max_workers,
+                             namespace_filter, interner)
+    return CompactCluster(cluster_name, host, port, username, SecretStr(password), auth_db, databases,
+                          sharded=sharded)
+
+
 if __name__ == "__main__":
     cluster = mongo_to_datamodel("MyCluster", "localhost", 27017, "mongolocal", "mongosecret1a", "admin")
     print(datamodel_to_config([cluster]))
\ No newline at end of file
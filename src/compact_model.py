@@ -0,0 +1,208 @@
+import sys
+from typing import List, Dict, Iterable, NamedTuple, Optional, Tuple, Union
+
+from pydantic import SecretStr
+
+from src.mongo_data_model import MongoCluster, MongoDatabase, MongoCollection, MongoIndex, MongoUser, MongoRole, \
+    content_hash, role_documents
+
+# Read-only stand-ins for the mongo_data_model classes, for large snapshots of live clusters. They expose the same
+# attributes and fingerprints, so diff_utils and plan_apply accept either kind, even mixed in one comparison, but
+# they hold tuples in __slots__ instead of validated pydantic models with a dict per index. Names, key patterns and
+# roles are shared through an Interner. Pydantic validation stays at the config boundary: config files are parsed
+# into mongo_data_model, server documents are built into these classes without validation.
+# They are never mutated, so unlike the pydantic models their fingerprints need no invalidation.
+
+EMPTY_PASSWORD = SecretStr('')
+
+
+class CompactRole(NamedTuple):
+    role: str
+    db: str
+
+
+class Interner:
+    # One instance can be shared by every snapshot of a fleet, so that identical key patterns are stored once
+    def __init__(self):
+        self.key_patterns = {}
+        self.roles = {}
+
+    def key_pattern(self, fields: Iterable[Tuple[str, int]], unique: bool) -> tuple:
+        key_pattern = (tuple((sys.intern(field), order) for field, order in fields), unique)
+        return self.key_patterns.setdefault(key_pattern, key_pattern)
+
+    def role(self, role: Union[str, MongoRole, CompactRole]) -> Union[str, CompactRole]:
+        if isinstance(role, str):
+            return sys.intern(role)
+        compact_role = CompactRole(sys.intern(role.role), sys.intern(role.db))
+        return self.roles.setdefault(compact_role, compact_role)
+
+
+class CompactIndex:
+    __slots__ = ("name", "key_pattern", "_fingerprint")
+
+    def __init__(self, name: str, key_pattern: tuple):
+        self.name = name
+        # ((field, order), ...), unique: immutable and hashable, field order is significant
+        self.key_pattern = key_pattern
+        self._fingerprint = None
+
+    @property
+    def fields(self) -> Dict[str, int]:
+        return dict(self.key_pattern[0])
+
+    @property
+    def unique(self) -> bool:
+        return self.key_pattern[1]
+
+    @property
+    def fingerprint(self) -> int:
+        if self._fingerprint is None:
+            self._fingerprint = content_hash(self.name, self.key_pattern)
+        return self._fingerprint
+
+    def __eq__(self, other):
+        return isinstance(other, CompactIndex) and self.name == other.name and self.key_pattern == other.key_pattern
+
+    def __hash__(self):
+        return hash((self.name, self.key_pattern))
+
+    def __repr__(self):
+        return f"CompactIndex({self.name!r}, {self.key_pattern!r})"
+
+
+class CompactCollection:
+    __slots__ = ("name", "indexes", "shard_indexes", "_fingerprint")
+
+    def __init__(self, name: str, indexes: Tuple[CompactIndex, ...],
+                 shard_indexes: Optional[Dict[str, Optional[Tuple[CompactIndex, ...]]]] = None):
+        self.name = name
+        self.indexes = indexes
+        self.shard_indexes = shard_indexes
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self) -> int:
+        if self._fingerprint is None:
+            self._fingerprint = content_hash(self.name, tuple(sorted(index.fingerprint for index in self.indexes)))
+        return self._fingerprint
+
+
+class CompactUser:
+    __slots__ = ("username", "password", "roles", "_fingerprint")
+
+    def __init__(self, username: str, roles: Tuple[Union[str, CompactRole], ...], password: SecretStr = EMPTY_PASSWORD):
+        self.username = username
+        self.password = password
+        self.roles = roles
+        self._fingerprint = None
+
+    def role_documents(self, db_name: str) -> List[Dict[str, str]]:
+        return role_documents(self.roles, db_name)
+
+    @property
+    def fingerprint(self) -> int:
+        if self._fingerprint is None:
+            self._fingerprint = content_hash(self.username, tuple(sorted(
+                (role, "") if isinstance(role, str) else (role.role, role.db) for role in self.roles)))
+        return self._fingerprint
+
+
+class CompactDatabase:
+    __slots__ = ("name", "collections", "users", "_fingerprint")
+
+    # Keyword-compatible with MongoDatabase, which diff_utils relies on to rebuild a filtered database
+    def __init__(self, name: str, collections: Iterable[CompactCollection], users: Iterable[CompactUser]):
+        self.name = name
+        self.collections = tuple(collections)
+        self.users = tuple(users)
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self) -> int:
+        if self._fingerprint is None:
+            self._fingerprint = content_hash(self.name,
+                                             tuple(sorted(collection.fingerprint for collection in self.collections)),
+                                             tuple(sorted(user.fingerprint for user in self.users)))
+        return self._fingerprint
+
+
+class CompactCluster:
+    __slots__ = ("name", "host", "port", "username", "password", "authentication_database", "databases",
+                 "namespaces", "sharded")
+
+    def __init__(self, name: str, host: str, port: int, username: str, password: SecretStr,
+                 authentication_database: str, databases: Iterable[CompactDatabase], namespaces=None,
+                 sharded: bool = False):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.authentication_database = authentication_database
+        self.databases = tuple(databases)
+        self.namespaces = namespaces
+        self.sharded = sharded
+
+
+def compact_index_from_spec(spec: Dict, interner: Interner) -> CompactIndex:
+    # spec is an index document as returned by listIndexes or $listCatalog
+    return CompactIndex(sys.intern(spec['name']), interner.key_pattern(spec['key'].items(), spec.get('unique', False)))
+
+
+def compact_user_from_info(user: Dict, interner: Interner) -> CompactUser:
+    # user is a usersInfo document; passwords are not retrievable
+    return CompactUser(sys.intern(user['user']), tuple(
+        interner.role(role['role'] if role['db'] == user['db'] else CompactRole(role['role'], role['db']))
+        for role in user['roles']))
+
+
+def compact_indexes(indexes: Iterable[MongoIndex], interner: Interner) -> Tuple[CompactIndex, ...]:
+    return tuple(CompactIndex(sys.intern(index.name), interner.key_pattern(index.fields.items(), index.unique))
+                 for index in indexes)
+
+
+def compact_cluster(cluster: MongoCluster, interner: Optional[Interner] = None) -> CompactCluster:
+    interner = interner or Interner()
+    return CompactCluster(
+        cluster.name, cluster.host, cluster.port, cluster.username, cluster.password,
+        cluster.authentication_database,
+        [CompactDatabase(
+            sys.intern(db.name),
+            [CompactCollection(sys.intern(collection.name), compact_indexes(collection.indexes, interner),
+                               {shard: compact_indexes(indexes, interner) if indexes is not None else None
+                                for shard, indexes in collection.shard_indexes.items()}
+                               if collection.shard_indexes is not None else None)
+             for collection in db.collections],
+            [CompactUser(sys.intern(user.username), tuple(interner.role(role) for role in user.roles), user.password)
+             for user in db.users])
+         for db in cluster.databases],
+        cluster.namespaces, cluster.sharded)
+
+
+def expand_indexes(indexes: Iterable[CompactIndex]) -> List[MongoIndex]:
+    return [MongoIndex.model_construct(name=index.name, fields=index.fields, unique=index.unique) for index in indexes]
+
+
+def expand_cluster(cluster: CompactCluster) -> MongoCluster:
+    # Back to pydantic models through model_construct: the compact models were never validated against them,
+    # but everything they hold came from the server or from models that were
+    return MongoCluster.model_construct(
+        name=cluster.name, host=cluster.host, port=cluster.port, username=cluster.username,
+        password=cluster.password, authentication_database=cluster.authentication_database,
+        databases=[MongoDatabase.model_construct(
+            name=db.name,
+            collections=[MongoCollection.model_construct(
+                name=collection.name,
+                indexes=expand_indexes(collection.indexes),
+                shard_indexes={shard: expand_indexes(indexes) if indexes is not None else None
+                               for shard, indexes in collection.shard_indexes.items()}
+                if collection.shard_indexes is not None else None)
+                for collection in db.collections],
+            users=[MongoUser.model_construct(
+                username=user.username, password=user.password,
+                roles=[role if isinstance(role, str) else MongoRole.model_construct(role=role.role, db=role.db)
+                       for role in user.roles])
+                for user in db.users])
+            for db in cluster.databases],
+        namespaces=cluster.namespaces, sharded=cluster.sharded)
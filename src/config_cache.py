@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+from pydantic import SecretStr
+
+from src.mongo_data_model import MongoCluster, MongoDatabase, MongoCollection, MongoIndex, MongoUser, MongoRole, \
+    MongoNamespaceRules
+
+# Bump whenever the cached layout or the models change, so stale entries are never loaded
+CACHE_FORMAT_VERSION = 4
+
+
+def config_cache_key(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def cache_file_path(cache_dir: str, cache_key: str) -> str:
+    return os.path.join(cache_dir, f"config-v{CACHE_FORMAT_VERSION}-{cache_key}.json")
+
+
+# The cache stores plain tuples rather than models, written as JSON: loading them back through model_construct
+# skips validation, no fingerprint cached under another process' hash seed can leak into this one, and unlike a
+# pickle an entry planted in a shared cache directory cannot run code when it is loaded. Tuples come back as lists.
+
+def cluster_to_cache_data(cluster: MongoCluster, include_secrets: bool = True) -> tuple:
+    def secret(value: SecretStr) -> str:
+        return value.get_secret_value() if include_secrets else ''
+
+    return (
+        cluster.name, cluster.host, cluster.port, cluster.username, secret(cluster.password),
+        cluster.authentication_database,
+        [(db.name,
+          [(user.username, secret(user.password),
+            [role if isinstance(role, str) else (role.role, role.db) for role in user.roles])
+           for user in db.users],
+          [(collection.name, [(index.name, list(index.fields.items()), index.unique) for index in collection.indexes])
+           for collection in db.collections])
+         for db in cluster.databases],
+        cluster.namespaces.model_dump() if cluster.namespaces else None,
+        cluster.sharded
+    )
+
+
+def cluster_from_cache_data(data: tuple) -> MongoCluster:
+    name, host, port, username, password, authentication_database, databases, namespaces, sharded = data
+    return MongoCluster.model_construct(
+        name=name,
+        host=host,
+        port=port,
+        username=username,
+        password=SecretStr(password),
+        authentication_database=authentication_database,
+        databases=[
+            MongoDatabase.model_construct(
+                name=db_name,
+                users=[
+                    MongoUser.model_construct(
+                        username=user_name,
+                        password=SecretStr(user_password),
+                        roles=[role if isinstance(role, str) else MongoRole.model_construct(role=role[0], db=role[1])
+                               for role in roles]
+                    ) for user_name, user_password, roles in users
+                ],
+                collections=[
+                    MongoCollection.model_construct(
+                        name=collection_name,
+                        indexes=[MongoIndex.model_construct(name=index_name, fields=dict(fields), unique=unique)
+                                 for index_name, fields, unique in indexes]
+                    ) for collection_name, indexes in collections
+                ]
+            ) for db_name, users, collections in databases
+        ],
+        namespaces=MongoNamespaceRules.model_construct(**namespaces) if namespaces else None,
+        sharded=sharded
+    )
+
+
+def load_cached_clusters(cache_dir: str, cache_key: str) -> Optional[List[MongoCluster]]:
+    try:
+        with open(cache_file_path(cache_dir, cache_key), 'r') as file:
+            data = json.load(file)
+        return [cluster_from_cache_data(cluster_data) for cluster_data in data]
+    except (OSError, ValueError, TypeError, IndexError):
+        # A missing or unreadable entry is just a cache miss
+        return None
+
+
+def store_cached_clusters(cache_dir: str, cache_key: str, clusters: List[MongoCluster]):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_file_path(cache_dir, cache_key)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    # The config holds passwords, so the cache entry is only readable by its owner
+    with open(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+        json.dump([cluster_to_cache_data(cluster) for cluster in clusters], file, separators=(',', ':'))
+    os.replace(temporary_path, path)
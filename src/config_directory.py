@@ -0,0 +1,64 @@
+import hashlib
+import json
+import os
+from typing import List, Dict, Optional
+
+# A config directory holds two kinds of files:
+#   <dir>/**/<name>.yml          one file per cluster, either a cluster mapping or a full {clusters: [...]} document
+#   <dir>/**/<cluster>/cluster.yml
+#   <dir>/**/<cluster>/<db>.yml  a cluster split into its connection settings and one file per database
+CLUSTER_FILE_NAME = "cluster.yml"
+YAML_EXTENSIONS = (".yml", ".yaml")
+
+
+class ConfigDirectoryLayout:
+    def __init__(self):
+        self.cluster_files = []  # Relative paths of self-contained cluster files
+        self.cluster_directories = {}  # Relative cluster directory -> relative paths of its database files
+
+
+def discover_config_files(path: str) -> ConfigDirectoryLayout:
+    layout = ConfigDirectoryLayout()
+    for directory, subdirectories, file_names in os.walk(path):
+        subdirectories[:] = sorted(subdirectory for subdirectory in subdirectories if not subdirectory.startswith("."))
+        relative_directory = os.path.relpath(directory, path)
+        yaml_files = sorted(os.path.normpath(os.path.join(relative_directory, file_name)) for file_name in file_names
+                            if file_name.endswith(YAML_EXTENSIONS) and not file_name.startswith("."))
+        if CLUSTER_FILE_NAME in file_names:
+            cluster_file = os.path.normpath(os.path.join(relative_directory, CLUSTER_FILE_NAME))
+            layout.cluster_directories[os.path.normpath(relative_directory)] = [
+                file for file in yaml_files if file != cluster_file]
+        else:
+            layout.cluster_files.extend(yaml_files)
+    return layout
+
+
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ManifestEntry:
+    def __init__(self, sha256: str, databases: Optional[List[str]] = None):
+        self.sha256 = sha256
+        self.databases = databases or []  # Databases defined by a database file, to scope its removal
+
+
+def load_manifest(manifest_path: str) -> Optional[Dict[str, ManifestEntry]]:
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as file:
+        data = json.load(file)
+    return {path: ManifestEntry(entry["sha256"], entry.get("databases")) for path, entry in data["files"].items()}
+
+
+def save_manifest(manifest_path: str, manifest: Dict[str, ManifestEntry]):
+    data = {"files": {path: {"sha256": entry.sha256, "databases": entry.databases}
+                      for path, entry in sorted(manifest.items())}}
+    temporary_path = f"{manifest_path}.tmp"
+    with open(temporary_path, 'w') as file:
+        json.dump(data, file, indent=2)
+    os.replace(temporary_path, manifest_path)
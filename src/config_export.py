@@ -0,0 +1,102 @@
+import logging
+import os
+import textwrap
+from typing import Iterable, Iterator, Optional, TextIO, Tuple
+
+import yaml
+
+from src.client_registry import get_cluster_client
+from src.cluster_to_data_model import SafeDumper, SYSTEM_DATABASES, cluster_settings_to_config, database_to_config, \
+    iter_mongo_databases, list_database_names
+from src.config_directory import CLUSTER_FILE_NAME, YAML_EXTENSIONS
+from src.config_to_mongo import iter_config_file
+from src.instrumentation import metrics
+from src.mongo_data_model import MongoCluster, MongoDatabase
+from src.namespace_filter import NamespaceFilter
+
+logger = logging.getLogger(__name__)
+
+# A cluster's settings together with its databases, which may be produced lazily by introspection
+ExportSource = Tuple[MongoCluster, Iterable[MongoDatabase]]
+
+
+def dump_yaml(data) -> str:
+    return yaml.dump(data, Dumper=SafeDumper, sort_keys=False)
+
+
+def database_file_name(db_name: str) -> str:
+    # Database names cannot contain dots, so this never collides with another database's file
+    return "cluster.db.yml" if f"{db_name}.yml" == CLUSTER_FILE_NAME else f"{db_name}.yml"
+
+
+def write_cluster_yaml(file: TextIO, cluster: MongoCluster, databases: Iterable[MongoDatabase],
+                       include_secrets: bool = True):
+    # Writes one item of the top-level 'clusters' sequence. Every database is turned into a config dict and dumped
+    # on its own, then indented into place, so only one database is held at a time.
+    file.write(dump_yaml([cluster_settings_to_config(cluster, include_secrets)]))
+    empty = True
+    for db in databases:
+        if empty:
+            file.write("  databases:\n")
+            empty = False
+        file.write(textwrap.indent(dump_yaml([database_to_config(db, include_secrets)]), "  "))
+    if empty:
+        file.write("  databases: []\n")
+
+
+def write_config_file(file_path: str, sources: Iterable[ExportSource], include_secrets: bool = True):
+    with open(file_path, 'w') as file:
+        empty = True
+        for cluster, databases in sources:
+            if empty:
+                file.write("clusters:\n")
+                empty = False
+            write_cluster_yaml(file, cluster, databases, include_secrets)
+        if empty:
+            file.write("clusters: []\n")
+
+
+def write_yaml_file(file_path: str, data):
+    with open(file_path, 'w') as file:
+        file.write(dump_yaml(data))
+
+
+def write_config_directory(path: str, sources: Iterable[ExportSource], include_secrets: bool = True):
+    # Writes the <cluster>/cluster.yml + <cluster>/<db>.yml layout read by config_directory
+    for cluster, databases in sources:
+        cluster_directory = os.path.join(path, cluster.name)
+        os.makedirs(cluster_directory, exist_ok=True)
+        write_yaml_file(os.path.join(cluster_directory, CLUSTER_FILE_NAME),
+                        cluster_settings_to_config(cluster, include_secrets))
+        written = {CLUSTER_FILE_NAME}
+        for db in databases:
+            file_name = database_file_name(db.name)
+            write_yaml_file(os.path.join(cluster_directory, file_name), database_to_config(db, include_secrets))
+            written.add(file_name)
+        stale = sorted(file_name for file_name in os.listdir(cluster_directory)
+                       if file_name.endswith(YAML_EXTENSIONS) and not file_name.startswith(".")
+                       and file_name not in written)
+        if stale:
+            logger.warning("%s: %s in %s were not written by this export but will be read as databases of the cluster",
+                           cluster.name, ", ".join(stale), cluster_directory, extra={"cluster": cluster.name})
+
+
+def iter_live_databases(cluster: MongoCluster, max_workers: Optional[int] = None) -> Iterator[MongoDatabase]:
+    namespace_filter = NamespaceFilter.from_rules(cluster.namespaces)
+    client = get_cluster_client(cluster, max_pool_size=max_workers)
+    db_names = sorted(db_name for db_name in list_database_names(client, namespace_filter=namespace_filter)
+                      if db_name not in SYSTEM_DATABASES)
+    return iter_mongo_databases(client, db_names, max_workers, namespace_filter)
+
+
+def export_clusters(config_file_path: str, output_path: str, split_databases: bool = False,
+                    include_secrets: bool = True, max_workers: Optional[int] = None):
+    # Snapshots the live state of every cluster in the config. Clusters are read from the config one at a time and
+    # databases are written as they are introspected, so memory stays bounded by the largest single database.
+    # Introspected users have no retrievable password; without include_secrets no password is written at all.
+    sources = ((cluster, metrics.timed_iter(iter_live_databases(cluster, max_workers), "export", cluster.name))
+               for cluster in iter_config_file(config_file_path))
+    if split_databases:
+        write_config_directory(output_path, sources, include_secrets)
+    else:
+        write_config_file(output_path, sources, include_secrets)
@@ -1,51 +1,226 @@
-from typing import List
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Iterator, Set
 
 import yaml
-from pymongo import MongoClient, errors
+from pymongo import errors
 from pymongo.database import Database
 
-from src.mongo_data_model import MongoUser, MongoCollection, MongoCluster
+from yaml.composer import Composer
+from yaml.constructor import SafeConstructor
+from yaml.events import DocumentStartEvent, MappingStartEvent, MappingEndEvent, SequenceStartEvent, SequenceEndEvent
+from yaml.resolver import Resolver
 
+try:
+    # libyaml's loader is many times faster than the pure-Python one
+    from yaml import CSafeLoader as SafeLoader
+    from yaml._yaml import CParser
+except ImportError:
+    from yaml import SafeLoader
+    CParser = None
 
-def parse_config_file(file_path: str) -> List[MongoCluster]:
-    with open(file_path, 'r') as file:
-        config = yaml.safe_load(file)
+from pydantic import SecretStr
 
+from src.client_registry import get_cluster_client
+from src.config_directory import discover_config_files, hash_file, ManifestEntry, CLUSTER_FILE_NAME
+from src.config_cache import config_cache_key, load_cached_clusters, store_cached_clusters
+from src.instrumentation import metrics
+from src.mongo_data_model import MongoUser, MongoCollection, MongoCluster, MongoDatabase, MongoIndex, \
+    MongoNamespaceRules
+
+logger = logging.getLogger(__name__)
+
+
+def cluster_from_config(cluster_config: Dict) -> MongoCluster:
     try:
-        clusters = []
-        for cluster_config in config['clusters']:
-            cluster = MongoCluster(
-                name=cluster_config['name'],
-                host=cluster_config['host'],
-                port=cluster_config['port'],
-                username=cluster_config['username'],
-                password=SecretStr(cluster_config['password']),
-                authentication_database=cluster_config['authentication_database'],
-                databases=[
-                    MongoDatabase(
-                        name=db['name'],
-                        users=[
-                            MongoUser(username=user['username'], password=SecretStr(user['password']), roles=user['roles'])
-                            for user in db.get('users', [])],
-                        collections=[
-                            MongoCollection(
-                                name=col['name'],
-                                indexes=[
-                                    MongoIndex(name=index['name'],
-                                               fields={field: order for d in index['fields'] for field, order in d.items()},
-                                               unique=index.get('unique', False))
-                                    for index in col.get('indexes', [])
-                                ]
-                            ) for col in db.get('collections', [])
-                        ]
-                    ) for db in cluster_config['databases']
-                ]
-            )
-            clusters.append(cluster)
-        return clusters
+        return MongoCluster(
+            name=cluster_config['name'],
+            host=cluster_config['host'],
+            port=cluster_config['port'],
+            username=cluster_config['username'],
+            # Exports made without secrets have no passwords
+            password=SecretStr(cluster_config.get('password', '')),
+            authentication_database=cluster_config['authentication_database'],
+            databases=[
+                MongoDatabase(
+                    name=db['name'],
+                    users=[
+                        MongoUser(username=user['username'], password=SecretStr(user.get('password', '')),
+                                  roles=user['roles'])
+                        for user in db.get('users', [])],
+                    collections=[
+                        MongoCollection(
+                            name=col['name'],
+                            indexes=[
+                                MongoIndex(name=index['name'],
+                                           fields={field: order for d in index['fields'] for field, order in d.items()},
+                                           unique=index.get('unique', False))
+                                for index in col.get('indexes', [])
+                            ]
+                        ) for col in db.get('collections', [])
+                    ]
+                ) for db in cluster_config['databases']
+            ],
+            namespaces=MongoNamespaceRules(**cluster_config['namespaces']) if cluster_config.get('namespaces') else None,
+            sharded=cluster_config.get('sharded', False)
+        )
     except KeyError as e:
         raise KeyError(f"Missing key {e} in config file")
 
+def parse_config(config: Dict) -> List[MongoCluster]:
+    try:
+        cluster_configs = config['clusters']
+    except (KeyError, TypeError) as e:
+        raise KeyError(f"Missing key {e} in config file")
+    return [cluster_from_config(cluster_config) for cluster_config in cluster_configs]
+
+def parse_config_file(file_path: str, cache_dir: Optional[str] = None) -> List[MongoCluster]:
+    # A directory is parsed file by file; see config_directory for its layout
+    if os.path.isdir(file_path):
+        return list(iter_config_directory(file_path))
+
+    with open(file_path, 'rb') as file:
+        content = file.read()
+
+    # With a cache_dir, an unchanged file is loaded from the cache without parsing YAML or validating models
+    if cache_dir:
+        cache_key = config_cache_key(content)
+        clusters = load_cached_clusters(cache_dir, cache_key)
+        if clusters is not None:
+            return clusters
+
+    clusters = parse_config(yaml.load(content, Loader=SafeLoader))
+    if cache_dir:
+        store_cached_clusters(cache_dir, cache_key, clusters)
+    return clusters
+
+if CParser is not None:
+    class StreamingConfigLoader(CParser, Composer, SafeConstructor, Resolver):
+        # Events come from libyaml; composing and constructing one node at a time needs the Python Composer
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            Composer.__init__(self)
+            SafeConstructor.__init__(self)
+            Resolver.__init__(self)
+else:
+    StreamingConfigLoader = SafeLoader
+
+def iter_config_file(file_path: str) -> Iterator[MongoCluster]:
+    # Yields the clusters of the top-level 'clusters' sequence one at a time, so only one cluster's YAML
+    # nodes and models are held in memory at once
+    if os.path.isdir(file_path):
+        yield from iter_config_directory(file_path)
+        return
+    with open(file_path, 'rb') as file:
+        loader = StreamingConfigLoader(file)
+        try:
+            loader.get_event()  # StreamStartEvent
+            if not loader.check_event(DocumentStartEvent):
+                raise KeyError("Missing key 'clusters' in config file")
+            loader.get_event()
+            if not loader.check_event(MappingStartEvent):
+                raise KeyError("Missing key 'clusters' in config file")
+            loader.get_event()
+
+            found = False
+            while not loader.check_event(MappingEndEvent):
+                key = loader.construct_document(loader.compose_node(None, None))
+                if key != 'clusters':
+                    loader.compose_node(None, None)  # Skip the value of any other top-level key
+                    continue
+                found = True
+                if not loader.check_event(SequenceStartEvent):
+                    for cluster_config in loader.construct_document(loader.compose_node(None, None)) or []:
+                        yield cluster_from_config(cluster_config)
+                    continue
+                loader.get_event()
+                while not loader.check_event(SequenceEndEvent):
+                    yield cluster_from_config(loader.construct_document(loader.compose_node(None, None)))
+                loader.get_event()
+            if not found:
+                raise KeyError("Missing key 'clusters' in config file")
+        finally:
+            loader.dispose()
+
+def load_yaml_file(file_path: str):
+    with open(file_path, 'rb') as file:
+        return yaml.load(file, Loader=SafeLoader)
+
+class ConfigChange:
+    def __init__(self, cluster: MongoCluster, database_scope: Optional[Set[str]] = None):
+        self.cluster = cluster
+        # None means the whole cluster is in scope; otherwise only these databases changed, and any of them
+        # missing from the cluster were removed from the config
+        self.database_scope = database_scope
+
+class ConfigDirectoryLoader:
+    # Yields a ConfigChange for every cluster with a file that differs from previous_manifest (all of them
+    # without one) and parses only those files. The manifest of the current tree is built while iterating.
+    def __init__(self, path: str, previous_manifest: Optional[Dict[str, ManifestEntry]] = None):
+        self.path = path
+        self.previous_manifest = previous_manifest
+        self.manifest = {}
+
+    def hash(self, relative_path: str) -> ManifestEntry:
+        self.manifest[relative_path] = ManifestEntry(hash_file(os.path.join(self.path, relative_path)))
+        return self.manifest[relative_path]
+
+    def is_changed(self, relative_path: str) -> bool:
+        if self.previous_manifest is None or relative_path not in self.previous_manifest:
+            return True
+        return self.previous_manifest[relative_path].sha256 != self.manifest[relative_path].sha256
+
+    def changes(self) -> Iterator[ConfigChange]:
+        layout = discover_config_files(self.path)
+        for relative_path in layout.cluster_files:
+            self.hash(relative_path)
+            if not self.is_changed(relative_path):
+                continue
+            document = load_yaml_file(os.path.join(self.path, relative_path))
+            for cluster_config in document['clusters'] if 'clusters' in document else [document]:
+                yield ConfigChange(cluster_from_config(cluster_config))
+
+        for directory, database_files in layout.cluster_directories.items():
+            cluster_file = os.path.normpath(os.path.join(directory, CLUSTER_FILE_NAME))
+            self.hash(cluster_file)
+            full = self.is_changed(cluster_file)
+
+            database_configs = []
+            database_scope = set()
+            for relative_path in database_files:
+                entry = self.hash(relative_path)
+                if not full and not self.is_changed(relative_path):
+                    entry.databases = self.previous_manifest[relative_path].databases
+                    continue
+                document = load_yaml_file(os.path.join(self.path, relative_path))
+                configs = document['databases'] if 'databases' in document else [document]
+                entry.databases = [db['name'] for db in configs]
+                database_configs.extend(configs)
+                database_scope.update(entry.databases)
+
+            if not full:
+                # What changed or deleted files used to define is in scope too, so pruning can drop it
+                for relative_path, entry in self.previous_manifest.items():
+                    if os.path.normpath(os.path.dirname(relative_path) or ".") == directory \
+                            and relative_path != cluster_file and self.is_changed_or_removed(relative_path):
+                        database_scope.update(entry.databases)
+                if not database_scope:
+                    continue
+
+            cluster_config = dict(load_yaml_file(os.path.join(self.path, cluster_file)))
+            if full:
+                database_configs = list(cluster_config.get('databases') or []) + database_configs
+            cluster_config['databases'] = database_configs
+            yield ConfigChange(cluster_from_config(cluster_config), None if full else database_scope)
+
+    def is_changed_or_removed(self, relative_path: str) -> bool:
+        return relative_path not in self.manifest or self.is_changed(relative_path)
+
+def iter_config_directory(path: str) -> Iterator[MongoCluster]:
+    for change in ConfigDirectoryLoader(path).changes():
+        yield change.cluster
+
 def create_users(db: Database, users: List[MongoUser]):
     for user in users:
         try:
@@ -53,35 +228,64 @@ def create_users(db: Database, users: List[MongoUser]):
                 "createUser",
                 user.username,
                 pwd=user.password.get_secret_value(),
-                roles=[{"role": role, "db": db.name} for role in user.roles]
+                roles=user.role_documents(db.name)
             )
         except errors.OperationFailure as e:
-            print(f"Error creating user {user.username}: {e}")
-
-def create_collections(db: Database, collections: List[MongoCollection]):
-    for collection in collections:
-        coll = db[collection.name]
-        for index in collection.indexes:
-            try:
-                coll.create_index([(field, order) for field, order in index.fields.items()], name=index.name, unique=index.unique)
-            except errors.OperationFailure as e:
-                print(f"Error creating index {index.name} in collection {collection.name}: {e}")
-
-def setup_cluster(cluster: MongoCluster):
-    client = MongoClient(
-        host=cluster.host,
-        port=cluster.port,
-        username=cluster.username,
-        password=cluster.password.get_secret_value(),
-        authSource=cluster.authentication_database
-    )
+            logger.error("Error creating user %s: %s", user.username, e,
+                         extra={"database": db.name, "user": user.username})
+
+class IndexCreationError:
+    def __init__(self, database: str, collection: str, index: str, message: str):
+        self.database = database
+        self.collection = collection
+        self.index = index
+        self.message = message
+
+    def __repr__(self):
+        return f"IndexCreationError({self.database}.{self.collection}, {self.index}: {self.message})"
+
+
+def index_to_spec(index: MongoIndex) -> Dict:
+    spec = {"key": dict(index.fields), "name": index.name}
+    if index.unique:
+        spec["unique"] = True
+    return spec
+
+
+def create_indexes(db: Database, collection_name: str, indexes: List[MongoIndex],
+                   **command_options) -> List[IndexCreationError]:
+    if not indexes:
+        return []
+    try:
+        # Indexes that already exist with the same definition are a no-op for the server
+        db.command("createIndexes", collection_name, indexes=[index_to_spec(index) for index in indexes],
+                   **command_options)
+        return []
+    except errors.OperationFailure as e:
+        if len(indexes) == 1:
+            return [IndexCreationError(db.name, collection_name, indexes[0].name, str(e))]
+    # The batch fails as a whole, so retry one index at a time to attribute the failure to specific indexes
+    return [error for index in indexes for error in create_indexes(db, collection_name, [index], **command_options)]
+
+
+def setup_cluster(cluster: MongoCluster, max_workers: Optional[int] = None) -> List[IndexCreationError]:
+    client = get_cluster_client(cluster, max_pool_size=max_workers)
 
     for db_config in cluster.databases:
-        db = client[db_config.name]
-        create_users(db, db_config.users)
-        create_collections(db, db_config.collections)
-
-def sync_config_file_to_db(config_file_path):
-    clusters = parse_config_file(config_file_path)
-    for cluster in clusters:
-        setup_cluster(cluster)
+        create_users(client[db_config.name], db_config.users)
+
+    # One pool across every database so the concurrency limit holds for the whole cluster
+    with ThreadPoolExecutor(max_workers=max_workers or 1) as executor:
+        results = executor.map(
+            lambda namespace: create_indexes(client[namespace[0]], namespace[1].name, namespace[1].indexes),
+            [(db_config.name, collection) for db_config in cluster.databases for collection in db_config.collections]
+        )
+        return [error for collection_errors in results for error in collection_errors]
+
+def sync_config_file_to_db(config_file_path, max_workers: Optional[int] = None) -> Dict[str, List[IndexCreationError]]:
+    # Clusters are parsed lazily, so each one is released before the next is read
+    results = {}
+    for cluster in metrics.timed_iter(iter_config_file(config_file_path), "parse_config"):
+        with metrics.phase("apply", cluster.name):
+            results[cluster.name] = setup_cluster(cluster, max_workers)
+    return results
@@ -1,11 +1,15 @@
-from typing import List
+from collections import defaultdict
+from typing import List, Optional, Iterable
 
-from src.mongo_data_model import MongoDatabase, MongoUser, MongoCluster
+from src.mongo_data_model import MongoDatabase, MongoUser, MongoCluster, MongoCollection
+from src.namespace_filter import NamespaceFilter
 
 class IndexDiff:
     def __init__(self):
         self.added = []
         self.removed = []
+        self.renamed = []  # (old, new) pairs with the same key pattern, only the name differs
+        self.rebuilt = []  # (old, new) pairs with the same name but a different key pattern
 
 class CollectionDiff:
     def __init__(self):
@@ -31,68 +35,178 @@ class DatabaseDiff:
         self.changed = {}
         self.users_diff = {}
 
+class ShardIndexInconsistency:
+    def __init__(self, database: str, collection: str, index: Optional[str], missing_shards: List[str],
+                 definitions: dict, unreadable_shards: Optional[List[str]] = None):
+        self.database = database
+        self.collection = collection
+        self.index = index  # None when the inconsistency is about unreadable shards
+        self.missing_shards = missing_shards  # Shards owning chunks of the collection that lack the index
+        self.definitions = definitions  # Key pattern -> shards defining the index that way, when they disagree
+        self.unreadable_shards = unreadable_shards or []  # Shards whose indexes could not be read at all
+
+    def describe(self) -> str:
+        if self.unreadable_shards:
+            return f"indexes of {self.database}.{self.collection} are unreadable on {', '.join(self.unreadable_shards)}"
+        problems = []
+        if self.missing_shards:
+            problems.append(f"missing on {', '.join(self.missing_shards)}")
+        if self.definitions:
+            problems.append("defined differently: " + "; ".join(
+                f"{', '.join(shards)} {dict(key_pattern[0])}{' unique' if key_pattern[1] else ''}"
+                for key_pattern, shards in self.definitions.items()))
+        return f"index {self.index} on {self.database}.{self.collection} is {' and '.join(problems)}"
+
+    def __repr__(self):
+        return f"ShardIndexInconsistency({self.describe()})"
+
 class ClusterDiff:
     def __init__(self):
         self.databases = DatabaseDiff()
+        # Found in the first cluster of the comparison, the live one, when it was read with shard_indexes
+        self.shard_inconsistencies = []
+
+# Every comparison below looks items up in name-keyed dicts and skips pairs whose fingerprints match,
+# so a diff costs O(n) in the number of objects and O(1) for every identical subtree.
+
+def role_keys(user: MongoUser, db_name: Optional[str]) -> List[tuple]:
+    # Roles are compared as exact {role, db} pairs, plain names resolving to the user's database
+    return [(role["role"], role["db"]) for role in user.role_documents(db_name)]
 
-def generate_user_diff(user_list_control: List[MongoUser], user_list_test: List[MongoUser]) -> UserDiff:
+def generate_user_diff(user_list_control: List[MongoUser], user_list_test: List[MongoUser],
+                       db_name: Optional[str] = None) -> UserDiff:
     diff = UserDiff()
-    user_names_control = set(user.username for user in user_list_control)
-    user_names_test = set(user.username for user in user_list_test)
-    diff.added = [user for user in user_list_test if user.username not in user_names_control]
-    diff.removed = [user for user in user_list_control if user.username not in user_names_test]
+    users_control = {user.username: user for user in user_list_control}
+    users_test = {user.username: user for user in user_list_test}
+    diff.added = [user for user in user_list_test if user.username not in users_control]
+    diff.removed = [user for user in user_list_control if user.username not in users_test]
     for user in user_list_control:
-        if user.username in user_names_test:
-            user_test = next(user_test for user_test in user_list_test if user_test.username == user.username)
-            roles_diff = RolesDiff()
-            roles_diff.added = [role for role in user_test.roles if role not in user.roles]
-            roles_diff.removed = [role for role in user.roles if role not in user_test.roles]
-            if roles_diff.added or roles_diff.removed:
-                diff.changed[user.username] = roles_diff
+        user_test = users_test.get(user.username)
+        if user_test is None or user_test.fingerprint == user.fingerprint:
+            continue
+        keys_control = role_keys(user, db_name)
+        keys_test = role_keys(user_test, db_name)
+        keys_control_set = set(keys_control)
+        keys_test_set = set(keys_test)
+        roles_diff = RolesDiff()
+        roles_diff.added = [role for role, key in zip(user_test.roles, keys_test) if key not in keys_control_set]
+        roles_diff.removed = [role for role, key in zip(user.roles, keys_control) if key not in keys_test_set]
+        if roles_diff.added or roles_diff.removed:
+            diff.changed[user.username] = roles_diff
     return diff
 
+def generate_index_diff(coll1: MongoCollection, coll2: MongoCollection) -> IndexDiff:
+    index_diff = IndexDiff()
+    indexes1 = {idx.name: idx for idx in coll1.indexes}
+    indexes2 = {idx.name: idx for idx in coll2.indexes}
+    for idx2 in coll2.indexes:
+        idx1 = indexes1.get(idx2.name)
+        if idx1 is not None and idx1.key_pattern != idx2.key_pattern:
+            index_diff.rebuilt.append((idx1, idx2))
+
+    # Indexes without a same-named counterpart are matched on their key pattern before counting as added or removed
+    unmatched1 = {}
+    for idx1 in coll1.indexes:
+        if idx1.name not in indexes2:
+            unmatched1.setdefault(idx1.key_pattern, []).append(idx1)
+    for idx2 in coll2.indexes:
+        if idx2.name in indexes1:
+            continue
+        candidates = unmatched1.get(idx2.key_pattern)
+        if candidates:
+            index_diff.renamed.append((candidates.pop(0), idx2))
+        else:
+            index_diff.added.append(idx2)
+    remaining = set(id(idx) for candidates in unmatched1.values() for idx in candidates)
+    index_diff.removed = [idx for idx in coll1.indexes if id(idx) in remaining]
+    return index_diff
+
 def generate_collection_diff(db1: MongoDatabase, db2: MongoDatabase) -> CollectionDiff:
     collection_diff = CollectionDiff()
 
     # Compare collections
-    coll_names1 = set(coll.name for coll in db1.collections)
-    coll_names2 = set(coll.name for coll in db2.collections)
-    collection_diff.added = [coll for coll in db2.collections if coll.name not in coll_names1]
-    collection_diff.removed = [coll for coll in db1.collections if coll.name not in coll_names2]
+    colls1 = {coll.name: coll for coll in db1.collections}
+    colls2 = {coll.name: coll for coll in db2.collections}
+    collection_diff.added = [coll for coll in db2.collections if coll.name not in colls1]
+    collection_diff.removed = [coll for coll in db1.collections if coll.name not in colls2]
 
     # Compare indexes for matching collection
     for coll1 in db1.collections:
-        if coll1.name in coll_names2:
-            coll2 = next(coll for coll in db2.collections if coll.name == coll1.name)
-            index_diff = IndexDiff()
-            index_names1 = set(idx.name for idx in coll1.indexes)
-            index_names2 = set(idx.name for idx in coll2.indexes)
-            index_diff.added = [idx for idx in coll2.indexes if idx.name not in index_names1]
-            index_diff.removed = [idx for idx in coll1.indexes if idx.name not in index_names2]
-            if index_diff.added or index_diff.removed:
-                collection_diff.changed[coll1.name] = index_diff
+        coll2 = colls2.get(coll1.name)
+        if coll2 is None or coll2.fingerprint == coll1.fingerprint:
+            continue
+        index_diff = generate_index_diff(coll1, coll2)
+        if index_diff.added or index_diff.removed or index_diff.renamed or index_diff.rebuilt:
+            collection_diff.changed[coll1.name] = index_diff
 
     return collection_diff
 
 
-def generate_cluster_diff(cluster1: MongoCluster, cluster2: MongoCluster) -> ClusterDiff:
+def filter_database(db: MongoDatabase, namespace_filter: NamespaceFilter) -> MongoDatabase:
+    # Only a database that actually loses collections is rebuilt, so the others keep their cached fingerprints.
+    # It is rebuilt as the same class, which may be a compact_model one.
+    collections = [coll for coll in db.collections if namespace_filter.includes_collection(db.name, coll.name)]
+    if len(collections) == len(db.collections):
+        return db
+    return type(db)(name=db.name, collections=collections, users=db.users)
+
+
+def find_shard_inconsistencies(databases: Iterable[MongoDatabase]) -> List[ShardIndexInconsistency]:
+    # Shards are only compared with each other: an index the config lacks is the regular diff's business
+    inconsistencies = []
+    for db in databases:
+        for coll in db.collections:
+            if not coll.shard_indexes:
+                continue
+            # Shards that could not be read are reported as such and left out of the comparison
+            shard_indexes = {shard: indexes for shard, indexes in coll.shard_indexes.items() if indexes is not None}
+            unreadable = sorted(shard for shard in coll.shard_indexes if shard not in shard_indexes)
+            if unreadable:
+                inconsistencies.append(ShardIndexInconsistency(db.name, coll.name, None, [], {}, unreadable))
+            definitions = defaultdict(lambda: defaultdict(list))  # Index name -> key pattern -> shards
+            for shard, indexes in sorted(shard_indexes.items()):
+                for idx in indexes:
+                    definitions[idx.name][idx.key_pattern].append(shard)
+            for name, key_patterns in sorted(definitions.items()):
+                present = set(shard for shards in key_patterns.values() for shard in shards)
+                missing = sorted(shard for shard in shard_indexes if shard not in present)
+                if missing or len(key_patterns) > 1:
+                    inconsistencies.append(ShardIndexInconsistency(
+                        db.name, coll.name, name, missing, dict(key_patterns) if len(key_patterns) > 1 else {}))
+    return inconsistencies
+
+
+# With a namespace_filter, databases and collections it excludes are left out on both sides, as if neither
+# cluster had them.
+def generate_cluster_diff(cluster1: MongoCluster, cluster2: MongoCluster,
+                          namespace_filter: Optional[NamespaceFilter] = None) -> ClusterDiff:
     diff = ClusterDiff()
+    databases1 = cluster1.databases
+    databases2 = cluster2.databases
+    if namespace_filter:
+        databases1 = [filter_database(db, namespace_filter) for db in databases1
+                      if namespace_filter.includes_database(db.name)]
+        databases2 = [filter_database(db, namespace_filter) for db in databases2
+                      if namespace_filter.includes_database(db.name)]
 
     # Compare databases
-    db_names1 = set(db.name for db in cluster1.databases)
-    db_names2 = set(db.name for db in cluster2.databases)
+    dbs1 = {db.name: db for db in databases1}
+    dbs2 = {db.name: db for db in databases2}
 
-    diff.databases.added = [db for db in cluster2.databases if db.name not in db_names1]
-    diff.databases.removed = [db for db in cluster1.databases if db.name not in db_names2]
+    diff.databases.added = [db for db in databases2 if db.name not in dbs1]
+    diff.databases.removed = [db for db in databases1 if db.name not in dbs2]
 
     # Compare collections, indexes, and users within each database
-    for db1 in cluster1.databases:
-        if db1.name in db_names2:
-            db2 = next(db for db in cluster2.databases if db.name == db1.name)
-            collection_diff = generate_collection_diff(db1, db2)
-            user_diff = generate_user_diff(db1.users, db2.users)
-            if collection_diff.added or collection_diff.removed or collection_diff.changed:
-                diff.databases.changed[db1.name] = collection_diff
-            if user_diff.added or user_diff.removed or user_diff.changed:
-                diff.databases.users_diff[db1.name] = user_diff
-    return diff
\ No newline at end of file
+    for db1 in databases1:
+        db2 = dbs2.get(db1.name)
+        if db2 is None or db2.fingerprint == db1.fingerprint:
+            continue
+        collection_diff = generate_collection_diff(db1, db2)
+        user_diff = generate_user_diff(db1.users, db2.users, db1.name)
+        if collection_diff.added or collection_diff.removed or collection_diff.changed:
+            diff.databases.changed[db1.name] = collection_diff
+        if user_diff.added or user_diff.removed or user_diff.changed:
+            diff.databases.users_diff[db1.name] = user_diff
+    if cluster1.sharded:
+        diff.shard_inconsistencies = find_shard_inconsistencies(databases1)
+    return diff
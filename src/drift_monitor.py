@@ -0,0 +1,185 @@
+import heapq
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, Set, Tuple, TextIO
+
+from pymongo import MongoClient, errors
+from pymongo.database import Database
+
+from src.client_registry import get_cluster_client
+from src.cluster_to_data_model import mongo_to_compact_datamodel, list_database_names, get_all_mongo_users, \
+    SYSTEM_DATABASES
+from src.diff_utils import generate_cluster_diff
+from src.mongo_data_model import MongoCluster, MongoUser, content_hash
+from src.namespace_filter import NamespaceFilter, merge_filters
+from src.plan_apply import Operation, generate_plan
+
+logger = logging.getLogger(__name__)
+
+
+class DriftEvent:
+    def __init__(self, cluster: str, database: Optional[str], kind: str, detail: str,
+                 collection: Optional[str] = None, target: Optional[str] = None):
+        self.cluster = cluster
+        self.database = database
+        # An operation kind from plan_apply that would undo the drift, "shard_inconsistency", "in_sync" or "error"
+        self.kind = kind
+        self.detail = detail
+        self.collection = collection
+        self.target = target
+        self.time = datetime.now(timezone.utc)
+
+    def to_json(self) -> str:
+        return json.dumps({"time": self.time.isoformat(), "cluster": self.cluster, "database": self.database,
+                           "collection": self.collection, "kind": self.kind, "target": self.target,
+                           "detail": self.detail})
+
+
+def operation_to_drift_event(cluster_name: str, operation: Operation) -> DriftEvent:
+    return DriftEvent(cluster_name, operation.database, operation.kind, operation.describe(),
+                      operation.collection, operation.target)
+
+
+def get_database_fingerprint(db: Database, users: List[MongoUser],
+                             namespace_filter: Optional[NamespaceFilter] = None) -> int:
+    # Cheap stand-in for the database's full fingerprint: one listCollections and one dbStats, no listIndexes.
+    # A catalog UUID changes when a collection is dropped and recreated, the index count when indexes come and go.
+    # dbStats counts the indexes of excluded collections too, so a change there only costs a needless diff.
+    query = merge_filters({'type': 'collection'},
+                          namespace_filter.collection_filter(db.name) if namespace_filter else {})
+    collections = sorted((info['name'], info.get('info', {}).get('uuid'))
+                         for info in db.list_collections(filter=query)
+                         if not info['name'].startswith('system.') and
+                         (namespace_filter is None or namespace_filter.includes_collection(db.name, info['name'])))
+    index_count = db.command("dbStats").get("indexes", 0)
+    return content_hash(tuple(collections), index_count, tuple(sorted(user.fingerprint for user in users)))
+
+
+def get_cluster_fingerprints(client: MongoClient, namespace_filter: Optional[NamespaceFilter] = None) -> Dict[str, int]:
+    users = get_all_mongo_users(client)
+    return {db_name: get_database_fingerprint(client[db_name], users[db_name], namespace_filter)
+            for db_name in list_database_names(client, namespace_filter=namespace_filter)
+            if db_name not in SYSTEM_DATABASES}
+
+
+def changed_databases(previous: Dict[str, int], current: Dict[str, int]) -> Set[str]:
+    return set(db_name for db_name in set(previous) | set(current) if previous.get(db_name) != current.get(db_name))
+
+
+def detect_drift(cluster: MongoCluster, client: MongoClient,
+                 previous: Optional[Dict[str, int]] = None) -> Tuple[Dict[str, int], List[DriftEvent]]:
+    # Without previous fingerprints the whole cluster is compared once to establish a baseline. Afterwards only
+    # databases whose fingerprint moved are introspected and diffed, and each of them reports drift or "in_sync".
+    # Fingerprints are taken before introspecting, so a change racing the introspection shows up next cycle.
+    namespace_filter = NamespaceFilter.from_rules(cluster.namespaces)
+    fingerprints = get_cluster_fingerprints(client, namespace_filter)
+    database_scope = None if previous is None else changed_databases(previous, fingerprints)
+    if database_scope is not None and not database_scope:
+        return fingerprints, []
+
+    live_cluster = mongo_to_compact_datamodel(cluster.name, cluster.host, cluster.port, cluster.username,
+                                              cluster.password.get_secret_value(), cluster.authentication_database,
+                                              databases=database_scope, namespace_filter=namespace_filter,
+                                              sharded=cluster.sharded)
+    desired_cluster = cluster if database_scope is None else MongoCluster(
+        name=cluster.name,
+        host=cluster.host,
+        port=cluster.port,
+        username=cluster.username,
+        password=cluster.password,
+        authentication_database=cluster.authentication_database,
+        databases=[db for db in cluster.databases if db.name in database_scope]
+    )
+    diff = generate_cluster_diff(live_cluster, desired_cluster, namespace_filter)
+    plan = generate_plan(diff, prune=True)
+    events = [operation_to_drift_event(cluster.name, operation) for operation in plan]
+    events.extend(DriftEvent(cluster.name, inconsistency.database, "shard_inconsistency", inconsistency.describe(),
+                             inconsistency.collection, inconsistency.index)
+                  for inconsistency in diff.shard_inconsistencies)
+    if database_scope is not None:
+        drifted = set(operation.database for operation in plan)
+        events.extend(DriftEvent(cluster.name, db_name, "in_sync", "matches the config")
+                      for db_name in sorted(database_scope - drifted))
+    return fingerprints, events
+
+
+def next_poll_delay(interval: float, jitter: float, rng: random.Random) -> float:
+    # Spreads polls of many clusters over time instead of letting them fall into lockstep
+    return interval * (1 + rng.uniform(-jitter, jitter))
+
+
+class MonitoredCluster:
+    def __init__(self, cluster: MongoCluster, due: float):
+        self.cluster = cluster
+        self.due = due
+        self.fingerprints = None
+
+    def __lt__(self, other):
+        return self.due < other.due
+
+
+class DriftMonitor:
+    # Polls every cluster about once per interval from a small thread pool. The first poll of each cluster is
+    # spread at random over the first interval, and every later one is jittered, so hundreds of clusters never
+    # poll together. Drift events are written to output as JSON lines.
+    def __init__(self, clusters: List[MongoCluster], interval: float = 300.0, jitter: float = 0.2,
+                 max_workers: int = 8, output: TextIO = sys.stdout, rng: Optional[random.Random] = None):
+        self.interval = interval
+        self.jitter = jitter
+        self.max_workers = max_workers
+        self.output = output
+        self.rng = rng or random.Random()
+        now = time.monotonic()
+        self.queue = [MonitoredCluster(cluster, now + self.rng.uniform(0, interval)) for cluster in clusters]
+        heapq.heapify(self.queue)
+        self.condition = threading.Condition()
+        self.output_lock = threading.Lock()
+
+    def emit(self, events: List[DriftEvent]):
+        with self.output_lock:
+            for event in events:
+                self.output.write(event.to_json() + "\n")
+            self.output.flush()
+
+    def poll(self, monitored: MonitoredCluster):
+        # The cluster goes back into the queue whatever happens; an exception escaping here would vanish into the
+        # poll's future and silently stop the cluster from being monitored
+        try:
+            monitored.fingerprints, events = detect_drift(monitored.cluster, get_cluster_client(monitored.cluster),
+                                                          monitored.fingerprints)
+        except errors.PyMongoError as e:
+            # The previous fingerprints are kept, so whatever changed meanwhile is still caught by the next poll
+            events = [DriftEvent(monitored.cluster.name, None, "error", str(e))]
+        except Exception as e:
+            logger.exception("Polling %s failed", monitored.cluster.name, extra={"cluster": monitored.cluster.name})
+            events = [DriftEvent(monitored.cluster.name, None, "error", f"{type(e).__name__}: {e}")]
+        try:
+            self.emit(events)
+        finally:
+            with self.condition:
+                monitored.due = time.monotonic() + next_poll_delay(self.interval, self.jitter, self.rng)
+                heapq.heappush(self.queue, monitored)
+                self.condition.notify()
+
+    def run(self, duration: Optional[float] = None):
+        # A cluster is back in the queue only once its poll finished, so slow clusters never overlap themselves
+        deadline = time.monotonic() + duration if duration is not None else None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                with self.condition:
+                    now = time.monotonic()
+                    if deadline is not None and now >= deadline:
+                        return
+                    if not self.queue or self.queue[0].due > now:
+                        wake_at = min(self.queue[0].due if self.queue else float("inf"),
+                                      deadline if deadline is not None else float("inf"))
+                        self.condition.wait(None if wake_at == float("inf") else wake_at - now)
+                        continue
+                    monitored = heapq.heappop(self.queue)
+                executor.submit(self.poll, monitored)
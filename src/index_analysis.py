@@ -0,0 +1,173 @@
+import logging
+from datetime import datetime, timezone
+from typing import List, Dict, Iterable, Optional
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+
+from src.client_registry import get_cluster_client
+from src.cluster_to_data_model import mongo_to_datamodel, datamodel_to_config, config_json_to_yml_file
+from src.config_to_mongo import parse_config_file
+from src.mongo_data_model import MongoCluster, MongoDatabase, MongoCollection, MongoIndex
+from src.namespace_filter import NamespaceFilter
+
+logger = logging.getLogger(__name__)
+
+
+class IndexUsage:
+    def __init__(self, ops: int, since: Optional[datetime]):
+        self.ops = ops
+        self.since = since  # When the server started counting; counters reset on restart and index rebuild
+
+
+class IndexFinding:
+    def __init__(self, database: str, collection: str, index: MongoIndex, reason: str, detail: str):
+        self.database = database
+        self.collection = collection
+        self.index = index
+        self.reason = reason  # "unused" or "redundant"
+        self.detail = detail
+
+    def __repr__(self):
+        return f"{self.database}.{self.collection} {self.index.name}: {self.reason} ({self.detail})"
+
+
+def get_index_usage(collection: Collection) -> Dict[str, IndexUsage]:
+    usage = {}
+    for stats in collection.aggregate([{"$indexStats": {}}]):
+        # On sharded clusters every shard reports its own counters for the same index
+        current = usage.get(stats["name"])
+        ops = stats["accesses"]["ops"]
+        since = stats["accesses"].get("since")
+        if current is None:
+            usage[stats["name"]] = IndexUsage(ops, since)
+        else:
+            current.ops += ops
+            current.since = max(current.since, since) if current.since and since else current.since or since
+    return usage
+
+
+def parse_timestamp(value: str) -> datetime:
+    # $indexStats times come back from the driver as naive UTC datetimes, so an offset given here is converted
+    # to UTC and dropped for the two to be comparable; a time without one is taken as UTC already
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def find_redundant_indexes(collection: MongoCollection, removed: Iterable[MongoIndex] = ()) -> List[tuple]:
+    # An index is redundant when its ordered key pattern is a prefix of another index on the same collection,
+    # since the longer index can serve the same queries. Of indexes with the same key pattern under different
+    # names, a unique one or else the first one is kept. Unique indexes enforce a constraint and are always kept.
+    # Only an index that stays can cover another, so none of the removed ones counts as covering.
+    removed_names = set(index.name for index in removed)
+    redundant = []
+    for position, index in enumerate(collection.indexes):
+        if index.unique:
+            continue
+        fields = list(index.fields.items())
+        for other_position, other in enumerate(collection.indexes):
+            other_fields = list(other.fields.items())
+            if other is index or other.name in removed_names or other_fields[:len(fields)] != fields:
+                continue
+            if len(other_fields) > len(fields) or other.unique or other_position < position:
+                redundant.append((index, other))
+                break
+    return redundant
+
+
+def find_unused_indexes(collection: MongoCollection, usage: Dict[str, IndexUsage],
+                        unused_since: Optional[datetime] = None) -> List[MongoIndex]:
+    # Zero accesses only prove anything when the counters cover the whole window asked about. Unique indexes
+    # enforce a constraint whether or not queries use them, so they are never unused.
+    unused = []
+    for index in collection.indexes:
+        index_usage = usage.get(index.name)
+        if index.unique or index_usage is None or index_usage.ops:
+            continue
+        if unused_since is None or (index_usage.since is not None and index_usage.since <= unused_since):
+            unused.append(index)
+    return unused
+
+
+def analyze_collection(db_name: str, collection: MongoCollection, usage: Dict[str, IndexUsage],
+                       unused_since: Optional[datetime] = None) -> List[IndexFinding]:
+    findings = []
+    unused = find_unused_indexes(collection, usage, unused_since)
+    for index in unused:
+        since = usage[index.name].since
+        findings.append(IndexFinding(db_name, collection.name, index, "unused",
+                                     f"no accesses since {since.isoformat() if since else 'counters started'}"))
+    # Every finding is removed from --output-config, so an unused index cannot be what makes another redundant
+    for index, covering in find_redundant_indexes(collection, removed=unused):
+        relation = "the same as" if len(covering.fields) == len(index.fields) else "a prefix of"
+        findings.append(IndexFinding(db_name, collection.name, index, "redundant",
+                                     f"key pattern is {relation} {covering.name}"))
+    return findings
+
+
+def analyze_cluster(client: MongoClient, cluster: MongoCluster,
+                    unused_since: Optional[datetime] = None) -> List[IndexFinding]:
+    findings = []
+    for db in cluster.databases:
+        for collection in db.collections:
+            usage = get_index_usage(client[db.name][collection.name])
+            findings.extend(analyze_collection(db.name, collection, usage, unused_since))
+    return findings
+
+
+def format_findings(cluster: MongoCluster, findings: List[IndexFinding]) -> str:
+    if not findings:
+        return f"{cluster.name}: no unused or redundant indexes"
+    return "\n".join([f"{cluster.name}: {len(findings)} finding(s)"] + [f"  {finding}" for finding in findings])
+
+
+def remove_flagged_indexes(cluster: MongoCluster, findings: List[IndexFinding],
+                           config_cluster: Optional[MongoCluster] = None) -> MongoCluster:
+    # New models are built rather than copied so that no cached fingerprint outlives the removed indexes.
+    # A live snapshot has neither namespace rules nor the sharded flag, those are taken from config_cluster if given.
+    flagged = set((finding.database, finding.collection, finding.index.name) for finding in findings)
+    settings = config_cluster or cluster
+    return MongoCluster(
+        name=cluster.name,
+        host=cluster.host,
+        port=cluster.port,
+        username=cluster.username,
+        password=cluster.password,
+        authentication_database=cluster.authentication_database,
+        databases=[
+            MongoDatabase(
+                name=db.name,
+                users=db.users,
+                collections=[
+                    MongoCollection(
+                        name=collection.name,
+                        indexes=[index for index in collection.indexes
+                                 if (db.name, collection.name, index.name) not in flagged]
+                    ) for collection in db.collections
+                ]
+            ) for db in cluster.databases
+        ],
+        namespaces=settings.namespaces,
+        sharded=settings.sharded
+    )
+
+
+def analyze_config_file(config_file_path: str, unused_since: Optional[datetime] = None,
+                        output_config_path: Optional[str] = None) -> Dict[str, List[IndexFinding]]:
+    # The written config describes the live clusters minus the flagged indexes, so syncing it with prune drops them
+    results = {}
+    cleaned_clusters = []
+    for cluster in parse_config_file(config_file_path):
+        live_cluster = mongo_to_datamodel(cluster.name, cluster.host, cluster.port, cluster.username,
+                                          cluster.password.get_secret_value(), cluster.authentication_database,
+                                          use_catalog=True,
+                                          namespace_filter=NamespaceFilter.from_rules(cluster.namespaces))
+        findings = analyze_cluster(get_cluster_client(cluster), live_cluster, unused_since)
+        logger.info(format_findings(cluster, findings), extra={"cluster": cluster.name, "findings": len(findings)})
+        results[cluster.name] = findings
+        cleaned_clusters.append(remove_flagged_indexes(live_cluster, findings, cluster))
+    if output_config_path:
+        config_json_to_yml_file(datamodel_to_config(cleaned_clusters), output_config_path)
+    return results
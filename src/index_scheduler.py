@@ -0,0 +1,161 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Optional, Callable
+
+from pymongo import MongoClient, errors
+
+from src.config_to_mongo import create_indexes, IndexCreationError
+from src.mongo_data_model import MongoIndex
+
+logger = logging.getLogger(__name__)
+
+
+class IndexBuild:
+    def __init__(self, database: str, collection: str, indexes: List[MongoIndex]):
+        self.database = database
+        self.collection = collection
+        self.indexes = indexes
+        self.document_count = 0
+        self.data_size = 0
+
+    @property
+    def cost(self) -> int:
+        # Every index in the batch scans the whole collection once
+        return max(self.data_size, self.document_count) * len(self.indexes)
+
+    def __repr__(self):
+        return f"IndexBuild({self.database}.{self.collection}, {len(self.indexes)} index(es), cost={self.cost})"
+
+
+class IndexBuildProgress:
+    def __init__(self, namespace: str, message: str, done: Optional[int], total: Optional[int]):
+        self.namespace = namespace
+        self.message = message
+        self.done = done
+        self.total = total
+
+    def __repr__(self):
+        if self.total:
+            return f"{self.namespace}: {self.message} ({self.done}/{self.total})"
+        return f"{self.namespace}: {self.message}"
+
+
+def log_index_build_progress(progress: IndexBuildProgress):
+    logger.info("Index build in progress: %s", progress, extra={"namespace": progress.namespace})
+
+
+def estimate_index_build_costs(client: MongoClient, builds: List[IndexBuild]):
+    for build in builds:
+        try:
+            stats = client[build.database].command("collStats", build.collection)
+            build.document_count = stats.get("count", 0)
+            build.data_size = stats.get("size", 0)
+        except errors.OperationFailure:
+            # The collection does not exist yet, so its indexes are built on an empty collection
+            build.document_count = 0
+            build.data_size = 0
+
+
+def get_index_build_progress(client: MongoClient) -> List[IndexBuildProgress]:
+    current_ops = client.admin.command({
+        "currentOp": True,
+        "$or": [
+            {"op": "command", "command.createIndexes": {"$exists": True}},
+            {"op": "none", "msg": {"$regex": "^Index Build"}}
+        ]
+    })
+    progress = []
+    for operation in current_ops.get("inprog", []):
+        operation_progress = operation.get("progress", {})
+        progress.append(IndexBuildProgress(
+            namespace=operation.get("ns", ""),
+            message=operation.get("msg", "building"),
+            done=operation_progress.get("done"),
+            total=operation_progress.get("total")
+        ))
+    return progress
+
+
+class IndexBuildScheduler:
+    # Runs the cheapest builds first, keeping at most max_concurrent_builds running on the cluster and
+    # max_concurrent_builds_per_database on any one database. commit_quorum and max_time_ms are passed to
+    # every createIndexes command; while builds run, currentOp is polled every progress_interval seconds.
+    def __init__(self, max_concurrent_builds: int = 1, max_concurrent_builds_per_database: Optional[int] = None,
+                 commit_quorum=None, max_time_ms: Optional[int] = None, progress_interval: Optional[float] = 30,
+                 progress_callback: Callable[[IndexBuildProgress], None] = log_index_build_progress):
+        self.max_concurrent_builds = max_concurrent_builds
+        self.max_concurrent_builds_per_database = max_concurrent_builds_per_database or max_concurrent_builds
+        self.commit_quorum = commit_quorum
+        self.max_time_ms = max_time_ms
+        self.progress_interval = progress_interval
+        self.progress_callback = progress_callback
+
+    def command_options(self) -> Dict:
+        options = {}
+        if self.commit_quorum is not None:
+            options["commitQuorum"] = self.commit_quorum
+        if self.max_time_ms is not None:
+            options["maxTimeMS"] = self.max_time_ms
+        return options
+
+    def order(self, builds: List[IndexBuild]) -> List[IndexBuild]:
+        return sorted(builds, key=lambda build: (build.cost, build.database, build.collection))
+
+    # on_start is called with each build as it is submitted, on_finish with each build and its errors as soon as
+    # it is done, both from the thread calling run.
+    def run(self, client: MongoClient, builds: List[IndexBuild],
+            on_start: Optional[Callable[[IndexBuild], None]] = None,
+            on_finish: Optional[Callable[[IndexBuild, List[IndexCreationError]], None]] = None
+            ) -> List[IndexCreationError]:
+        estimate_index_build_costs(client, builds)
+        pending = self.order(builds)
+        running = {}  # Future -> build
+        running_per_database = {}
+        build_errors = []
+
+        finished = threading.Event()
+        progress_thread = None
+        if self.progress_interval:
+            progress_thread = threading.Thread(target=self.report_progress, args=(client, finished), daemon=True)
+            progress_thread.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrent_builds) as executor:
+                while pending or running:
+                    # Start the cheapest builds whose database still has capacity
+                    for build in list(pending):
+                        if len(running) >= self.max_concurrent_builds:
+                            break
+                        if running_per_database.get(build.database, 0) >= self.max_concurrent_builds_per_database:
+                            continue
+                        pending.remove(build)
+                        if on_start:
+                            on_start(build)
+                        future = executor.submit(create_indexes, client[build.database], build.collection,
+                                                 build.indexes, **self.command_options())
+                        running[future] = build
+                        running_per_database[build.database] = running_per_database.get(build.database, 0) + 1
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        build = running.pop(future)
+                        running_per_database[build.database] -= 1
+                        errors_of_build = future.result()
+                        if on_finish:
+                            on_finish(build, errors_of_build)
+                        build_errors.extend(errors_of_build)
+        finally:
+            finished.set()
+            if progress_thread:
+                progress_thread.join()
+        return build_errors
+
+    def report_progress(self, client: MongoClient, finished: threading.Event):
+        while not finished.wait(self.progress_interval):
+            try:
+                for progress in get_index_build_progress(client):
+                    self.progress_callback(progress)
+            except errors.PyMongoError:
+                # Progress reporting is best effort and must never fail the builds themselves
+                pass
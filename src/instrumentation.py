@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Iterable, Iterator, Tuple
+
+from bson import encode
+from pymongo import monitoring
+
+from src.client_registry import registry
+
+# Upper bounds in seconds, Prometheus style: a sample is counted in every bucket it fits in
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, float("inf"))
+
+METRIC_PREFIX = "mongo_as_code"
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+    def to_dict(self) -> Dict:
+        return {"count": self.count, "seconds": self.total,
+                "buckets": {"+Inf" if bound == float("inf") else str(bound): count
+                            for bound, count in zip(LATENCY_BUCKETS, self.buckets)}}
+
+
+class CommandStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.failures = 0
+        self.request_bytes = 0
+        self.reply_bytes = 0
+
+
+class RunMetrics:
+    # Everything is keyed by cluster name; commands additionally by database and command name.
+    # Phases are the coarse steps of a run (parse_config, introspect, diff, apply) and are always recorded,
+    # commands and connections only once enable_command_metrics registered the listeners.
+    def __init__(self):
+        self.commands = {}  # (cluster, database, command) -> CommandStats
+        self.connections = {}  # (cluster, stage) -> LatencyHistogram, stage is "ready" or "checkout"
+        self.phases = {}  # (cluster, phase) -> LatencyHistogram
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def record_command(self, cluster: str, database: str, command: str, seconds: float, failed: bool,
+                       request_bytes: int, reply_bytes: int):
+        with self._lock:
+            stats = self.commands.get((cluster, database, command))
+            if stats is None:
+                stats = self.commands[(cluster, database, command)] = CommandStats()
+            stats.latency.observe(seconds)
+            stats.failures += failed
+            stats.request_bytes += request_bytes
+            stats.reply_bytes += reply_bytes
+
+    def record_connection(self, cluster: str, stage: str, seconds: float):
+        with self._lock:
+            self.connections.setdefault((cluster, stage), LatencyHistogram()).observe(seconds)
+
+    def record_phase(self, cluster: str, phase: str, seconds: float):
+        with self._lock:
+            self.phases.setdefault((cluster, phase), LatencyHistogram()).observe(seconds)
+
+    @contextmanager
+    def phase(self, phase: str, cluster: str = ""):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(cluster, phase, time.perf_counter() - start)
+
+    def timed_iter(self, items: Iterable, phase: str, cluster: str = "") -> Iterator:
+        # For lazily parsed configs: only the time spent producing each item counts towards the phase
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.record_phase(cluster, phase, time.perf_counter() - start)
+                return
+            self.record_phase(cluster, phase, time.perf_counter() - start)
+            yield item
+
+    def to_report(self) -> Dict:
+        with self._lock:
+            return {
+                "started": self.started,
+                "elapsed": time.time() - self.started,
+                "phases": [dict(cluster=cluster, phase=phase, **histogram.to_dict())
+                           for (cluster, phase), histogram in sorted(self.phases.items())],
+                "connections": [dict(cluster=cluster, stage=stage, **histogram.to_dict())
+                                for (cluster, stage), histogram in sorted(self.connections.items())],
+                "commands": [dict(cluster=cluster, database=database, command=command, failures=stats.failures,
+                                  request_bytes=stats.request_bytes, reply_bytes=stats.reply_bytes,
+                                  **stats.latency.to_dict())
+                             for (cluster, database, command), stats in sorted(self.commands.items())],
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+
+        def histogram_lines(name: str, help_text: str, histograms: List[Tuple[Dict[str, str], LatencyHistogram]]):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} histogram")
+            for labels, histogram in histograms:
+                for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                    le = "+Inf" if bound == float("inf") else str(bound)
+                    lines.append(f"{METRIC_PREFIX}_{name}_bucket{format_labels(dict(labels, le=le))} {count}")
+                lines.append(f"{METRIC_PREFIX}_{name}_sum{format_labels(labels)} {histogram.total}")
+                lines.append(f"{METRIC_PREFIX}_{name}_count{format_labels(labels)} {histogram.count}")
+
+        def counter_lines(name: str, help_text: str, values: List[Tuple[Dict[str, str], int]]):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+            lines.extend(f"{METRIC_PREFIX}_{name}{format_labels(labels)} {value}" for labels, value in values)
+
+        with self._lock:
+            phases = sorted(self.phases.items())
+            connections = sorted(self.connections.items())
+            commands = sorted(self.commands.items())
+        histogram_lines("phase_duration_seconds", "Time spent in each phase of the run.",
+                        [({"cluster": cluster, "phase": phase}, histogram) for (cluster, phase), histogram in phases])
+        histogram_lines("connection_duration_seconds",
+                        "Connection setup including handshake and authentication (ready), and pool checkout wait.",
+                        [({"cluster": cluster, "stage": stage}, histogram)
+                         for (cluster, stage), histogram in connections])
+        command_labels = [({"cluster": cluster, "database": database, "command": command}, stats)
+                          for (cluster, database, command), stats in commands]
+        histogram_lines("command_duration_seconds", "Server round trip time per command.",
+                        [(labels, stats.latency) for labels, stats in command_labels])
+        counter_lines("command_failures_total", "Commands that failed.",
+                      [(labels, stats.failures) for labels, stats in command_labels])
+        counter_lines("command_request_bytes_total", "BSON size of the commands sent.",
+                      [(labels, stats.request_bytes) for labels, stats in command_labels])
+        counter_lines("command_reply_bytes_total", "BSON size of the replies received.",
+                      [(labels, stats.reply_bytes) for labels, stats in command_labels])
+        return "\n".join(lines) + "\n"
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    return "{" + ",".join(f'{name}="{escape_label_value(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def document_size(document) -> int:
+    # Sensitive commands such as saslStart are published with an empty body
+    return len(encode(document)) if document else 0
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    def __init__(self, metrics: RunMetrics, cluster: str):
+        self.metrics = metrics
+        self.cluster = cluster
+        self._request_bytes = {}
+        self._lock = threading.Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        with self._lock:
+            self._request_bytes[(event.connection_id, event.request_id)] = document_size(event.command)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self.finished(event, False, document_size(event.reply))
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self.finished(event, True, 0)
+
+    def finished(self, event, failed: bool, reply_bytes: int):
+        with self._lock:
+            request_bytes = self._request_bytes.pop((event.connection_id, event.request_id), 0)
+        self.metrics.record_command(self.cluster, event.database_name, event.command_name,
+                                    event.duration_micros / 1e6, failed, request_bytes, reply_bytes)
+
+
+class ConnectionMetricsListener(monitoring.ConnectionPoolListener):
+    def __init__(self, metrics: RunMetrics, cluster: str):
+        self.metrics = metrics
+        self.cluster = cluster
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent):
+        self.metrics.record_connection(self.cluster, "ready", event.duration or 0.0)
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent):
+        self.metrics.record_connection(self.cluster, "checkout", event.duration or 0.0)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+metrics = RunMetrics()
+
+
+def enable_command_metrics():
+    # Only clients created afterwards are instrumented, so call this before anything connects
+    registry.listener_factory = lambda cluster: [CommandMetricsListener(metrics, cluster),
+                                                 ConnectionMetricsListener(metrics, cluster)]
+
+
+def write_report(path: str, report_format: Optional[str] = None):
+    # Written atomically, as the Prometheus textfile collector may read the file at any moment
+    if report_format is None:
+        report_format = "prometheus" if path.endswith(".prom") else "json"
+    content = metrics.to_prometheus() if report_format == "prometheus" else json.dumps(metrics.to_report(), indent=2)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as file:
+        file.write(content)
+    os.replace(temporary_path, path)
+
+
+# Attributes every LogRecord has; anything else was passed through extra= and belongs in the structured output
+STANDARD_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name,
+                 "message": record.getMessage()}
+        entry.update((key, value) for key, value in vars(record).items() if key not in STANDARD_RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = "INFO", json_format: bool = False):
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonLogFormatter() if json_format else logging.Formatter("%(message)s"))
+    logging.basicConfig(level=level, handlers=[handler], force=True)
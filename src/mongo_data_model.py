@@ -1,25 +1,87 @@
-from typing import List, Dict
+from functools import cached_property
+from typing import List, Dict, Union, Optional
 from pydantic import BaseModel, SecretStr
 
+def content_hash(*parts) -> int:
+    # Python's tuple hash is seeded per process, so fingerprints are only comparable within one run
+    return hash(parts)
+
+class MongoRole(BaseModel):
+    role: str
+    db: str
+
+def role_documents(roles: List[Union[str, MongoRole]], db_name: str) -> List[Dict[str, str]]:
+    return [{"role": role, "db": db_name} if isinstance(role, str) else {"role": role.role, "db": role.db}
+            for role in roles]
+
+# The fingerprints below are Merkle-style content hashes used by diff_utils to skip identical subtrees.
+# They are computed once per object, so code that mutates a model after it may have been diffed must call
+# invalidate_fingerprints on it and on every model containing it.
+
+def invalidate_fingerprints(*models: BaseModel):
+    for model in models:
+        model.__dict__.pop('fingerprint', None)
+
 class MongoUser(BaseModel):
     username: str
     password: SecretStr
-    roles: List[str]
+    # A plain role name refers to a role on the database the user belongs to
+    roles: List[Union[str, MongoRole]]
+
+    def role_documents(self, db_name: str) -> List[Dict[str, str]]:
+        return role_documents(self.roles, db_name)
+
+    @cached_property
+    def fingerprint(self) -> int:
+        # Passwords are not retrievable from a cluster, so they never take part in a comparison
+        return content_hash(self.username, tuple(sorted(
+            (role, "") if isinstance(role, str) else (role.role, role.db) for role in self.roles)))
 
 class MongoIndex(BaseModel):
     name: str
     fields: Dict[str, int]
     unique: bool = False
 
+    @property
+    def key_pattern(self) -> tuple:
+        # Everything that defines the index on the server except its name; field order is significant
+        return tuple(self.fields.items()), self.unique
+
+    @cached_property
+    def fingerprint(self) -> int:
+        return content_hash(self.name, self.key_pattern)
+
 class MongoCollection(BaseModel):
     name: str
     indexes: List[MongoIndex]
+    # Only on snapshots of sharded collections: the indexes each shard owning chunks reports, keyed by shard id,
+    # or None for a shard that could not be read. They are not part of the fingerprint; diff_utils compares them
+    # between shards, never against a config.
+    shard_indexes: Optional[Dict[str, Optional[List[MongoIndex]]]] = None
+
+    @cached_property
+    def fingerprint(self) -> int:
+        return content_hash(self.name, tuple(sorted(index.fingerprint for index in self.indexes)))
 
 class MongoDatabase(BaseModel):
     name: str
     collections: List[MongoCollection]
     users: List[MongoUser]
 
+    @cached_property
+    def fingerprint(self) -> int:
+        return content_hash(self.name,
+                            tuple(sorted(collection.fingerprint for collection in self.collections)),
+                            tuple(sorted(user.fingerprint for user in self.users)))
+
+class MongoNamespaceRules(BaseModel):
+    # Glob patterns, or regular expressions prefixed with "re:". Collection patterns match the collection name in
+    # every database, or "<database glob>.<collection glob>" for specific databases. See namespace_filter.
+    include_databases: List[str] = []
+    exclude_databases: List[str] = []
+    include_collections: List[str] = []
+    exclude_collections: List[str] = []
+
 class MongoCluster(BaseModel):
     name: str
     host: str
@@ -28,3 +90,7 @@ class MongoCluster(BaseModel):
     password: SecretStr
     authentication_database: str
     databases: List[MongoDatabase]
+    # Namespaces outside these rules are neither introspected nor compared
+    namespaces: Optional[MongoNamespaceRules] = None
+    # Also read the indexes of sharded collections from every shard owning chunks of them, see shard_indexes
+    sharded: bool = False
@@ -0,0 +1,107 @@
+import fnmatch
+import re
+from typing import List, Dict, Optional, Iterable
+
+from src.mongo_data_model import MongoNamespaceRules
+
+REGEX_PREFIX = "re:"
+
+
+def pattern_to_regex(pattern: str) -> str:
+    # Globs become anchored regular expressions; "re:" patterns are used as they are and must match the whole name
+    if pattern.startswith(REGEX_PREFIX):
+        return pattern[len(REGEX_PREFIX):]
+    return re.sub(r"\\[Zz]$", "", fnmatch.translate(pattern))
+
+
+def combine_regexes(regexes: Iterable[str]) -> Optional[str]:
+    # Written so that both Python's re and the server's PCRE read it the same way
+    regexes = list(regexes)
+    return f"^(?:{'|'.join(f'(?:{regex})' for regex in regexes)})$" if regexes else None
+
+
+class CollectionPattern:
+    def __init__(self, pattern: str):
+        # Database names cannot contain dots, so the first dot of a glob separates the database part
+        self.database_regex = None
+        if not pattern.startswith(REGEX_PREFIX) and "." in pattern:
+            database_pattern, pattern = pattern.split(".", 1)
+            self.database_regex = re.compile(combine_regexes([pattern_to_regex(database_pattern)]))
+        self.regex = pattern_to_regex(pattern)
+
+    def applies_to(self, db_name: str) -> bool:
+        return self.database_regex is None or self.database_regex.match(db_name) is not None
+
+
+class NamespaceFilter:
+    # With no include rules everything is included; exclude rules win over include rules.
+    # The same compiled expressions serve the server-side listDatabases/listCollections filters and the
+    # in-process checks, so a namespace is either introspected and compared everywhere or nowhere.
+    def __init__(self, include_databases: Iterable[str] = (), exclude_databases: Iterable[str] = (),
+                 include_collections: Iterable[str] = (), exclude_collections: Iterable[str] = ()):
+        self.include_databases = combine_regexes(pattern_to_regex(pattern) for pattern in include_databases)
+        self.exclude_databases = combine_regexes(pattern_to_regex(pattern) for pattern in exclude_databases)
+        self.include_collections = [CollectionPattern(pattern) for pattern in include_collections]
+        self.exclude_collections = [CollectionPattern(pattern) for pattern in exclude_collections]
+        self._include_databases = re.compile(self.include_databases) if self.include_databases else None
+        self._exclude_databases = re.compile(self.exclude_databases) if self.exclude_databases else None
+        self._collection_regexes = {}  # db_name -> (include, exclude) regexes of the rules for that database
+
+    @classmethod
+    def from_rules(cls, rules: Optional[MongoNamespaceRules]) -> Optional["NamespaceFilter"]:
+        if rules is None:
+            return None
+        return cls(rules.include_databases, rules.exclude_databases, rules.include_collections,
+                   rules.exclude_collections)
+
+    def includes_database(self, db_name: str) -> bool:
+        if self._include_databases and not self._include_databases.match(db_name):
+            return False
+        return not (self._exclude_databases and self._exclude_databases.match(db_name))
+
+    def collection_regexes(self, db_name: str) -> tuple:
+        if db_name not in self._collection_regexes:
+            self._collection_regexes[db_name] = tuple(
+                combine_regexes(pattern.regex for pattern in patterns if pattern.applies_to(db_name))
+                for patterns in (self.include_collections, self.exclude_collections))
+        return self._collection_regexes[db_name]
+
+    def includes_collection(self, db_name: str, collection_name: str) -> bool:
+        include, exclude = self.collection_regexes(db_name)
+        if include and not re.match(include, collection_name):
+            return False
+        return not (exclude and re.match(exclude, collection_name))
+
+    def database_filter(self) -> Dict:
+        return name_filter(self.include_databases, self.exclude_databases)
+
+    def collection_filter(self, db_name: str) -> Dict:
+        return name_filter(*self.collection_regexes(db_name))
+
+
+def name_filter(include: Optional[str], exclude: Optional[str]) -> Dict:
+    # Query on the 'name' field, as understood by both listDatabases and listCollections
+    conditions = []
+    if include:
+        conditions.append({'name': {'$regex': include}})
+    if exclude:
+        conditions.append({'name': {'$not': {'$regex': exclude}}})
+    return merge_filters(*conditions)
+
+
+def merge_filters(*filters: Dict) -> Dict:
+    conditions = []
+    for query in filters:
+        if list(query) == ['$and']:
+            conditions.extend(query['$and'])
+        elif query:
+            conditions.append(query)
+    if len(conditions) > 1:
+        return {'$and': conditions}
+    return conditions[0] if conditions else {}
+
+
+def filter_database_names(db_names: Iterable[str], namespace_filter: Optional[NamespaceFilter]) -> List[str]:
+    if namespace_filter is None:
+        return list(db_names)
+    return [db_name for db_name in db_names if namespace_filter.includes_database(db_name)]
@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+from typing import List, Dict, Optional
+
+# The journal is an append-only JSON-lines file. A run first writes one "planned" record per operation of a
+# cluster's plan, then a "started" record before each operation is executed and a "completed" or "failed" record
+# after it; the last record about an operation is its status. An operation that is "started" without a later record
+# was in flight when the run died.
+PLANNED = "planned"
+STARTED = "started"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class JournaledPlan:
+    def __init__(self, cluster: str):
+        self.cluster = cluster
+        self.operations = []  # Operation records in plan order
+        self.status = {}  # Operation id -> last status
+        self.messages = {}  # Operation id -> error message of the last failure
+
+    def remaining(self) -> List[Dict]:
+        # Failed operations are retried along with those that never ran
+        return [operation for operation in self.operations if self.status[operation["id"]] != COMPLETED]
+
+    def in_flight(self) -> List[Dict]:
+        return [operation for operation in self.operations if self.status[operation["id"]] == STARTED]
+
+
+class OperationJournal:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self) -> Dict[str, JournaledPlan]:
+        plans = {}
+        if not os.path.exists(self.path):
+            return plans
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Only the last line can be torn, by a crash in the middle of a write
+                    continue
+                plan = plans.setdefault(record["cluster"], JournaledPlan(record["cluster"]))
+                if record["event"] == PLANNED:
+                    if record["id"] not in plan.status:
+                        plan.operations.append(record["operation"])
+                    plan.status[record["id"]] = PLANNED
+                elif record["id"] in plan.status:
+                    plan.status[record["id"]] = record["event"]
+                    if record["event"] == FAILED:
+                        plan.messages[record["id"]] = record.get("message")
+        return plans
+
+    def open(self, resume: bool = False):
+        # A fresh run starts a new journal; a resumed one appends to what the interrupted run left behind
+        self._file = open(self.path, 'a' if resume else 'w')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def write(self, record: Dict):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._file.write(line)
+            # Flushed per record so that a killed process loses at most the record being written
+            self._file.flush()
+
+    def record_plan(self, cluster: str, operations: List[Dict]):
+        for operation in operations:
+            self.write({"event": PLANNED, "cluster": cluster, "id": operation["id"], "operation": operation})
+
+    def record(self, event: str, cluster: str, operation_id: str, message: Optional[str] = None):
+        record = {"event": event, "cluster": cluster, "id": operation_id}
+        if message is not None:
+            record["message"] = message
+        self.write(record)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,364 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Set
+
+from pymongo import MongoClient, errors
+
+from src.client_registry import get_cluster_client
+from src.cluster_to_data_model import mongo_to_compact_datamodel
+from src.config_directory import load_manifest, save_manifest
+from src.config_to_mongo import parse_config_file, iter_config_file, create_indexes, index_to_spec, \
+    ConfigDirectoryLoader, ConfigChange, IndexCreationError
+from src.diff_utils import generate_cluster_diff, ClusterDiff
+from src.instrumentation import metrics
+from src.index_scheduler import IndexBuildScheduler, IndexBuild, get_index_build_progress
+from src.mongo_data_model import MongoCluster, MongoUser, MongoCollection, MongoIndex, \
+    role_documents
+from src.namespace_filter import NamespaceFilter
+from src.operation_journal import OperationJournal, JournaledPlan, STARTED, COMPLETED, FAILED
+
+logger = logging.getLogger(__name__)
+
+
+class Operation:
+    def __init__(self, kind: str, database: str, command: Dict, collection: Optional[str] = None,
+                 target: Optional[str] = None, indexes: Optional[List[MongoIndex]] = None):
+        self.kind = kind
+        self.database = database
+        self.collection = collection
+        self.target = target  # Username or index name the operation acts on
+        self.command = command
+        self.indexes = indexes or []
+        # Set on operations an interrupted run had already started, which may have taken effect
+        self.resumed = False
+
+    def describe(self) -> str:
+        namespace = f"{self.database}.{self.collection}" if self.collection else self.database
+        if self.kind == "create_indexes":
+            return f"+ create indexes {', '.join(index.name for index in self.indexes)} on {namespace}"
+        if self.kind == "create_collection":
+            return f"+ create collection {namespace}"
+        if self.kind == "create_user":
+            return f"+ create user {self.target} on {namespace}"
+        if self.kind == "grant_roles":
+            return f"~ grant roles {self.command['roles']} to user {self.target} on {namespace}"
+        if self.kind == "revoke_roles":
+            return f"~ revoke roles {self.command['roles']} from user {self.target} on {namespace}"
+        if self.kind == "drop_user":
+            return f"- drop user {self.target} on {namespace}"
+        if self.kind == "rename_index":
+            return f"~ keep index {self.target} on {namespace} (renamed in config, not rebuilt)"
+        if self.kind == "rebuild_index":
+            return f"! drop index {self.target} on {namespace} to rebuild it with a new definition"
+        if self.kind == "drop_index":
+            return f"- drop index {self.target} on {namespace}"
+        if self.kind == "drop_collection":
+            return f"- drop collection {namespace}"
+        if self.kind == "drop_database":
+            return f"- drop database {namespace}"
+        return f"{self.kind} {namespace}"
+
+    def __repr__(self):
+        return f"Operation({self.describe()})"
+
+
+class OperationError:
+    def __init__(self, operation: Operation, message: str):
+        self.operation = operation
+        self.message = message
+
+    def __repr__(self):
+        return f"OperationError({self.operation.describe()}: {self.message})"
+
+
+def operation_id(operation: Operation) -> str:
+    # Stable across runs, so that a resumed run can match the journal's records to the operations they describe
+    indexes = ",".join(index.name for index in operation.indexes)
+    return f"{operation.kind}:{operation.database}.{operation.collection or ''}:{operation.target or ''}:{indexes}"
+
+
+def operation_to_record(operation: Operation) -> Dict:
+    return {
+        "id": operation_id(operation),
+        "kind": operation.kind,
+        "database": operation.database,
+        "collection": operation.collection,
+        "target": operation.target,
+        # Passwords never reach the journal; operation_from_record takes them from the config again
+        "command": {key: value for key, value in operation.command.items() if key != "pwd"},
+        "indexes": [{"name": index.name, "fields": list(index.fields.items()), "unique": index.unique}
+                    for index in operation.indexes],
+    }
+
+
+def operation_from_record(record: Dict, cluster: MongoCluster) -> Operation:
+    command = dict(record["command"])
+    if record["kind"] == "create_user":
+        db = next((db for db in cluster.databases if db.name == record["database"]), None)
+        user = next((user for user in db.users if user.username == record["target"]), None) if db else None
+        if user is None:
+            raise KeyError(f"User {record['target']} on {record['database']} is no longer in the config")
+        command["pwd"] = user.password.get_secret_value()
+    return Operation(record["kind"], record["database"], command, collection=record["collection"],
+                     target=record["target"],
+                     indexes=[MongoIndex(name=index["name"], fields=dict(index["fields"]), unique=index["unique"])
+                              for index in record["indexes"]])
+
+
+def create_user_operation(db_name: str, user: MongoUser) -> Operation:
+    return Operation("create_user", db_name, {
+        "createUser": user.username,
+        "pwd": user.password.get_secret_value(),
+        "roles": user.role_documents(db_name)
+    }, target=user.username)
+
+
+def create_collection_operation(db_name: str, collection: MongoCollection) -> Operation:
+    return create_indexes_operation(db_name, collection.name, collection.indexes) if collection.indexes \
+        else Operation("create_collection", db_name, {"create": collection.name}, collection=collection.name)
+
+
+def create_indexes_operation(db_name: str, collection_name: str, indexes: List[MongoIndex]) -> Operation:
+    return Operation("create_indexes", db_name, {
+        "createIndexes": collection_name,
+        "indexes": [index_to_spec(index) for index in indexes]
+    }, collection=collection_name, indexes=indexes)
+
+
+def generate_plan(diff: ClusterDiff, prune: bool = False) -> List[Operation]:
+    # The diff is expected to run from the live cluster to the desired config, so "added" means missing on the server.
+    # Anything only present on the server is dropped or revoked only when prune is set.
+    plan = []
+    for db in diff.databases.added:
+        plan.extend(create_user_operation(db.name, user) for user in db.users)
+        plan.extend(create_collection_operation(db.name, collection) for collection in db.collections)
+
+    for db_name, user_diff in diff.databases.users_diff.items():
+        plan.extend(create_user_operation(db_name, user) for user in user_diff.added)
+        for username, roles_diff in user_diff.changed.items():
+            if roles_diff.added:
+                plan.append(Operation("grant_roles", db_name, {
+                    "grantRolesToUser": username, "roles": role_documents(roles_diff.added, db_name)
+                }, target=username))
+            if prune and roles_diff.removed:
+                plan.append(Operation("revoke_roles", db_name, {
+                    "revokeRolesFromUser": username, "roles": role_documents(roles_diff.removed, db_name)
+                }, target=username))
+        if prune:
+            plan.extend(Operation("drop_user", db_name, {"dropUser": user.username}, target=user.username)
+                        for user in user_diff.removed)
+
+    for db_name, collection_diff in diff.databases.changed.items():
+        plan.extend(create_collection_operation(db_name, collection) for collection in collection_diff.added)
+        for collection_name, index_diff in collection_diff.changed.items():
+            # MongoDB cannot rename an index, and an equivalent one already serves the same queries
+            plan.extend(Operation("rename_index", db_name, {}, collection=collection_name,
+                                  target=f"{old_index.name} -> {new_index.name}")
+                        for old_index, new_index in index_diff.renamed)
+            # A changed definition has to be dropped before the new one can take its name
+            plan.extend(Operation("rebuild_index", db_name, {"dropIndexes": collection_name, "index": old_index.name},
+                                  collection=collection_name, target=old_index.name)
+                        for old_index, _ in index_diff.rebuilt)
+            indexes_to_create = index_diff.added + [new_index for _, new_index in index_diff.rebuilt]
+            if indexes_to_create:
+                plan.append(create_indexes_operation(db_name, collection_name, indexes_to_create))
+            if prune:
+                plan.extend(Operation("drop_index", db_name, {"dropIndexes": collection_name, "index": index.name},
+                                      collection=collection_name, target=index.name)
+                            for index in index_diff.removed)
+        if prune:
+            plan.extend(Operation("drop_collection", db_name, {"drop": collection.name}, collection=collection.name)
+                        for collection in collection_diff.removed)
+
+    if prune:
+        plan.extend(Operation("drop_database", db.name, {"dropDatabase": 1}) for db in diff.databases.removed)
+    return plan
+
+
+def plan_cluster(cluster: MongoCluster, prune: bool = False, max_workers: Optional[int] = None,
+                 database_scope: Optional[Set[str]] = None) -> List[Operation]:
+    # With a database_scope only those databases are introspected and compared, as if nothing else existed;
+    # the cluster's namespace rules narrow both steps further
+    namespace_filter = NamespaceFilter.from_rules(cluster.namespaces)
+    with metrics.phase("introspect", cluster.name):
+        live_cluster = mongo_to_compact_datamodel(cluster.name, cluster.host, cluster.port, cluster.username,
+                                                  cluster.password.get_secret_value(),
+                                                  cluster.authentication_database, max_workers=max_workers,
+                                                  databases=database_scope, namespace_filter=namespace_filter,
+                                                  sharded=cluster.sharded)
+    with metrics.phase("diff", cluster.name):
+        diff = generate_cluster_diff(live_cluster, cluster, namespace_filter)
+    # Reported only: which shard's definition is the right one is not something the config can say
+    for inconsistency in diff.shard_inconsistencies:
+        logger.warning("%s: %s", cluster.name, inconsistency.describe(),
+                       extra={"cluster": cluster.name, "database": inconsistency.database,
+                              "collection": inconsistency.collection})
+    return generate_plan(diff, prune)
+
+
+def format_plan(cluster: MongoCluster, plan: List[Operation]) -> str:
+    if not plan:
+        return f"{cluster.name}: no changes"
+    return "\n".join([f"{cluster.name}: {len(plan)} operation(s)"] + [f"  {operation.describe()}" for operation in plan])
+
+
+# Errors a command fails with when it had already taken effect, by operation kind: UserAlreadyExists, UserNotFound,
+# IndexNotFound, NamespaceExists and NamespaceNotFound
+ALREADY_APPLIED_ERRORS = {
+    "create_user": {51003},
+    "drop_user": {11},
+    "drop_index": {27},
+    "rebuild_index": {27},
+    "create_collection": {48},
+    "drop_collection": {26},
+}
+
+
+def execute_operation(client: MongoClient, operation: Operation) -> List[OperationError]:
+    if not operation.command:
+        return []
+    if operation.kind == "create_indexes":
+        return [OperationError(operation, f"{error.index}: {error.message}")
+                for error in create_indexes(client[operation.database], operation.collection, operation.indexes)]
+    try:
+        client[operation.database].command(operation.command)
+        return []
+    except errors.OperationFailure as e:
+        if operation.resumed and e.code in ALREADY_APPLIED_ERRORS.get(operation.kind, ()):
+            logger.info("%s had already been applied before the run was interrupted", operation.describe(),
+                        extra={"database": operation.database})
+            return []
+        return [OperationError(operation, str(e))]
+
+
+def record_outcome(journal: Optional[OperationJournal], cluster: MongoCluster, operation: Operation,
+                   operation_errors: List[OperationError]):
+    if journal:
+        journal.record(FAILED if operation_errors else COMPLETED, cluster.name, operation_id(operation),
+                       "; ".join(error.message for error in operation_errors) or None)
+
+
+def apply_plan(cluster: MongoCluster, plan: List[Operation], max_workers: Optional[int] = None,
+               scheduler: Optional[IndexBuildScheduler] = None,
+               journal: Optional[OperationJournal] = None) -> List[OperationError]:
+    client = get_cluster_client(cluster, max_pool_size=max_workers)
+    # Index builds are the long-running part, so only they go through the pool; users must exist before grants
+    index_operations = [operation for operation in plan if operation.kind == "create_indexes"]
+    other_operations = [operation for operation in plan if operation.kind != "create_indexes"]
+
+    def execute(operation: Operation) -> List[OperationError]:
+        if journal:
+            journal.record(STARTED, cluster.name, operation_id(operation))
+        operation_errors = execute_operation(client, operation)
+        record_outcome(journal, cluster, operation, operation_errors)
+        return operation_errors
+
+    operation_errors = []
+    for operation in other_operations:
+        operation_errors.extend(execute(operation))
+    if scheduler:
+        # Each build is journaled when the scheduler submits it and again as soon as it is done
+        operations = {(operation.database, operation.collection): operation for operation in index_operations}
+
+        def build_started(build: IndexBuild):
+            if journal:
+                journal.record(STARTED, cluster.name, operation_id(operations[(build.database, build.collection)]))
+
+        def build_finished(build: IndexBuild, build_errors: List[IndexCreationError]):
+            operation = operations[(build.database, build.collection)]
+            errors_of_build = [OperationError(operation, f"{error.index}: {error.message}") for error in build_errors]
+            record_outcome(journal, cluster, operation, errors_of_build)
+            operation_errors.extend(errors_of_build)
+
+        scheduler.run(client, [IndexBuild(operation.database, operation.collection, operation.indexes)
+                               for operation in index_operations], build_started, build_finished)
+        return operation_errors
+    with ThreadPoolExecutor(max_workers=max_workers or 1) as executor:
+        for index_errors in executor.map(execute, index_operations):
+            operation_errors.extend(index_errors)
+    return operation_errors
+
+
+def wait_for_index_builds(client: MongoClient, operation: Operation, poll_interval: float = 10.0) -> bool:
+    # Returns whether every index of the operation exists once no build is running on its collection any more
+    namespace = f"{operation.database}.{operation.collection}"
+    while True:
+        building = [progress for progress in get_index_build_progress(client) if progress.namespace == namespace]
+        if not building:
+            break
+        for progress in building:
+            logger.info("Waiting for in-flight index build: %s", progress, extra={"namespace": namespace})
+        time.sleep(poll_interval)
+    existing = set(index["name"] for index in client[operation.database][operation.collection].list_indexes())
+    return all(index.name in existing for index in operation.indexes)
+
+
+def resume_plan(cluster: MongoCluster, journaled_plan: JournaledPlan, journal: Optional[OperationJournal] = None,
+                poll_interval: float = 10.0) -> List[Operation]:
+    # What the interrupted run left to do, in its original order. Index builds it had started are not issued again
+    # while the server is still running them, and are only repeated if some of their indexes never got built;
+    # createIndexes skips the ones that did. Other operations that were in flight are run again, and count as
+    # completed if they fail because they had already taken effect.
+    client = get_cluster_client(cluster)
+    plan = []
+    for record in journaled_plan.remaining():
+        operation = operation_from_record(record, cluster)
+        if journaled_plan.status[record["id"]] == STARTED and operation.kind == "create_indexes" \
+                and wait_for_index_builds(client, operation, poll_interval):
+            if journal:
+                journal.record(COMPLETED, cluster.name, record["id"])
+            continue
+        operation.resumed = journaled_plan.status[record["id"]] == STARTED
+        plan.append(operation)
+    return plan
+
+
+def plan_and_apply(config_file_path: str, dry_run: bool = False, prune: bool = False,
+                   max_workers: Optional[int] = None, scheduler: Optional[IndexBuildScheduler] = None,
+                   cache_dir: Optional[str] = None, manifest_path: Optional[str] = None,
+                   journal_path: Optional[str] = None, resume: bool = False) -> Dict[str, List[OperationError]]:
+    # For a config directory with a manifest only the clusters and databases whose files changed since the
+    # last successful run are planned; the manifest is only advanced once everything applied cleanly.
+    # With a journal every planned and executed operation is recorded, and resume continues the journaled plans
+    # of an interrupted run instead of planning their clusters again. Clusters it never reached are planned.
+    directory_loader = None
+    if os.path.isdir(config_file_path):
+        directory_loader = ConfigDirectoryLoader(config_file_path, load_manifest(manifest_path) if manifest_path else None)
+        changes = directory_loader.changes()
+    else:
+        # Without a cache the clusters are streamed, so only one is held in memory at a time
+        clusters = parse_config_file(config_file_path, cache_dir) if cache_dir else iter_config_file(config_file_path)
+        changes = (ConfigChange(cluster) for cluster in clusters)
+
+    journal = OperationJournal(journal_path) if journal_path and not dry_run else None
+    journaled_plans = OperationJournal(journal_path).load() if journal_path and resume else {}
+    if journal:
+        journal.open(resume)
+
+    results = {}
+    try:
+        for change in metrics.timed_iter(changes, "parse_config"):
+            cluster = change.cluster
+            journaled_plan = journaled_plans.get(cluster.name)
+            if journaled_plan:
+                plan = resume_plan(cluster, journaled_plan, journal) if not dry_run \
+                    else [operation_from_record(record, cluster) for record in journaled_plan.remaining()]
+            else:
+                plan = plan_cluster(cluster, prune, max_workers, change.database_scope)
+                if journal:
+                    journal.record_plan(cluster.name, [operation_to_record(operation) for operation in plan])
+            logger.info(format_plan(cluster, plan), extra={"cluster": cluster.name, "operations": len(plan)})
+            if dry_run:
+                results[cluster.name] = []
+                continue
+            with metrics.phase("apply", cluster.name):
+                results[cluster.name] = apply_plan(cluster, plan, max_workers, scheduler, journal)
+    finally:
+        if journal:
+            journal.close()
+
+    if directory_loader and manifest_path and not dry_run and not any(results.values()):
+        save_manifest(manifest_path, directory_loader.manifest)
+    return results
@@ -0,0 +1,129 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterable, Optional, Set
+
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+from src.client_registry import get_client
+from src.namespace_filter import NamespaceFilter
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE_NOT_FOUND = 26
+
+# mongos answers listIndexes from a single shard, so an index missing or defined differently on another shard
+# goes unnoticed while it slows down that shard's part of every scatter-gather query. These functions read the
+# index specs of sharded collections from every shard owning chunks of them: through mongos with $listCatalog, which
+# tags each shard's copy of a collection with the shard, or else straight from the shard primaries. Shards are
+# connected to with the cluster's credentials, which therefore have to be valid on the shards too. A shard that
+# cannot be read is reported with None instead of its specs rather than failing the whole snapshot.
+
+
+def shard_seed_list(host: str) -> str:
+    # config.shards stores "<replica set>/<host:port>,..." for replica set shards; the driver discovers the primary
+    return host.split("/", 1)[1] if "/" in host else host
+
+
+def get_shards(client: MongoClient) -> Dict[str, str]:
+    # Shard id -> seed list. Draining shards are included, they still own chunks until they are removed.
+    return {shard['_id']: shard_seed_list(shard['host'])
+            for shard in client.config.shards.find({}, {'_id': 1, 'host': 1})}
+
+
+def get_chunk_owners(client: MongoClient, db_names: List[str],
+                     namespace_filter: Optional[NamespaceFilter] = None) -> Dict[str, Set[str]]:
+    # Sharded namespace -> shards owning at least one of its chunks. Only those shards are expected to have the
+    # collection's indexes; unsharded collections live on a single shard and have nothing to be compared with.
+    uuids = {}
+    for collection in client.config.collections.find({'dropped': {'$ne': True}}, {'_id': 1, 'uuid': 1}):
+        db_name, collection_name = collection['_id'].split('.', 1)
+        if db_name in db_names and (namespace_filter is None
+                                    or namespace_filter.includes_collection(db_name, collection_name)):
+            uuids[collection['_id']] = collection.get('uuid')
+    if not uuids:
+        return {}
+
+    owners = {namespace: set() for namespace in uuids}
+    namespaces_by_uuid = {uuid: namespace for namespace, uuid in uuids.items() if uuid is not None}
+    # Chunks refer to their collection by UUID since MongoDB 5.0 and by namespace before
+    pipeline = [
+        {'$match': {'$or': [{'uuid': {'$in': list(namespaces_by_uuid)}}, {'ns': {'$in': list(uuids)}}]}},
+        {'$group': {'_id': {'$ifNull': ['$uuid', '$ns']}, 'shards': {'$addToSet': '$shard'}}},
+    ]
+    for group in client.config.chunks.aggregate(pipeline):
+        namespace = namespaces_by_uuid.get(group['_id'], group['_id'])
+        if namespace in owners:
+            owners[namespace].update(group['shards'])
+    return owners
+
+
+def get_catalog_shard_index_specs(client: MongoClient,
+                                  namespaces: Iterable[str]) -> Optional[Dict[str, Dict[str, List[Dict]]]]:
+    # Namespace -> shard id -> index specs of the shards holding the collection, in one round trip through mongos.
+    # None when the server has no $listCatalog (before 6.0) or it cannot be run.
+    specs = {namespace: {} for namespace in namespaces}
+    pipeline = [
+        {'$listCatalog': {}},
+        {'$match': {'db': {'$in': sorted(set(namespace.split('.', 1)[0] for namespace in specs))},
+                    'type': 'collection', 'shard': {'$exists': True}}},
+        {'$project': {'db': 1, 'name': 1, 'shard': 1, 'md.indexes.spec': 1}},
+    ]
+    try:
+        for entry in client.admin.aggregate(pipeline):
+            namespace = f"{entry['db']}.{entry['name']}"
+            if namespace in specs:
+                specs[namespace][entry['shard']] = [index['spec'] for index in entry['md']['indexes']]
+    except OperationFailure as e:
+        logger.debug("$listCatalog is not available, reading the shards directly: %s", e)
+        return None
+    return specs
+
+
+def list_index_specs(client: MongoClient, namespace: str, shard: str) -> Optional[List[Dict]]:
+    db_name, collection_name = namespace.split('.', 1)
+    try:
+        return list(client[db_name][collection_name].list_indexes())
+    except OperationFailure as e:
+        # A shard owning chunks of a collection it does not have lacks every index of it
+        if e.code == NAMESPACE_NOT_FOUND:
+            return []
+        logger.warning("Cannot read the indexes of %s from shard %s: %s", namespace, shard, e)
+    except PyMongoError as e:
+        logger.warning("Cannot read the indexes of %s from shard %s: %s", namespace, shard, e)
+    return None
+
+
+def get_shard_index_specs(client: MongoClient, db_names: List[str], cluster_name: str, username: str, password: str,
+                          auth_db: str, max_workers: Optional[int] = None,
+                          namespace_filter: Optional[NamespaceFilter] = None
+                          ) -> Dict[str, Dict[str, Optional[List[Dict]]]]:
+    # Sharded namespace -> shard id -> index specs, or None for a shard that could not be read. Namespaces that
+    # $listCatalog reports no shard for are read from the shard primaries, with the commands of all shards running
+    # in parallel, by default with one worker per shard.
+    owners = get_chunk_owners(client, db_names, namespace_filter)
+    if not owners:
+        return {}
+    shard_index_specs = {namespace: {} for namespace in owners}
+    catalog = get_catalog_shard_index_specs(client, owners) or {}
+    for namespace, namespace_owners in owners.items():
+        if catalog.get(namespace):
+            # An owning shard missing from the catalog does not have the collection
+            shard_index_specs[namespace] = {shard: catalog[namespace].get(shard, []) for shard in namespace_owners}
+    if all(shard_index_specs.values()):
+        return shard_index_specs
+    shards = get_shards(client)
+    tasks = [(namespace, shard) for namespace, namespace_owners in sorted(owners.items())
+             if not shard_index_specs[namespace] for shard in sorted(namespace_owners) if shard in shards]
+    # Shards owning no chunk of the collections in scope are never connected to
+    shard_clients = {shard: get_client(shards[shard], 27017, username, password, auth_db, max_pool_size=max_workers,
+                                       name=f"{cluster_name}/{shard}")
+                     for shard in sorted(set(shard for _, shard in tasks))}
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(shard_clients))) as executor:
+        specs = list(executor.map(lambda task: list_index_specs(shard_clients[task[1]], *task), tasks))
+
+    for (namespace, shard), shard_specs in zip(tasks, specs):
+        shard_index_specs[namespace][shard] = shard_specs
+    logger.debug("Read the indexes of %d sharded collections from %d shards", len(owners), len(shard_clients),
+                 extra={"cluster": cluster_name})
+    return shard_index_specs
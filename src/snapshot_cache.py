@@ -0,0 +1,167 @@
+import os
+import time
+from typing import Dict, Optional
+
+from bson import json_util
+from pymongo import MongoClient
+
+from src.cluster_to_data_model import mongo_to_datamodel, index_spec_to_datamodel, get_all_mongo_users, \
+    SYSTEM_DATABASES
+from src.config_cache import cluster_to_cache_data, cluster_from_cache_data, CACHE_FORMAT_VERSION
+from src.diff_utils import generate_cluster_diff, ClusterDiff
+from src.mongo_data_model import MongoCluster, MongoDatabase, MongoCollection, invalidate_fingerprints
+from src.namespace_filter import NamespaceFilter
+
+# DDL events that change what mongo_to_datamodel would return; showExpandedEvents is needed for the index events
+DDL_EVENTS = ["create", "createIndexes", "dropIndexes", "drop", "rename", "dropDatabase"]
+
+
+def is_managed_namespace(db_name: str, collection_name: Optional[str] = None) -> bool:
+    return db_name not in SYSTEM_DATABASES and not (collection_name or "").startswith("system.")
+
+
+def find_database(cluster: MongoCluster, db_name: str, create: bool = False) -> Optional[MongoDatabase]:
+    db = next((db for db in cluster.databases if db.name == db_name), None)
+    if db is None and create:
+        db = MongoDatabase(name=db_name, collections=[], users=[])
+        cluster.databases.append(db)
+        cluster.databases.sort(key=lambda database: database.name)
+    return db
+
+
+def find_collection(db: MongoDatabase, collection_name: str, create: bool = False) -> Optional[MongoCollection]:
+    collection = next((collection for collection in db.collections if collection.name == collection_name), None)
+    if collection is None and create:
+        collection = MongoCollection(name=collection_name, indexes=[])
+        db.collections.append(collection)
+        db.collections.sort(key=lambda coll: coll.name)
+    return collection
+
+
+def remove_collection(cluster: MongoCluster, db_name: str, collection_name: str) -> Optional[MongoCollection]:
+    db = find_database(cluster, db_name)
+    collection = find_collection(db, collection_name) if db else None
+    if collection is None:
+        return None
+    db.collections.remove(collection)
+    invalidate_fingerprints(db)
+    if not db.collections:
+        # listDatabases stops reporting a database once its last collection is gone
+        cluster.databases.remove(db)
+    return collection
+
+
+def apply_change_event(cluster: MongoCluster, event: Dict) -> bool:
+    # Every event is applied idempotently, so replaying events from before the snapshot was taken is harmless.
+    # Returns whether the event concerned a managed namespace.
+    operation_type = event["operationType"]
+    namespace = event.get("ns", {})
+    db_name = namespace.get("db")
+    collection_name = namespace.get("coll")
+    if db_name is None or not is_managed_namespace(db_name, collection_name):
+        return False
+    description = event.get("operationDescription", {})
+
+    if operation_type == "dropDatabase":
+        db = find_database(cluster, db_name)
+        if db:
+            cluster.databases.remove(db)
+    elif operation_type == "drop":
+        remove_collection(cluster, db_name, collection_name)
+    elif operation_type == "rename":
+        collection = remove_collection(cluster, db_name, collection_name)
+        target = description["to"]
+        if is_managed_namespace(target["db"], target["coll"]):
+            db = find_database(cluster, target["db"], create=True)
+            target_collection = find_collection(db, target["coll"], create=True)
+            target_collection.indexes = collection.indexes if collection else []
+            invalidate_fingerprints(target_collection, db)
+    elif operation_type == "create" and "viewOn" in description:
+        # Views are not part of the model, mongo_to_datamodel only lists real collections
+        return False
+    elif operation_type in ("create", "createIndexes", "dropIndexes"):
+        db = find_database(cluster, db_name, create=True)
+        collection = find_collection(db, collection_name, create=True)
+        changed_names = set(index["name"] for index in description.get("indexes", []))
+        collection.indexes = [index for index in collection.indexes if index.name not in changed_names]
+        if operation_type == "createIndexes":
+            collection.indexes.extend(index_spec_to_datamodel(index) for index in description["indexes"]
+                                      if index["name"] != "_id_")
+        invalidate_fingerprints(collection, db)
+    else:
+        return False
+    return True
+
+
+class SnapshotCache:
+    # Keeps a MongoCluster snapshot current from a cluster-wide change stream instead of re-introspecting.
+    # The snapshot and the stream's resume token are stored together, without any secrets, in a JSON file.
+    # Change streams need a replica set or sharded cluster, and they do not report user changes, so
+    # refresh_users re-reads users with a single usersInfo command.
+    def __init__(self, path: str):
+        self.path = path
+        self.cluster = None
+        self.resume_token = None
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r') as file:
+            data = json_util.loads(file.read())
+        if data.get("format") != CACHE_FORMAT_VERSION:
+            # Written by a version with a different model layout; the caller seeds a fresh snapshot
+            return False
+        self.cluster = cluster_from_cache_data(data["cluster"])
+        self.resume_token = data["resume_token"]
+        return True
+
+    def save(self):
+        data = {"format": CACHE_FORMAT_VERSION,
+                "cluster": cluster_to_cache_data(self.cluster, include_secrets=False),
+                "resume_token": self.resume_token}
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as file:
+            file.write(json_util.dumps(data))
+        os.replace(temporary_path, self.path)
+
+    def watch(self, client: MongoClient, resume_token: Optional[Dict] = None):
+        return client.watch(pipeline=[{"$match": {"operationType": {"$in": DDL_EVENTS}}}],
+                            show_expanded_events=True, resume_after=resume_token)
+
+    def seed(self, client: MongoClient, cluster: MongoCluster, max_workers: Optional[int] = None):
+        # The stream is opened before the snapshot is taken, so nothing that happens in between is missed
+        with self.watch(client) as stream:
+            self.resume_token = stream.resume_token
+            self.cluster = mongo_to_datamodel(cluster.name, cluster.host, cluster.port, cluster.username,
+                                              cluster.password.get_secret_value(), cluster.authentication_database,
+                                              max_workers=max_workers, use_catalog=True,
+                                              namespace_filter=NamespaceFilter.from_rules(cluster.namespaces))
+        self.save()
+
+    def refresh_users(self, client: MongoClient):
+        users = get_all_mongo_users(client)
+        for db in self.cluster.databases:
+            db.users = users[db.name]
+            invalidate_fingerprints(db)
+
+    def follow(self, client: MongoClient, duration: Optional[float] = None, save_interval: float = 5.0) -> int:
+        # Applies DDL events until duration elapses (forever without one), saving at least every save_interval
+        # seconds so a restart resumes close to where it stopped. Returns the number of events applied.
+        applied = 0
+        deadline = time.monotonic() + duration if duration is not None else None
+        last_save = time.monotonic()
+        with self.watch(client, self.resume_token) as stream:
+            while stream.alive and (deadline is None or time.monotonic() < deadline):
+                event = stream.try_next()
+                if event is not None and apply_change_event(self.cluster, event):
+                    applied += 1
+                self.resume_token = stream.resume_token
+                if time.monotonic() - last_save >= save_interval:
+                    self.save()
+                    last_save = time.monotonic()
+        self.save()
+        return applied
+
+    def check_drift(self, desired_cluster: MongoCluster) -> ClusterDiff:
+        namespace_filter = NamespaceFilter.from_rules(desired_cluster.namespaces)
+        return generate_cluster_diff(self.cluster, desired_cluster, namespace_filter)
@@ -0,0 +1,165 @@
+import unittest
+
+from pydantic import SecretStr
+from pymongo.errors import OperationFailure
+
+from src.mongo_data_model import MongoCluster, MongoDatabase, MongoCollection, MongoIndex
+
+NAMESPACE_NOT_FOUND = 26
+
+
+def index_spec(name, key, unique=False):
+    # A listIndexes document as the server returns it
+    return {"v": 2, "key": key, "name": name, "unique": unique}
+
+
+class FakeCollection:
+    def __init__(self, indexes=None, documents=(), uuid=None):
+        # listIndexes documents, None for a collection that does not exist
+        self.indexes = indexes
+        # Returned by find and aggregate alike
+        self.documents = list(documents)
+        self.uuid = uuid
+        self.pipelines = []
+
+    def list_indexes(self):
+        if self.indexes is None:
+            raise OperationFailure("ns does not exist", code=NAMESPACE_NOT_FOUND)
+        return list(self.indexes)
+
+    def find(self, query=None, projection=None):
+        return list(self.documents)
+
+    def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        return list(self.documents)
+
+
+class FakeDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getitem__(self, collection_name):
+        return self.client.collections.get((self.name, collection_name), FakeCollection())
+
+    def __getattr__(self, collection_name):
+        if collection_name.startswith("_"):
+            raise AttributeError(collection_name)
+        return self[collection_name]
+
+    def list_collections(self, filter=None, **kwargs):
+        return [{"name": name, "type": "collection", "info": {"uuid": collection.uuid}}
+                for (db_name, name), collection in sorted(self.client.collections.items()) if db_name == self.name]
+
+    def aggregate(self, pipeline, **kwargs):
+        # Database level aggregations, i.e. $listCatalog on admin
+        self.client.pipelines.append(pipeline)
+        return list(self.client.catalog)
+
+    def command(self, command, *args, **kwargs):
+        return self.client.command(self.name, command, *args, **kwargs)
+
+
+class FakeClient:
+    # In-memory stand-in for MongoClient answering just the reads the tests need. collections maps
+    # (database, collection) to a FakeCollection; database_names lists databases that hold none.
+    def __init__(self, collections=None, database_names=None, users=(), catalog=()):
+        self.collections = dict(collections or {})
+        self.database_names = database_names
+        self.users = list(users)
+        self.catalog = list(catalog)
+        self.database_filters = []
+        self.pipelines = []
+
+    def list_databases(self, nameOnly=True, filter=None, **kwargs):
+        self.database_filters.append(filter)
+        names = self.database_names if self.database_names is not None \
+            else sorted(set(db_name for db_name, _ in self.collections))
+        return [{"name": name} for name in names]
+
+    def command(self, db_name, command, *args, **kwargs):
+        # Test cases needing other commands override this
+        if command == "usersInfo":
+            return {"users": self.users}
+        if command == "dbStats":
+            return {"indexes": sum(len(collection.indexes or []) for (name, _), collection in self.collections.items()
+                                   if name == db_name)}
+        raise AssertionError(f"unexpected command {command}")
+
+    def __getitem__(self, db_name):
+        return FakeDatabase(self, db_name)
+
+    def __getattr__(self, db_name):
+        if db_name.startswith("_"):
+            raise AttributeError(db_name)
+        return self[db_name]
+
+
+class FakeAsyncCursor:
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    async def to_list(self, length=None):
+        return self.documents
+
+
+class FakeAsyncCollection:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def list_indexes(self):
+        return FakeAsyncCursor(self.collection.list_indexes())
+
+
+class FakeAsyncDatabase:
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, collection_name):
+        return FakeAsyncCollection(self.database[collection_name])
+
+    async def list_collections(self, filter=None, **kwargs):
+        return FakeAsyncCursor(self.database.list_collections(filter, **kwargs))
+
+    async def aggregate(self, pipeline, **kwargs):
+        return FakeAsyncCursor(self.database.aggregate(pipeline, **kwargs))
+
+    async def command(self, command, *args, **kwargs):
+        return self.database.command(command, *args, **kwargs)
+
+
+class FakeAsyncClient:
+    # AsyncMongoClient over a FakeClient, so both share its state and command overrides
+    def __init__(self, client):
+        self.client = client
+        self.closed = False
+
+    async def list_databases(self, nameOnly=True, filter=None, **kwargs):
+        return FakeAsyncCursor(self.client.list_databases(nameOnly, filter, **kwargs))
+
+    def __getitem__(self, db_name):
+        return FakeAsyncDatabase(self.client[db_name])
+
+    def __getattr__(self, db_name):
+        if db_name.startswith("_"):
+            raise AttributeError(db_name)
+        return self[db_name]
+
+    async def close(self):
+        self.closed = True
+
+
+class ClusterTestCase(unittest.TestCase):
+
+    def create_mock_cluster(self, databases=(), name="test_cluster", **fields):
+        return MongoCluster(name=name, host="localhost", port=27017, username="user", password=SecretStr("pass"),
+                            authentication_database="admin", databases=list(databases), **fields)
+
+    def create_mock_database(self, name, collections=(), users=()):
+        return MongoDatabase(name=name, collections=list(collections), users=list(users))
+
+    def create_mock_collection(self, name, index_names=(), **fields):
+        # Every index is on the field it is named after
+        return MongoCollection(name=name, indexes=[MongoIndex(name=index_name, fields={index_name: 1})
+                                                   for index_name in index_names], **fields)
@@ -0,0 +1,122 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from pydantic import SecretStr
+
+from src.async_sync import async_sync_fleet, async_mongo_to_datamodel
+from src.config_to_mongo import ConfigChange
+from src.mongo_data_model import MongoCluster
+from test.helpers import FakeClient, FakeAsyncClient, FakeCollection, ClusterTestCase, index_spec
+
+
+class TestAsyncFleetSync(unittest.TestCase):
+
+    def create_changes(self, durations):
+        return [ConfigChange(MongoCluster(name=name, host="localhost", port=27017, username="user",
+                                          password=SecretStr("pass"), authentication_database="admin", databases=[]))
+                for name in durations]
+
+    def run_fleet(self, durations, **kwargs):
+        running = []
+        max_running = []
+
+        async def fake_sync_cluster(cluster, result, prune=False, dry_run=False, database_scope=None):
+            running.append(cluster.name)
+            max_running.append(len(running))
+            try:
+                await asyncio.sleep(durations[cluster.name])
+            finally:
+                running.remove(cluster.name)
+
+        with mock.patch("src.async_sync.async_sync_cluster", fake_sync_cluster):
+            report = asyncio.run(async_sync_fleet(self.create_changes(durations), **kwargs))
+        return report, max(max_running)
+
+    def test_clusters_run_concurrently(self):
+        durations = {f"cluster_{i}": 0.2 for i in range(5)}
+        start = time.perf_counter()
+        report, max_running = self.run_fleet(durations, max_concurrent_clusters=5)
+
+        self.assertLess(time.perf_counter() - start, 0.8)
+        self.assertEqual(max_running, 5)
+        self.assertEqual([result.status for result in report.results], ["ok"] * 5)
+
+    def test_concurrency_cap(self):
+        durations = {f"cluster_{i}": 0.05 for i in range(6)}
+        report, max_running = self.run_fleet(durations, max_concurrent_clusters=2)
+
+        self.assertEqual(max_running, 2)
+        self.assertEqual(len(report.results), 6)
+
+    def test_cluster_timeout(self):
+        report, _ = self.run_fleet({"fast": 0.01, "slow": 5}, cluster_timeout=0.2)
+
+        statuses = {result.cluster_name: result.status for result in report.results}
+        self.assertEqual(statuses, {"fast": "ok", "slow": "timeout"})
+        self.assertIn("slow: timeout", report.format())
+
+
+class TestAsyncIntrospection(unittest.TestCase):
+
+    def catalog_entry(self, db_name, name, *specs):
+        return {"db": db_name, "name": name, "type": "collection",
+                "md": {"indexes": [{"spec": spec} for spec in (index_spec("_id_", {"_id": 1}),) + specs]}}
+
+    def test_catalog_through_mongos(self):
+        # mongos returns one $listCatalog entry per shard holding the collection
+        entry = self.catalog_entry("shop", "orders", index_spec("status_1", {"status": 1}),
+                                   index_spec("notes_text", {"_fts": "text", "_ftsx": 1}))
+        client = FakeClient(database_names=["shop"], catalog=[entry, entry])
+        cluster = MongoCluster(name="sharded", host="localhost", port=27017, username="user",
+                               password=SecretStr("pass"), authentication_database="admin", databases=[])
+
+        live_cluster = asyncio.run(async_mongo_to_datamodel(FakeAsyncClient(client), cluster))
+
+        collections = live_cluster.databases[0].collections
+        self.assertEqual([collection.name for collection in collections], ["orders"])
+        self.assertEqual(sorted(index.name for index in collections[0].indexes), ["notes_text", "status_1"])
+
+
+class RecordingClient(FakeClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commands = []
+
+    def command(self, db_name, command, *args, **kwargs):
+        if command == "createIndexes":
+            self.commands.append((db_name, command, args, kwargs))
+            return {"ok": 1}
+        return super().command(db_name, command, *args, **kwargs)
+
+
+class BrokenClient(FakeClient):
+    def list_databases(self, nameOnly=True, filter=None, **kwargs):
+        raise ValueError("unexpected reply")
+
+
+class TestAsyncFleetApply(ClusterTestCase):
+
+    def test_fleet_applies_plans_and_isolates_failures(self):
+        desired = self.create_mock_cluster([self.create_mock_database("shop", [
+            self.create_mock_collection("orders", ["status"])])], name="healthy")
+        broken = self.create_mock_cluster(name="broken")
+        clients = {"healthy": FakeAsyncClient(RecordingClient({("shop", "orders"): FakeCollection([
+                       index_spec("_id_", {"_id": 1})])})),
+                   "broken": FakeAsyncClient(BrokenClient())}
+
+        with mock.patch("src.async_sync.create_async_client", lambda cluster: clients[cluster.name]):
+            report = asyncio.run(async_sync_fleet([ConfigChange(desired), ConfigChange(broken)]))
+
+        results = {result.cluster_name: result for result in report.results}
+        self.assertEqual(results["healthy"].status, "ok")
+        self.assertEqual(clients["healthy"].client.commands, [
+            ("shop", "createIndexes", ("orders",), {"indexes": [{"key": {"status": 1}, "name": "status"}]})])
+        self.assertEqual(results["broken"].status, "failed")
+        self.assertEqual(results["broken"].message, "ValueError: unexpected reply")
+        self.assertTrue(all(client.closed for client in clients.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
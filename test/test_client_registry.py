@@ -0,0 +1,40 @@
+import unittest
+
+from pydantic import SecretStr
+
+from src.client_registry import ClientRegistry
+from src.mongo_data_model import MongoCluster
+
+
+class TestClientRegistry(unittest.TestCase):
+
+    def setUp(self):
+        # Clients connect lazily, so no server is needed to check how they are shared
+        self.registry = ClientRegistry(max_pool_size=50, min_pool_size=1, compressors=["zlib"])
+        self.addCleanup(self.registry.close)
+        self.cluster = MongoCluster(name="test_cluster", host="localhost", port=27017, username="user",
+                                    password=SecretStr("pass"), authentication_database="admin", databases=[])
+
+    def test_same_parameters_share_a_client(self):
+        client = self.registry.get_cluster_client(self.cluster)
+        self.assertIs(self.registry.get_client("localhost", 27017, "user", "pass", "admin"), client)
+        self.assertIsNot(self.registry.get_client("localhost", 27017, "user", "other", "admin"), client)
+
+    def test_pool_settings(self):
+        client = self.registry.get_cluster_client(self.cluster)
+        self.assertEqual(client.options.pool_options.max_pool_size, 50)
+        self.assertEqual(client.options.pool_options.min_pool_size, 1)
+        self.assertEqual(client.options.pool_options._compression_settings.compressors, ["zlib"])
+
+        # More workers than pooled connections gets its own, larger pool
+        client = self.registry.get_cluster_client(self.cluster, max_pool_size=200)
+        self.assertEqual(client.options.pool_options.max_pool_size, 200)
+
+    def test_close(self):
+        client = self.registry.get_cluster_client(self.cluster)
+        self.registry.close()
+        self.assertIsNot(self.registry.get_cluster_client(self.cluster), client)
+
+
+if __name__ == '__main__':
+    unittest.main()
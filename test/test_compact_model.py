@@ -0,0 +1,87 @@
+import unittest
+from unittest import mock
+
+from pydantic import SecretStr
+
+from src.cluster_to_data_model import collection_from_index_specs, mongo_to_compact_datamodel
+from src.compact_model import Interner, CompactCluster, compact_cluster, expand_cluster, compact_user_from_info
+from src.diff_utils import generate_cluster_diff
+from src.mongo_data_model import MongoUser, MongoCollection, MongoIndex, MongoRole
+from src.namespace_filter import NamespaceFilter
+from src.plan_apply import generate_plan
+from test.helpers import ClusterTestCase, FakeClient
+
+
+class TestCompactModel(ClusterTestCase):
+
+    def create_cluster(self, extra_index=False):
+        indexes = [MongoIndex(name="status_1_created_-1", fields={"status": 1, "created": -1}),
+                   MongoIndex(name="order_id_1", fields={"order_id": 1}, unique=True)]
+        if extra_index:
+            indexes.append(MongoIndex(name="customer_1", fields={"customer": 1}))
+        return self.create_mock_cluster([self.create_mock_database(
+            "app",
+            [MongoCollection(name="orders", indexes=indexes), self.create_mock_collection("tmp_import")],
+            [MongoUser(username="app", password=SecretStr(""),
+                       roles=["readWrite", MongoRole(role="read", db="reporting")])])])
+
+    def test_fingerprints_match_the_pydantic_models(self):
+        cluster = self.create_cluster()
+        compact = compact_cluster(cluster)
+        for db, compact_db in zip(cluster.databases, compact.databases):
+            self.assertEqual(db.fingerprint, compact_db.fingerprint)
+        self.assertEqual(expand_cluster(compact), cluster)
+
+    def test_built_from_server_documents(self):
+        interner = Interner()
+        specs = [{"v": 2, "key": {"_id": 1}, "name": "_id_"},
+                 {"v": 2, "key": {"status": 1, "created": -1}, "name": "status_1_created_-1"},
+                 {"v": 2, "key": {"order_id": 1}, "name": "order_id_1", "unique": True}]
+        collection = collection_from_index_specs("orders", specs, interner)
+        self.assertEqual(collection.fingerprint, self.create_cluster().databases[0].collections[0].fingerprint)
+        self.assertEqual(collection.indexes[0].fields, {"status": 1, "created": -1})
+        self.assertTrue(collection.indexes[1].unique)
+
+        # Equal key patterns and roles are shared between objects
+        other = collection_from_index_specs("archive", [dict(spec) for spec in specs], interner)
+        self.assertIs(other.indexes[0].key_pattern, collection.indexes[0].key_pattern)
+        users = [compact_user_from_info({"user": name, "db": "app", "roles": [{"role": "read", "db": "reporting"}]},
+                                        interner) for name in ("a", "b")]
+        self.assertIs(users[0].roles[0], users[1].roles[0])
+        self.assertEqual(users[0].role_documents("app"), [{"role": "read", "db": "reporting"}])
+
+    def test_diff_against_pydantic_models(self):
+        live = compact_cluster(self.create_cluster())
+        desired = self.create_cluster(extra_index=True)
+        plan = generate_plan(generate_cluster_diff(live, desired), prune=True)
+        self.assertEqual([operation.describe() for operation in plan],
+                         [operation.describe() for operation in
+                          generate_plan(generate_cluster_diff(self.create_cluster(), desired), prune=True)])
+        self.assertEqual([operation.kind for operation in plan], ["create_indexes"])
+
+        namespace_filter = NamespaceFilter(exclude_collections=["tmp_*"])
+        diff = generate_cluster_diff(live, self.create_cluster(), namespace_filter)
+        self.assertFalse(diff.databases.changed)
+
+    def test_compact_snapshot_of_a_live_cluster(self):
+        specs = [{"spec": {"v": 2, "key": {"_id": 1}, "name": "_id_"}},
+                 {"spec": {"v": 2, "key": {"status": 1, "created": -1}, "name": "status_1_created_-1"}},
+                 {"spec": {"v": 2, "key": {"order_id": 1}, "name": "order_id_1", "unique": True}}]
+        client = FakeClient(database_names=["admin", "app"],
+                            catalog=[{"db": "app", "name": name, "md": {"indexes": specs if name == "orders" else []}}
+                                     for name in ("orders", "tmp_import")],
+                            users=[{"user": "app", "db": "app", "roles": [{"role": "readWrite", "db": "app"},
+                                                                          {"role": "read", "db": "reporting"}]}])
+        interner = Interner()
+        with mock.patch("src.cluster_to_data_model.get_client", return_value=client):
+            live = mongo_to_compact_datamodel("test_cluster", "localhost", 27017, "user", "pass", "admin",
+                                              interner=interner)
+        self.assertIsInstance(live, CompactCluster)
+        self.assertEqual([db.name for db in live.databases], ["app"])
+        self.assertIs(live.databases[0].collections[0].indexes[0].key_pattern,
+                      interner.key_pattern([("status", 1), ("created", -1)], False))
+        self.assertFalse(generate_cluster_diff(live, self.create_cluster()).databases.changed)
+
+
+if __name__ == '__main__':
+    unittest.main()
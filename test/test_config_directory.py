@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.config_directory import save_manifest, load_manifest
+from src.config_to_mongo import ConfigDirectoryLoader, parse_config_file
+
+CLUSTER_YAML = """
+name: {name}
+host: localhost
+port: 27017
+username: admin_user
+password: placeholder
+authentication_database: admin
+"""
+
+DATABASE_YAML = """
+name: {name}
+users:
+  - username: db_user
+    password: placeholder
+    roles:
+      - readWrite
+collections:
+  - name: test_collection
+    indexes:
+      - name: document_id
+        fields:
+          - id: {order}
+"""
+
+
+class TestConfigDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.manifest_path = os.path.join(self.path, ".manifest.json")
+        self.write("standalone.yml", CLUSTER_YAML.format(name="standalone_cluster") + "databases: []\n")
+        self.write("split/cluster.yml", CLUSTER_YAML.format(name="split_cluster"))
+        self.write("split/orders.yml", DATABASE_YAML.format(name="orders", order=1))
+        self.write("split/customers.yml", DATABASE_YAML.format(name="customers", order=1))
+
+    def write(self, relative_path, content):
+        os.makedirs(os.path.dirname(os.path.join(self.path, relative_path)), exist_ok=True)
+        with open(os.path.join(self.path, relative_path), 'w') as f:
+            f.write(content)
+
+    def sync(self):
+        loader = ConfigDirectoryLoader(self.path, load_manifest(self.manifest_path))
+        changes = [(change.cluster.name, [db.name for db in change.cluster.databases], change.database_scope)
+                   for change in loader.changes()]
+        save_manifest(self.manifest_path, loader.manifest)
+        return changes
+
+    def test_full_parse(self):
+        clusters = parse_config_file(self.path)
+        self.assertEqual([cluster.name for cluster in clusters], ["standalone_cluster", "split_cluster"])
+        self.assertEqual([db.name for db in clusters[1].databases], ["customers", "orders"])
+
+    def test_first_run_loads_everything(self):
+        self.assertEqual(self.sync(), [("standalone_cluster", [], None),
+                                       ("split_cluster", ["customers", "orders"], None)])
+
+    def test_unchanged_tree_loads_nothing(self):
+        self.sync()
+        self.assertEqual(self.sync(), [])
+
+    def test_changed_database_file(self):
+        self.sync()
+        self.write("split/orders.yml", DATABASE_YAML.format(name="orders", order=-1))
+        self.assertEqual(self.sync(), [("split_cluster", ["orders"], {"orders"})])
+
+    def test_removed_database_file(self):
+        self.sync()
+        os.remove(os.path.join(self.path, "split/customers.yml"))
+        self.assertEqual(self.sync(), [("split_cluster", [], {"customers"})])
+
+    def test_changed_cluster_file(self):
+        self.sync()
+        self.write("split/cluster.yml", CLUSTER_YAML.format(name="split_cluster").replace("27017", "27018"))
+        self.assertEqual(self.sync(), [("split_cluster", ["customers", "orders"], None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from pydantic import SecretStr
+
+from src.cluster_to_data_model import datamodel_to_config
+from src.config_export import write_config_file, write_config_directory
+from src.config_to_mongo import parse_config_file
+from src.mongo_data_model import MongoUser, MongoCollection, MongoIndex, MongoRole, MongoNamespaceRules
+from test.helpers import ClusterTestCase
+
+
+class TestConfigExport(ClusterTestCase):
+
+    def create_database(self, name):
+        return self.create_mock_database(
+            name,
+            [MongoCollection(name="orders", indexes=[
+                MongoIndex(name="status_1_created_-1", fields={"status": 1, "created": -1}),
+                MongoIndex(name="order_id_1", fields={"order_id": 1}, unique=True)])],
+            [MongoUser(username=f"{name}_user", password=SecretStr("secret"),
+                       roles=["readWrite", MongoRole(role="read", db="reporting")])])
+
+    def create_cluster(self, name, db_names):
+        return self.create_mock_cluster([self.create_database(db_name) for db_name in db_names], name=name,
+                                        namespaces=MongoNamespaceRules(exclude_collections=["tmp_*"]))
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.clusters = [self.create_cluster("first", ["app", "cluster"]), self.create_cluster("second", [])]
+
+    def test_file_round_trip(self):
+        path = os.path.join(self.temp_dir.name, "export.yml")
+        # Databases are consumed lazily, one at a time
+        write_config_file(path, ((cluster, iter(cluster.databases)) for cluster in self.clusters))
+        self.assertEqual(parse_config_file(path), self.clusters)
+
+        write_config_file(path, [])
+        self.assertEqual(parse_config_file(path), [])
+
+    def test_directory_round_trip(self):
+        write_config_directory(self.temp_dir.name, ((cluster, cluster.databases) for cluster in self.clusters))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.temp_dir.name, "first"))),
+                         ["app.yml", "cluster.db.yml", "cluster.yml"])
+        self.assertEqual(parse_config_file(self.temp_dir.name), self.clusters)
+
+    def test_omit_secrets(self):
+        path = os.path.join(self.temp_dir.name, "export.yml")
+        write_config_file(path, ((cluster, cluster.databases) for cluster in self.clusters), include_secrets=False)
+        with open(path) as file:
+            content = file.read()
+        self.assertNotIn("password", content)
+
+        clusters = parse_config_file(path)
+        self.assertEqual(clusters[0].password.get_secret_value(), "")
+        self.assertEqual(clusters[0].databases[0].users[0].password.get_secret_value(), "")
+        self.assertEqual(datamodel_to_config(clusters, include_secrets=False),
+                         datamodel_to_config(self.clusters, include_secrets=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
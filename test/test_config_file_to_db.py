@@ -29,7 +29,7 @@ class TestMongoDBSetup(unittest.TestCase):
                 )
             ]
         )
-        setup_cluster(cls.cluster)
+        cls.errors = setup_cluster(cls.cluster, max_workers=4)
 
         # Create a client for testing
         cls.client = MongoClient("localhost", 27017, username="mongolocal", password="mongosecret1a", authSource="admin")
@@ -41,6 +41,9 @@ class TestMongoDBSetup(unittest.TestCase):
         cls.client.drop_database("test_db")
         cls.client.close()
 
+    def test_no_index_errors(self):
+        self.assertEqual(self.errors, [])
+
     def test_collection_exists(self):
         collections = self.db.list_collection_names()
         self.assertIn("test_collection", collections)
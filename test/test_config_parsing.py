@@ -1,7 +1,37 @@
+import json
 import os
+import shutil
+import tempfile
 import unittest
-from src.mongo_data_model import MongoCluster, MongoDatabase, MongoUser, MongoCollection, MongoIndex
-from src.config_to_mongo import parse_config_file
+from src.mongo_data_model import MongoCluster, MongoDatabase, MongoUser, MongoCollection, MongoIndex, MongoRole
+from src.config_to_mongo import parse_config_file, iter_config_file
+
+MOCK_CACHED_YAML = """
+clusters:
+  - name: test_cluster
+    host: localhost
+    port: 27017
+    username: admin_user
+    password: placeholder
+    authentication_database: admin
+    databases:
+      - name: test_db
+        users:
+          - username: db_user
+            password: placeholder
+            roles:
+              - readWrite
+              - role: read
+                db: reporting
+        collections:
+          - name: test_collection
+            indexes:
+              - name: document_id
+                fields:
+                  - id: 1
+                  - created: -1
+                unique: true
+"""
 
 class TestConfigParsing(unittest.TestCase):
     def tearDown(self):
@@ -85,6 +115,73 @@ class TestConfigParsing(unittest.TestCase):
         self.assertDictEqual(index.fields, {'id': 1})
         self.assertTrue(index.unique)
 
+    def test_cached_parse(self):
+        with open('mock_config.yml', 'w') as f:
+            f.write(MOCK_CACHED_YAML)
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+
+        clusters = parse_config_file('mock_config.yml', cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        # Entries are plain JSON, only readable by their owner
+        cache_file = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        self.assertEqual(os.stat(cache_file).st_mode & 0o777, 0o600)
+        with open(cache_file) as f:
+            self.assertEqual(json.load(f)[0][0], clusters[0].name)
+        cached_clusters = parse_config_file('mock_config.yml', cache_dir=cache_dir)
+        self.assertEqual(cached_clusters, clusters)
+        self.assertEqual(cached_clusters[0].databases[0].users[0].password.get_secret_value(), 'placeholder')
+        self.assertEqual(cached_clusters[0].databases[0].users[0].roles,
+                         ['readWrite', MongoRole(role='read', db='reporting')])
+        self.assertEqual(cached_clusters[0].databases[0].fingerprint, clusters[0].databases[0].fingerprint)
+
+        # Any change to the file is a new cache key
+        with open('mock_config.yml', 'a') as f:
+            f.write("\n")
+        parse_config_file('mock_config.yml', cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_streaming_parse(self):
+        streaming_yaml = """
+        defaults: &defaults
+          host: localhost
+          port: 27017
+          username: admin_user
+          password: placeholder
+          authentication_database: admin
+        clusters:
+          - <<: *defaults
+            name: first_cluster
+            databases: []
+          - <<: *defaults
+            name: second_cluster
+            databases:
+              - name: test_db
+                collections:
+                  - name: test_collection
+                    indexes:
+                      - name: document_id
+                        fields:
+                          - id: 1
+        trailing_key: true
+        """
+        with open('mock_config.yml', 'w') as f:
+            f.write(streaming_yaml)
+
+        clusters = iter_config_file('mock_config.yml')
+        self.assertNotIsInstance(clusters, list)
+        clusters = list(clusters)
+        self.assertEqual(clusters, parse_config_file('mock_config.yml'))
+        self.assertEqual([cluster.name for cluster in clusters], ['first_cluster', 'second_cluster'])
+        self.assertEqual(clusters[1].port, 27017)
+
+    def test_streaming_missing_clusters(self):
+        with open('mock_config.yml', 'w') as f:
+            f.write("other: 1\n")
+
+        with self.assertRaises(KeyError):
+            list(iter_config_file('mock_config.yml'))
+
     def test_validation_error(self):
         # Incorrect YAML structure
         bad_yaml = """
@@ -1,8 +1,10 @@
 import unittest
 from src.diff_utils import generate_cluster_diff, DatabaseDiff, CollectionDiff, IndexDiff, UserDiff, MongoCluster, \
-    MongoDatabase, MongoCollection, MongoIndex, MongoUser
+    MongoDatabase, MongoCollection, MongoUser
 from pydantic import SecretStr
 
+from src.mongo_data_model import MongoIndex, MongoRole
+
 
 # Replace 'your_diff_script' with the actual name of your script
 
@@ -60,6 +62,77 @@ class TestMongoClusterDiff(unittest.TestCase):
         self.assertEqual(len(diff.databases.users_diff["db_0"].removed), 1)
         self.assertEqual(diff.databases.users_diff["db_0"].removed[0].username, "user_1")
 
+    def test_changed_role_database(self):
+        cluster1 = self.create_mock_cluster("Cluster1", 1, 1, 1, [1])
+        cluster2 = self.create_mock_cluster("Cluster1", 1, 1, 1, [1])
+        cluster2.databases[0].users[0].roles = [MongoRole(role="readWrite", db="other_db")]
+
+        diff = generate_cluster_diff(cluster1, cluster2)
+        roles_diff = diff.databases.users_diff["db_0"].changed["user_0"]
+        self.assertEqual(roles_diff.added, [MongoRole(role="readWrite", db="other_db")])
+        self.assertEqual(roles_diff.removed, ["readWrite"])
+
+    def test_role_name_matches_own_database(self):
+        cluster1 = self.create_mock_cluster("Cluster1", 1, 1, 1, [1])
+        cluster2 = self.create_mock_cluster("Cluster1", 1, 1, 1, [1])
+        cluster2.databases[0].users[0].roles = [MongoRole(role="readWrite", db="db_0")]
+
+        diff = generate_cluster_diff(cluster1, cluster2)
+        self.assertFalse(diff.databases.users_diff)
+
+    def test_same_role_on_own_and_other_database(self):
+        cluster1 = self.create_mock_cluster("Cluster1", 1, 1, 1, [1])
+        cluster2 = self.create_mock_cluster("Cluster1", 1, 1, 1, [1])
+        cluster2.databases[0].users[0].roles = ["readWrite", MongoRole(role="readWrite", db="other_db")]
+
+        diff = generate_cluster_diff(cluster1, cluster2)
+        roles_diff = diff.databases.users_diff["db_0"].changed["user_0"]
+        self.assertEqual(roles_diff.added, [MongoRole(role="readWrite", db="other_db")])
+        self.assertFalse(roles_diff.removed)
+
+    def test_reordered_collections_have_same_fingerprint(self):
+        cluster1 = self.create_mock_cluster("Cluster1", 1, 3, 2, [2])
+        cluster2 = self.create_mock_cluster("Cluster1", 1, 3, 2, [2])
+        cluster2.databases[0].collections.reverse()
+        cluster2.databases[0].users.reverse()
+
+        self.assertEqual(cluster1.databases[0].fingerprint, cluster2.databases[0].fingerprint)
+        diff = generate_cluster_diff(cluster1, cluster2)
+        self.assertFalse(diff.databases.changed)
+        self.assertFalse(diff.databases.users_diff)
+
+    def test_added_index_in_collection(self):
+        cluster1 = self.create_mock_cluster("Cluster1", 2, 2, 1, [1, 1])
+        cluster2 = self.create_mock_cluster("Cluster1", 2, 2, 1, [1, 1])
+        cluster2.databases[1].collections[0].indexes.append(MongoIndex(name="index_new", fields={"other": 1}))
+
+        diff = generate_cluster_diff(cluster1, cluster2)
+        self.assertEqual(list(diff.databases.changed), ["db_1"])
+        index_diff = diff.databases.changed["db_1"].changed["collection_0"]
+        self.assertEqual([index.name for index in index_diff.added], ["index_new"])
+        self.assertFalse(index_diff.removed)
+
+    def test_renamed_index_is_matched_on_key_pattern(self):
+        cluster1 = self.create_mock_cluster("Cluster1", 1, 1, 1, [1])
+        cluster2 = self.create_mock_cluster("Cluster1", 1, 1, 1, [1])
+        cluster2.databases[0].collections[0].indexes[0].name = "renamed_index"
+
+        index_diff = generate_cluster_diff(cluster1, cluster2).databases.changed["db_0"].changed["collection_0"]
+        self.assertFalse(index_diff.added)
+        self.assertFalse(index_diff.removed)
+        self.assertEqual([(old.name, new.name) for old, new in index_diff.renamed], [("index_0", "renamed_index")])
+
+    def test_changed_index_definition_is_rebuilt(self):
+        cluster1 = self.create_mock_cluster("Cluster1", 1, 1, 1, [1])
+        cluster2 = self.create_mock_cluster("Cluster1", 1, 1, 1, [1])
+        cluster2.databases[0].collections[0].indexes[0].unique = True
+
+        index_diff = generate_cluster_diff(cluster1, cluster2).databases.changed["db_0"].changed["collection_0"]
+        self.assertFalse(index_diff.added)
+        self.assertFalse(index_diff.removed)
+        self.assertEqual(len(index_diff.rebuilt), 1)
+        self.assertTrue(index_diff.rebuilt[0][1].unique)
+
     # Additional test cases can be added as needed...
 
 if __name__ == '__main__':
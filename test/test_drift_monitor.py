@@ -0,0 +1,92 @@
+import io
+import json
+import random
+import unittest
+from unittest import mock
+
+from src.drift_monitor import DriftMonitor, detect_drift, get_cluster_fingerprints, next_poll_delay
+from src.mongo_data_model import invalidate_fingerprints
+from test.helpers import ClusterTestCase, FakeClient, FakeCollection, index_spec
+
+
+class TestDriftMonitor(ClusterTestCase):
+
+    def create_client(self):
+        return FakeClient({("app", "orders"): FakeCollection([index_spec("_id_", {"_id": 1}),
+                                                              index_spec("customer_1", {"customer": 1})], uuid=1),
+                           ("reports", "daily"): FakeCollection([index_spec("_id_", {"_id": 1})], uuid=2)})
+
+    def create_database(self, name, index_names):
+        return self.create_mock_database(name, [self.create_mock_collection("orders", index_names)])
+
+    def test_fingerprints_track_catalog_changes(self):
+        client = self.create_client()
+        fingerprints = get_cluster_fingerprints(client)
+        self.assertEqual(sorted(fingerprints), ["app", "reports"])
+
+        client.collections[("app", "orders")].indexes.append(index_spec("manual_1", {"manual": 1}))
+        # Dropped and recreated
+        client.collections[("reports", "daily")] = FakeCollection([index_spec("_id_", {"_id": 1})], uuid=3)
+        changed = get_cluster_fingerprints(client)
+        self.assertNotEqual(changed["app"], fingerprints["app"])
+        self.assertNotEqual(changed["reports"], fingerprints["reports"])
+
+    def test_only_changed_databases_are_introspected(self):
+        client = self.create_client()
+        desired = self.create_mock_cluster([self.create_database("app", ["customer"]),
+                                            self.create_database("reports", ["day"])])
+        live = self.create_mock_cluster([self.create_database("app", ["customer", "manual"])])
+
+        with mock.patch("src.drift_monitor.mongo_to_compact_datamodel", return_value=live) as introspect:
+            fingerprints, events = detect_drift(desired, client)
+            self.assertIsNone(introspect.call_args.kwargs["databases"])
+
+            # Nothing moved, so nothing is introspected
+            self.assertEqual(detect_drift(desired, client, fingerprints)[1], [])
+            self.assertEqual(introspect.call_count, 1)
+
+            client.collections[("app", "orders")].indexes.append(index_spec("manual_1", {"manual": 1}))
+            fingerprints, events = detect_drift(desired, client, fingerprints)
+            self.assertEqual(introspect.call_args.kwargs["databases"], {"app"})
+            self.assertEqual([(event.database, event.kind, event.target) for event in events],
+                             [("app", "drop_index", "manual")])
+
+            live.databases[0].collections[0].indexes.pop()
+            invalidate_fingerprints(live.databases[0].collections[0], live.databases[0])
+            client.collections[("app", "orders")].indexes.pop()
+            events = detect_drift(desired, client, fingerprints)[1]
+            self.assertEqual([(event.database, event.kind) for event in events], [("app", "in_sync")])
+
+    def test_poll_delays_are_jittered(self):
+        rng = random.Random(1)
+        delays = [next_poll_delay(100, 0.2, rng) for _ in range(100)]
+        self.assertTrue(all(80 <= delay <= 120 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_monitor_writes_json_lines(self):
+        output = io.StringIO()
+        clusters = [self.create_mock_cluster(name=f"cluster_{i}") for i in range(3)]
+        monitor = DriftMonitor(clusters, interval=0.05, jitter=0.1, max_workers=2, output=output)
+
+        def fake_detect_drift(cluster, client, previous):
+            return {}, [] if previous is not None else [mock.Mock(to_json=lambda: json.dumps(cluster.name))]
+
+        with mock.patch("src.drift_monitor.detect_drift", fake_detect_drift), \
+                mock.patch("src.drift_monitor.get_cluster_client"):
+            monitor.run(duration=0.3)
+        self.assertEqual(sorted(json.loads(line) for line in output.getvalue().splitlines()),
+                         ["cluster_0", "cluster_1", "cluster_2"])
+
+
+    def test_failed_polls_are_reported_and_retried(self):
+        output = io.StringIO()
+        monitor = DriftMonitor([self.create_mock_cluster()], interval=0.05, jitter=0.1, output=output)
+        with mock.patch("src.drift_monitor.detect_drift", side_effect=KeyError("orders")), \
+                mock.patch("src.drift_monitor.get_cluster_client"), self.assertLogs("src.drift_monitor"):
+            monitor.poll(monitor.queue.pop())
+        self.assertEqual(json.loads(output.getvalue())["kind"], "error")
+        self.assertEqual(len(monitor.queue), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
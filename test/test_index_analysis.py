@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from pydantic import SecretStr
+
+from src.config_to_mongo import parse_config_file
+from src.index_analysis import find_redundant_indexes, find_unused_indexes, IndexUsage, analyze_collection, \
+    parse_timestamp, analyze_config_file, remove_flagged_indexes
+from src.mongo_data_model import MongoCluster, MongoDatabase, MongoCollection, MongoIndex, MongoNamespaceRules
+
+
+class TestIndexAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = MongoCollection(name="orders", indexes=[
+            MongoIndex(name="customer", fields={"customer": 1}),
+            MongoIndex(name="customer_date", fields={"customer": 1, "date": -1}),
+            MongoIndex(name="customer_desc", fields={"customer": -1}),
+            MongoIndex(name="order_id", fields={"order_id": 1}, unique=True),
+            MongoIndex(name="order_id_date", fields={"order_id": 1, "date": 1}),
+            MongoIndex(name="customer_date_copy", fields={"customer": 1, "date": -1}),
+            MongoIndex(name="order_id_copy", fields={"order_id": 1}),
+        ])
+
+    def test_prefix_indexes_are_redundant(self):
+        redundant = find_redundant_indexes(self.collection)
+        self.assertEqual([(index.name, covering.name) for index, covering in redundant],
+                         [("customer", "customer_date"), ("customer_date_copy", "customer_date"),
+                          ("order_id_copy", "order_id")])
+
+    def test_unused_indexes_respect_counter_window(self):
+        usage = {
+            "customer": IndexUsage(0, datetime(2026, 1, 1)),
+            "customer_date": IndexUsage(25, datetime(2026, 1, 1)),
+            "customer_desc": IndexUsage(0, datetime(2026, 9, 1)),
+            "order_id": IndexUsage(3, datetime(2026, 1, 1)),
+        }
+        unused = find_unused_indexes(self.collection, usage, unused_since=datetime(2026, 6, 1))
+        self.assertEqual([index.name for index in unused], ["customer"])
+        unused = find_unused_indexes(self.collection, usage)
+        self.assertEqual([index.name for index in unused], ["customer", "customer_desc"])
+
+    def test_analyze_collection(self):
+        usage = {"order_id_date": IndexUsage(0, datetime(2026, 1, 1))}
+        findings = analyze_collection("shop", self.collection, usage)
+        self.assertEqual([(finding.index.name, finding.reason) for finding in findings],
+                         [("order_id_date", "unused"), ("customer", "redundant"),
+                          ("customer_date_copy", "redundant"), ("order_id_copy", "redundant")])
+        self.assertEqual(findings[2].detail, "key pattern is the same as customer_date")
+
+    def test_findings_never_remove_needed_indexes(self):
+        collection = MongoCollection(name="users", indexes=[
+            MongoIndex(name="a_1", fields={"a": 1}),
+            MongoIndex(name="a_1_b_1", fields={"a": 1, "b": 1}),
+            MongoIndex(name="email_1", fields={"email": 1}, unique=True),
+        ])
+        usage = {"a_1": IndexUsage(1000, datetime(2026, 1, 1)), "a_1_b_1": IndexUsage(0, datetime(2026, 1, 1)),
+                 "email_1": IndexUsage(0, datetime(2026, 1, 1))}
+        # a_1 is only redundant as long as a_1_b_1 stays, and a unique index is kept for its constraint
+        findings = analyze_collection("shop", collection, usage)
+        self.assertEqual([(finding.index.name, finding.reason) for finding in findings], [("a_1_b_1", "unused")])
+        cluster = MongoCluster(name="test_cluster", host="localhost", port=27017, username="user",
+                               password=SecretStr("pass"), authentication_database="admin",
+                               databases=[MongoDatabase(name="shop", collections=[collection], users=[])])
+        cleaned = remove_flagged_indexes(cluster, findings)
+        self.assertEqual([index.name for index in cleaned.databases[0].collections[0].indexes], ["a_1", "email_1"])
+
+    def test_timestamps_are_naive_utc(self):
+        self.assertEqual(parse_timestamp("2026-06-01T02:00:00+02:00"), datetime(2026, 6, 1))
+        self.assertEqual(parse_timestamp("2026-06-01T00:00:00"), datetime(2026, 6, 1))
+
+    def test_output_config_keeps_cluster_settings(self):
+        config_cluster = MongoCluster(name="test_cluster", host="localhost", port=27017, username="user",
+                                      password=SecretStr("pass"), authentication_database="admin", databases=[],
+                                      namespaces=MongoNamespaceRules(exclude_collections=["tmp_*"]), sharded=True)
+        live_cluster = config_cluster.model_copy(update={
+            "databases": [MongoDatabase(name="shop", collections=[self.collection], users=[])],
+            "namespaces": None, "sharded": False})
+        findings = analyze_collection("shop", self.collection, {})
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        path = os.path.join(temp_dir.name, "cleaned.yml")
+
+        with mock.patch("src.index_analysis.parse_config_file", return_value=[config_cluster]), \
+                mock.patch("src.index_analysis.mongo_to_datamodel", return_value=live_cluster), \
+                mock.patch("src.index_analysis.analyze_cluster", return_value=findings), \
+                mock.patch("src.index_analysis.get_cluster_client"):
+            analyze_config_file("config.yml", output_config_path=path)
+        cleaned = parse_config_file(path)[0]
+        self.assertEqual(cleaned.namespaces, config_cluster.namespaces)
+        self.assertTrue(cleaned.sharded)
+        self.assertEqual([index.name for index in cleaned.databases[0].collections[0].indexes],
+                         ["customer_date", "customer_desc", "order_id", "order_id_date"])
+
+
+if __name__ == '__main__':
+    unittest.main()
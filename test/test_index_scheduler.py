@@ -0,0 +1,89 @@
+import threading
+import time
+import unittest
+
+from src.index_scheduler import IndexBuildScheduler, IndexBuild, IndexBuildProgress
+from src.mongo_data_model import MongoIndex
+from test.helpers import FakeClient
+
+
+class BuildCountingClient(FakeClient):
+    # Answers collStats from the given collection sizes and keeps track of how many builds run at once
+    def __init__(self, sizes):
+        super().__init__()
+        self.sizes = sizes
+        self.lock = threading.Lock()
+        self.started = []
+        self.running = {}
+        self.max_running = 0
+        self.max_running_per_database = 0
+
+    def command(self, db_name, command, collection_name=None, **kwargs):
+        if command == "collStats":
+            return {"count": self.sizes[(db_name, collection_name)], "size": 0}
+        with self.lock:
+            self.started.append((db_name, collection_name, kwargs))
+            self.running[db_name] = self.running.get(db_name, 0) + 1
+            self.max_running = max(self.max_running, sum(self.running.values()))
+            self.max_running_per_database = max(self.max_running_per_database, self.running[db_name])
+        time.sleep(0.01)
+        with self.lock:
+            self.running[db_name] -= 1
+        return {"ok": 1}
+
+
+class TestIndexBuildScheduler(unittest.TestCase):
+
+    def create_builds(self, sizes):
+        return [IndexBuild(database, collection, [MongoIndex(name="by_field", fields={"field": 1})])
+                for database, collection in sizes]
+
+    def test_builds_run_cheapest_first_with_options(self):
+        sizes = {("db_0", "large"): 1000, ("db_0", "small"): 10, ("db_1", "medium"): 100}
+        client = BuildCountingClient(sizes)
+        scheduler = IndexBuildScheduler(commit_quorum="majority", max_time_ms=1000, progress_interval=None)
+
+        self.assertEqual(scheduler.run(client, self.create_builds(sizes)), [])
+        self.assertEqual([(database, collection) for database, collection, _ in client.started],
+                         [("db_0", "small"), ("db_1", "medium"), ("db_0", "large")])
+        self.assertEqual(client.started[0][2]["commitQuorum"], "majority")
+        self.assertEqual(client.started[0][2]["maxTimeMS"], 1000)
+
+    def test_concurrency_limits(self):
+        sizes = {(f"db_{i % 2}", f"collection_{i}"): i for i in range(12)}
+        client = BuildCountingClient(sizes)
+        scheduler = IndexBuildScheduler(max_concurrent_builds=4, max_concurrent_builds_per_database=1,
+                                        progress_interval=None)
+
+        self.assertEqual(scheduler.run(client, self.create_builds(sizes)), [])
+        self.assertEqual(len(client.started), 12)
+        self.assertLessEqual(client.max_running, 2)
+        self.assertEqual(client.max_running_per_database, 1)
+
+
+    def test_builds_are_reported_as_they_start_and_finish(self):
+        sizes = {(f"db_{i}", "orders"): i for i in range(3)}
+        client = BuildCountingClient(sizes)
+        events = []
+        scheduler = IndexBuildScheduler(max_concurrent_builds=2, progress_interval=None)
+
+        scheduler.run(client, self.create_builds(sizes),
+                      on_start=lambda build: events.append(("start", build.database)),
+                      on_finish=lambda build, build_errors: events.append(("finish", build.database, build_errors)))
+        self.assertEqual(events[:2], [("start", "db_0"), ("start", "db_1")])
+        # The third build waits for a slot, so it starts after one of the others is reported done
+        self.assertEqual(events[2][0], "finish")
+        self.assertEqual(sorted(event[1] for event in events if event[0] == "finish"), ["db_0", "db_1", "db_2"])
+        self.assertTrue(all(event[2] == [] for event in events if event[0] == "finish"))
+
+
+    def test_progress_is_logged_by_default(self):
+        scheduler = IndexBuildScheduler()
+        with self.assertLogs("src.index_scheduler", "INFO") as logs:
+            scheduler.progress_callback(IndexBuildProgress("db_0.orders", "Index Build: scanning", 10, 100))
+        self.assertEqual(logs.records[0].namespace, "db_0.orders")
+        self.assertIn("(10/100)", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
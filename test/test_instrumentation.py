@@ -0,0 +1,85 @@
+import json
+import logging
+import unittest
+from types import SimpleNamespace
+
+from src.client_registry import ClientRegistry
+from src.instrumentation import RunMetrics, CommandMetricsListener, JsonLogFormatter, LatencyHistogram
+
+
+def command_event(request_id, command_name="listIndexes", database="app", duration_micros=2000, **kwargs):
+    return SimpleNamespace(connection_id=("localhost", 27017), request_id=request_id, command_name=command_name,
+                           database_name=database, duration_micros=duration_micros, **kwargs)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = LatencyHistogram()
+        for seconds in (0.0005, 0.003, 0.2, 100):
+            histogram.observe(seconds)
+        buckets = histogram.to_dict()["buckets"]
+        self.assertEqual(buckets["0.001"], 1)
+        self.assertEqual(buckets["0.005"], 2)
+        self.assertEqual(buckets["0.5"], 3)
+        self.assertEqual(buckets["+Inf"], 4)
+
+    def test_command_listener(self):
+        metrics = RunMetrics()
+        listener = CommandMetricsListener(metrics, "test_cluster")
+        listener.started(command_event(1, command={"listIndexes": "orders"}))
+        listener.started(command_event(2, command={"listIndexes": "users"}))
+        listener.succeeded(command_event(1, reply={"ok": 1}))
+        listener.failed(command_event(2, duration_micros=5000))
+        # Auth commands are published without their bodies
+        listener.started(command_event(3, command_name="saslStart", database="admin", command={}))
+        listener.succeeded(command_event(3, command_name="saslStart", database="admin", reply={}))
+
+        stats = metrics.commands[("test_cluster", "app", "listIndexes")]
+        self.assertEqual(stats.latency.count, 2)
+        self.assertAlmostEqual(stats.latency.total, 0.007)
+        self.assertEqual(stats.failures, 1)
+        self.assertGreater(stats.request_bytes, 0)
+        self.assertGreater(stats.reply_bytes, 0)
+        self.assertEqual(metrics.commands[("test_cluster", "admin", "saslStart")].request_bytes, 0)
+
+    def test_reports(self):
+        metrics = RunMetrics()
+        with metrics.phase("diff", "test_cluster"):
+            pass
+        self.assertEqual(list(metrics.timed_iter(["a", "b"], "parse_config")), ["a", "b"])
+        metrics.record_command('test"cluster', "app", "createIndexes", 0.02, False, 100, 40)
+
+        report = metrics.to_report()
+        self.assertEqual([(phase["cluster"], phase["phase"]) for phase in report["phases"]],
+                         [("", "parse_config"), ("test_cluster", "diff")])
+        self.assertEqual(report["commands"][0]["request_bytes"], 100)
+
+        prometheus = metrics.to_prometheus()
+        self.assertIn('mongo_as_code_command_duration_seconds_bucket{cluster="test\\"cluster",database="app",'
+                      'command="createIndexes",le="0.05"} 1', prometheus)
+        self.assertIn('mongo_as_code_command_reply_bytes_total{cluster="test\\"cluster",database="app",'
+                      'command="createIndexes"} 40', prometheus)
+        self.assertIn("# TYPE mongo_as_code_phase_duration_seconds histogram", prometheus)
+
+    def test_registry_attaches_listeners(self):
+        registry = ClientRegistry()
+        self.addCleanup(registry.close)
+        names = []
+        registry.listener_factory = lambda name: names.append(name) or [CommandMetricsListener(RunMetrics(), name)]
+        client = registry.get_client("localhost", 27017, "user", "pass", "admin", name="test_cluster")
+        self.assertEqual(names, ["test_cluster"])
+        self.assertIsInstance(client.options.event_listeners[0], CommandMetricsListener)
+
+    def test_json_log_formatter(self):
+        record = logging.LogRecord("src.plan_apply", logging.INFO, __file__, 1, "%s: no changes", ("test_cluster",),
+                                   None)
+        record.cluster = "test_cluster"
+        entry = json.loads(JsonLogFormatter().format(record))
+        self.assertEqual(entry["message"], "test_cluster: no changes")
+        self.assertEqual(entry["cluster"], "test_cluster")
+        self.assertEqual(entry["level"], "INFO")
+
+
+if __name__ == '__main__':
+    unittest.main()
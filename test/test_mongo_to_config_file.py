@@ -29,5 +29,26 @@ class TestMongoConfigLoading(unittest.TestCase):
         self.assertIn("test_collection", [col.name for col in test_db.collections])
         self.assertIn("test_user", [user.username for user in test_db.users])
 
+    def test_config_loading_concurrent(self):
+        cluster = mongo_to_datamodel("MyCluster", "localhost", 27017, "mongolocal", "mongosecret1a", "admin",
+                                     max_workers=8)
+
+        db_names = [db.name for db in cluster.databases]
+        self.assertEqual(db_names, sorted(db_names))
+        test_db = next(db for db in cluster.databases if db.name == self.db_name)
+
+        self.assertIn("test_collection", [col.name for col in test_db.collections])
+        self.assertIn("test_user", [user.username for user in test_db.users])
+
+    def test_config_loading_catalog(self):
+        cluster = mongo_to_datamodel("MyCluster", "localhost", 27017, "mongolocal", "mongosecret1a", "admin",
+                                     use_catalog=True)
+        reference = mongo_to_datamodel("MyCluster", "localhost", 27017, "mongolocal", "mongosecret1a", "admin",
+                                       max_workers=8)
+
+        test_db = next(db for db in cluster.databases if db.name == self.db_name)
+        reference_db = next(db for db in reference.databases if db.name == self.db_name)
+        self.assertEqual(test_db.collections, reference_db.collections)
+
 if __name__ == '__main__':
     unittest.main()
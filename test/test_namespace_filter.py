@@ -0,0 +1,80 @@
+import unittest
+
+from src.cluster_to_data_model import list_database_names, datamodel_to_config
+from src.config_cache import cluster_to_cache_data, cluster_from_cache_data
+from src.config_to_mongo import parse_config
+from src.diff_utils import generate_cluster_diff
+from src.mongo_data_model import MongoNamespaceRules
+from src.namespace_filter import NamespaceFilter
+from test.helpers import ClusterTestCase, FakeClient
+
+
+class TestNamespaceFilter(ClusterTestCase):
+
+    def create_database(self, name, collections, indexes=1):
+        index_names = [f"index_{k}" for k in range(indexes)]
+        return self.create_mock_database(name, [self.create_mock_collection(collection, index_names)
+                                                for collection in collections])
+
+    def setUp(self):
+        self.namespace_filter = NamespaceFilter(include_databases=["app_*", "re:shop(_eu|_us)?"],
+                                                exclude_databases=["app_scratch"],
+                                                exclude_collections=["tmp_*", "app_*.cache", "re:.*\\.bak"])
+
+    def test_database_rules(self):
+        self.assertTrue(self.namespace_filter.includes_database("app_orders"))
+        self.assertTrue(self.namespace_filter.includes_database("shop_eu"))
+        self.assertFalse(self.namespace_filter.includes_database("shop_asia"))
+        self.assertFalse(self.namespace_filter.includes_database("app_scratch"))
+        self.assertFalse(self.namespace_filter.includes_database("analytics"))
+
+    def test_collection_rules(self):
+        self.assertTrue(self.namespace_filter.includes_collection("app_orders", "orders"))
+        self.assertFalse(self.namespace_filter.includes_collection("app_orders", "tmp_import"))
+        self.assertFalse(self.namespace_filter.includes_collection("app_orders", "orders.bak"))
+        # The database part of a rule limits it to matching databases
+        self.assertFalse(self.namespace_filter.includes_collection("app_orders", "cache"))
+        self.assertTrue(self.namespace_filter.includes_collection("shop", "cache"))
+
+    def test_server_filters(self):
+        client = FakeClient(database_names=["app_orders", "app_scratch", "analytics", "shop"])
+        # Names the server would have filtered out are dropped locally as well
+        self.assertEqual(list_database_names(client, ["app_orders", "shop"], self.namespace_filter),
+                         ["app_orders", "shop"])
+        query = client.database_filters[0]
+        self.assertEqual(query["$and"][0], {"name": {"$in": ["app_orders", "shop"]}})
+        self.assertEqual(len(query["$and"]), 3)
+        self.assertIn("$not", query["$and"][2]["name"])
+
+        self.assertNotIn("cache", self.namespace_filter.collection_filter("shop")["name"]["$not"]["$regex"])
+        self.assertIn("cache", self.namespace_filter.collection_filter("app_orders")["name"]["$not"]["$regex"])
+        self.assertEqual(NamespaceFilter().database_filter(), {})
+
+    def test_diff_ignores_excluded_namespaces(self):
+        live = self.create_mock_cluster([self.create_database("app_orders", ["orders", "tmp_import"]),
+                                          self.create_database("analytics", ["events"])])
+        desired = self.create_mock_cluster([self.create_database("app_orders", ["orders", "tmp_export"], indexes=2)])
+
+        diff = generate_cluster_diff(live, desired, self.namespace_filter)
+        self.assertFalse(diff.databases.removed)
+        collection_diff = diff.databases.changed["app_orders"]
+        self.assertFalse(collection_diff.added)
+        self.assertFalse(collection_diff.removed)
+        self.assertEqual([index.name for index in collection_diff.changed["orders"].added], ["index_1"])
+
+        # Without the filter every namespace counts
+        diff = generate_cluster_diff(live, desired)
+        self.assertEqual([db.name for db in diff.databases.removed], ["analytics"])
+
+    def test_rules_in_config(self):
+        rules = MongoNamespaceRules(include_databases=["app_*"], exclude_collections=["tmp_*"])
+        cluster = self.create_mock_cluster([self.create_database("app_orders", ["orders"])], namespaces=rules)
+        config = datamodel_to_config([cluster])
+        self.assertEqual(config["clusters"][0]["namespaces"],
+                         {"include_databases": ["app_*"], "exclude_collections": ["tmp_*"]})
+        self.assertEqual(parse_config(config)[0].namespaces, rules)
+        self.assertEqual(cluster_from_cache_data(cluster_to_cache_data(cluster)).namespaces, rules)
+
+
+if __name__ == '__main__':
+    unittest.main()
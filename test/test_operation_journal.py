@@ -0,0 +1,135 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from pydantic import SecretStr
+from pymongo.errors import OperationFailure
+
+from src.config_to_mongo import IndexCreationError
+from src.mongo_data_model import MongoUser, MongoIndex
+from src.operation_journal import OperationJournal, PLANNED, STARTED, COMPLETED, FAILED
+from src.plan_apply import create_indexes_operation, create_user_operation, operation_to_record, operation_id, \
+    resume_plan, apply_plan
+from test.helpers import ClusterTestCase, FakeClient, FakeCollection
+
+
+class TestOperationJournal(ClusterTestCase):
+
+    def create_client(self, index_names):
+        indexes = [{"name": name} for name in index_names]
+        return FakeClient({("app", "orders"): FakeCollection(indexes), ("app", "users"): FakeCollection(indexes)})
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = os.path.join(self.temp_dir.name, "journal.jsonl")
+        self.cluster = self.create_mock_cluster([self.create_mock_database(
+            "app", [self.create_mock_collection("orders")],
+            [MongoUser(username="app", password=SecretStr("secret"), roles=["readWrite"])])])
+        self.user_operation = create_user_operation("app", self.cluster.databases[0].users[0])
+        self.orders_operation = create_indexes_operation("app", "orders", [
+            MongoIndex(name="customer_1", fields={"customer": 1}),
+            MongoIndex(name="status_1_created_-1", fields={"status": 1, "created": -1})])
+        self.users_operation = create_indexes_operation("app", "users", [
+            MongoIndex(name="email_1", fields={"email": 1}, unique=True)])
+        self.plan = [self.user_operation, self.orders_operation, self.users_operation]
+
+    def write_interrupted_run(self):
+        with OperationJournal(self.path) as journal:
+            journal.open()
+            journal.record_plan("test_cluster", [operation_to_record(operation) for operation in self.plan])
+            journal.record(STARTED, "test_cluster", operation_id(self.user_operation))
+            journal.record(COMPLETED, "test_cluster", operation_id(self.user_operation))
+            journal.record(STARTED, "test_cluster", operation_id(self.orders_operation))
+            journal.record(STARTED, "test_cluster", operation_id(self.users_operation))
+
+    def test_load_statuses(self):
+        self.write_interrupted_run()
+        with OperationJournal(self.path) as journal:
+            journal.open(resume=True)
+            journal.record(FAILED, "test_cluster", operation_id(self.users_operation), "duplicate key")
+        with open(self.path, 'a') as file:
+            file.write('{"event": "completed", "cluster": "test_clu')
+
+        plan = OperationJournal(self.path).load()["test_cluster"]
+        self.assertEqual([record["id"] for record in plan.operations], [operation_id(op) for op in self.plan])
+        self.assertEqual([plan.status[operation_id(op)] for op in self.plan], [COMPLETED, STARTED, FAILED])
+        self.assertEqual(plan.messages[operation_id(self.users_operation)], "duplicate key")
+        self.assertEqual([record["id"] for record in plan.in_flight()], [operation_id(self.orders_operation)])
+        self.assertEqual(OperationJournal(os.path.join(self.temp_dir.name, "missing.jsonl")).load(), {})
+
+    def test_scheduled_builds_are_journaled_as_they_run(self):
+        plan = [self.orders_operation, self.users_operation]
+        statuses = []
+
+        def run(client, builds, on_start, on_finish):
+            # The users build starts only after the orders build is done, and fails
+            for build, build_errors in zip(builds, [[], [IndexCreationError("app", "users", "email_1", "E11000")]]):
+                on_start(build)
+                statuses.append(OperationJournal(self.path).load()["test_cluster"].status.copy())
+                on_finish(build, build_errors)
+            return []
+
+        with mock.patch("src.plan_apply.get_cluster_client"), OperationJournal(self.path) as journal:
+            journal.open()
+            journal.record_plan("test_cluster", [operation_to_record(operation) for operation in plan])
+            errors = apply_plan(self.cluster, plan, scheduler=mock.Mock(run=run), journal=journal)
+        self.assertEqual([[status[operation_id(operation)] for operation in plan] for status in statuses],
+                         [[STARTED, PLANNED], [COMPLETED, STARTED]])
+        journaled_plan = OperationJournal(self.path).load()["test_cluster"]
+        self.assertEqual(journaled_plan.status[operation_id(self.users_operation)], FAILED)
+        self.assertEqual([error.message for error in errors], ["email_1: E11000"])
+
+    def test_in_flight_operations_that_took_effect_count_as_completed(self):
+        with OperationJournal(self.path) as journal:
+            journal.open()
+            journal.record_plan("test_cluster", [operation_to_record(self.user_operation)])
+            journal.record(STARTED, "test_cluster", operation_id(self.user_operation))
+        journaled_plan = OperationJournal(self.path).load()["test_cluster"]
+
+        # The interrupted run had created the user already
+        client = mock.MagicMock()
+        client["app"].command.side_effect = OperationFailure("User \"app@app\" already exists", code=51003)
+        with mock.patch("src.plan_apply.get_cluster_client", return_value=client):
+            plan = resume_plan(self.cluster, journaled_plan)
+            self.assertEqual(apply_plan(self.cluster, plan), [])
+            # Outside a resumed run the same error is a failure
+            self.assertEqual(len(apply_plan(self.cluster, [self.user_operation])), 1)
+
+    def test_passwords_stay_out_of_the_journal(self):
+        with OperationJournal(self.path) as journal:
+            journal.open()
+            journal.record_plan("test_cluster", [operation_to_record(operation) for operation in self.plan])
+        with open(self.path) as file:
+            self.assertNotIn("secret", file.read())
+        plan = OperationJournal(self.path).load()["test_cluster"]
+        # Resuming takes the password from the config again
+        with mock.patch("src.plan_apply.get_cluster_client"):
+            operation = resume_plan(self.cluster, plan)[0]
+        self.assertEqual(operation.command["pwd"], "secret")
+
+    def test_resume_skips_completed_and_rechecks_in_flight_builds(self):
+        self.write_interrupted_run()
+        journaled_plan = OperationJournal(self.path).load()["test_cluster"]
+        progress = [[SimpleNamespace(namespace="app.orders")], [], []]
+
+        # The orders build is still running on the first check and has built both indexes by the second; the users
+        # build died without creating its index
+        client = self.create_client(["_id_", "customer_1", "status_1_created_-1"])
+        with mock.patch("src.plan_apply.get_cluster_client", return_value=client), \
+                mock.patch("src.plan_apply.get_index_build_progress", side_effect=lambda _: progress.pop(0)), \
+                mock.patch("src.plan_apply.time.sleep") as sleep, \
+                OperationJournal(self.path) as journal:
+            journal.open(resume=True)
+            plan = resume_plan(self.cluster, journaled_plan, journal)
+        sleep.assert_called_once()
+        self.assertEqual([operation_id(operation) for operation in plan], [operation_id(self.users_operation)])
+        self.assertEqual(plan[0].indexes[0].unique, True)
+        self.assertEqual(OperationJournal(self.path).load()["test_cluster"].status[operation_id(self.orders_operation)],
+                         COMPLETED)
+
+
+if __name__ == '__main__':
+    unittest.main()
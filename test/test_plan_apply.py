@@ -0,0 +1,81 @@
+import unittest
+from pydantic import SecretStr
+
+from src.diff_utils import generate_cluster_diff
+from src.mongo_data_model import MongoCluster, MongoDatabase, MongoUser, MongoCollection, MongoIndex
+from src.plan_apply import generate_plan
+
+
+class TestGeneratePlan(unittest.TestCase):
+
+    def create_cluster(self, databases):
+        return MongoCluster(
+            name="test_cluster",
+            host="localhost",
+            port=27017,
+            username="user",
+            password=SecretStr("pass"),
+            authentication_database="admin",
+            databases=databases
+        )
+
+    def create_database(self, name, index_names, usernames, extra_collections=()):
+        return MongoDatabase(
+            name=name,
+            collections=[MongoCollection(name="test_collection",
+                                         indexes=[MongoIndex(name=index_name, fields={index_name: 1})
+                                                  for index_name in index_names])]
+                        + [MongoCollection(name=collection_name, indexes=[]) for collection_name in extra_collections],
+            users=[MongoUser(username=username, password=SecretStr("secret"), roles=["readWrite"])
+                   for username in usernames]
+        )
+
+    def test_no_changes(self):
+        live = self.create_cluster([self.create_database("test_db", ["a", "b"], ["user_a"])])
+        desired = self.create_cluster([self.create_database("test_db", ["a", "b"], ["user_a"])])
+
+        self.assertEqual(generate_plan(generate_cluster_diff(live, desired)), [])
+
+    def test_only_missing_objects_are_created(self):
+        live = self.create_cluster([self.create_database("test_db", ["a"], ["user_a"])])
+        desired = self.create_cluster([self.create_database("test_db", ["a", "b"], ["user_a", "user_b"],
+                                                            ["empty_collection"])])
+
+        plan = generate_plan(generate_cluster_diff(live, desired))
+        self.assertEqual(sorted(operation.kind for operation in plan),
+                         ["create_collection", "create_indexes", "create_user"])
+        index_operation = next(operation for operation in plan if operation.kind == "create_indexes")
+        self.assertEqual(index_operation.command["indexes"], [{"key": {"b": 1}, "name": "b"}])
+        user_operation = next(operation for operation in plan if operation.kind == "create_user")
+        self.assertEqual(user_operation.command["createUser"], "user_b")
+        self.assertEqual(user_operation.command["roles"], [{"role": "readWrite", "db": "test_db"}])
+
+    def test_removals_require_prune(self):
+        live = self.create_cluster([self.create_database("test_db", ["a", "b"], ["user_a"]),
+                                    self.create_database("scratch_db", [], [])])
+        desired = self.create_cluster([self.create_database("test_db", ["a"], [])])
+
+        self.assertEqual(generate_plan(generate_cluster_diff(live, desired)), [])
+        plan = generate_plan(generate_cluster_diff(live, desired), prune=True)
+        self.assertEqual(sorted(operation.kind for operation in plan), ["drop_database", "drop_index", "drop_user"])
+
+    def test_renamed_index_is_not_rebuilt(self):
+        live = self.create_cluster([self.create_database("test_db", ["a"], [])])
+        desired = self.create_cluster([self.create_database("test_db", ["a"], [])])
+        desired.databases[0].collections[0].indexes[0].name = "a_renamed"
+
+        plan = generate_plan(generate_cluster_diff(live, desired), prune=True)
+        self.assertEqual([operation.kind for operation in plan], ["rename_index"])
+
+    def test_changed_index_is_rebuilt(self):
+        live = self.create_cluster([self.create_database("test_db", ["a"], [])])
+        desired = self.create_cluster([self.create_database("test_db", ["a"], [])])
+        desired.databases[0].collections[0].indexes[0].fields = {"a": -1}
+
+        plan = generate_plan(generate_cluster_diff(live, desired))
+        self.assertEqual([operation.kind for operation in plan], ["rebuild_index", "create_indexes"])
+        self.assertEqual(plan[1].command["indexes"], [{"key": {"a": -1}, "name": "a"}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+from pymongo.errors import OperationFailure
+
+from src.cluster_to_data_model import datamodel_to_config, get_mongo_catalog_from_list_catalog
+from src.compact_model import compact_cluster
+from src.config_cache import cluster_to_cache_data, cluster_from_cache_data
+from src.config_to_mongo import parse_config
+from src.diff_utils import generate_cluster_diff
+from src.mongo_data_model import MongoCollection, MongoIndex
+from src.plan_apply import generate_plan
+from src.shard_indexes import get_shard_index_specs, shard_seed_list
+from test.helpers import ClusterTestCase, FakeClient, FakeCollection, index_spec
+
+ORDERS_UUID = uuid.uuid4()
+
+
+class TestShardIndexes(ClusterTestCase):
+
+    def create_cluster(self, shard_indexes=None, sharded=True):
+        indexes = [MongoIndex(name="customer_1", fields={"customer": 1}),
+                   MongoIndex(name="status_1", fields={"status": 1})]
+        return self.create_mock_cluster([self.create_mock_database("app", [
+            MongoCollection(name="orders", indexes=indexes, shard_indexes=shard_indexes)])], sharded=sharded)
+
+    def test_inconsistencies_are_reported_alongside_the_diff(self):
+        customer = MongoIndex(name="customer_1", fields={"customer": 1})
+        status = MongoIndex(name="status_1", fields={"status": 1})
+        live = self.create_cluster({
+            "shard_a": [customer, status],
+            "shard_b": [customer, MongoIndex(name="status_1", fields={"status": -1})],
+            "shard_c": [status],
+        })
+        for cluster in (live, compact_cluster(live)):
+            diff = generate_cluster_diff(cluster, self.create_cluster(sharded=False))
+            # mongos agrees with the config, so there is nothing to apply
+            self.assertEqual(generate_plan(diff, prune=True), [])
+            self.assertEqual([(inconsistency.index, inconsistency.missing_shards, inconsistency.definitions)
+                              for inconsistency in diff.shard_inconsistencies],
+                             [("customer_1", ["shard_c"], {}),
+                              ("status_1", [], {((("status", 1),), False): ["shard_a", "shard_c"],
+                                                ((("status", -1),), False): ["shard_b"]})])
+        self.assertEqual(diff.shard_inconsistencies[0].describe(),
+                         "index customer_1 on app.orders is missing on shard_c")
+
+        # An unreadable shard is reported and otherwise left out of the comparison
+        partial = self.create_cluster({"shard_a": [customer, status], "shard_b": None, "shard_c": [customer, status]})
+        for cluster in (partial, compact_cluster(partial)):
+            inconsistencies = generate_cluster_diff(cluster, self.create_cluster()).shard_inconsistencies
+            self.assertEqual([inconsistency.describe() for inconsistency in inconsistencies],
+                             ["indexes of app.orders are unreadable on shard_b"])
+
+        consistent = self.create_cluster({"shard_a": [customer, status], "shard_b": [customer, status]})
+        self.assertEqual(generate_cluster_diff(consistent, self.create_cluster()).shard_inconsistencies, [])
+
+    def create_config_client(self, catalog=()):
+        return FakeClient({
+            ("config", "shards"): FakeCollection(documents=[{"_id": "shard_a", "host": "rs_a/a1:27018,a2:27018"},
+                                                            {"_id": "shard_b", "host": "rs_b/b1:27018"},
+                                                            {"_id": "shard_c", "host": "c1:27018"},
+                                                            {"_id": "shard_d", "host": "d1:27018"}]),
+            ("config", "collections"): FakeCollection(documents=[{"_id": "app.orders", "uuid": ORDERS_UUID},
+                                                                 {"_id": "app.tmp_import", "uuid": uuid.uuid4()},
+                                                                 {"_id": "other.events", "uuid": uuid.uuid4()}]),
+            # shard_d owns no chunk of app.orders, so its indexes do not matter
+            ("config", "chunks"): FakeCollection(documents=[{"_id": ORDERS_UUID,
+                                                             "shards": ["shard_a", "shard_b", "shard_c"]}]),
+        }, catalog=catalog)
+
+    def test_index_specs_are_read_from_every_owning_shard(self):
+        client = self.create_config_client()
+        unreadable = FakeCollection()
+        unreadable.list_indexes = mock.Mock(side_effect=OperationFailure("not authorized", code=13))
+        shard_clients = {
+            "a1:27018,a2:27018": FakeClient({("app", "orders"): FakeCollection(
+                [index_spec("_id_", {"_id": 1}), index_spec("customer_1", {"customer": 1})])}),
+            # The collection was never created on shard_b
+            "b1:27018": FakeClient(),
+            # The cluster's credentials are not valid on shard_c
+            "c1:27018": FakeClient({("app", "orders"): unreadable}),
+        }
+        namespace_filter = SimpleNamespace(includes_collection=lambda db_name, name: not name.startswith("tmp_"))
+        with mock.patch("src.shard_indexes.get_client", side_effect=lambda host, *args, **kwargs: shard_clients[host]):
+            specs = get_shard_index_specs(client, ["app"], "test_cluster", "user", "pass", "admin",
+                                          namespace_filter=namespace_filter)
+        self.assertEqual(list(specs), ["app.orders"])
+        self.assertEqual([spec["name"] for spec in specs["app.orders"]["shard_a"]], ["_id_", "customer_1"])
+        self.assertEqual(specs["app.orders"]["shard_b"], [])
+        self.assertIsNone(specs["app.orders"]["shard_c"])
+        self.assertEqual(client.config.chunks.pipelines[0][0]["$match"]["$or"][1], {"ns": {"$in": ["app.orders"]}})
+        self.assertEqual(shard_seed_list("c1:27018"), "c1:27018")
+
+    def test_index_specs_are_read_through_list_catalog(self):
+        specs = [{"spec": index_spec("_id_", {"_id": 1})}, {"spec": index_spec("customer_1", {"customer": 1})}]
+        client = self.create_config_client([{"db": "app", "name": "orders", "shard": shard, "md": {"indexes": specs}}
+                                            for shard in ("shard_a", "shard_b")])
+        with mock.patch("src.shard_indexes.get_client") as get_client:
+            shard_specs = get_shard_index_specs(client, ["app"], "test_cluster", "user", "pass", "admin")
+        get_client.assert_not_called()
+        self.assertEqual(shard_specs["app.orders"]["shard_a"], [entry["spec"] for entry in specs])
+        # shard_c owns chunks but does not hold the collection
+        self.assertEqual(shard_specs["app.orders"]["shard_c"], [])
+
+    def test_list_catalog_through_mongos(self):
+        specs = [{"spec": index_spec("_id_", {"_id": 1})}, {"spec": index_spec("customer_1", {"customer": 1})}]
+        # mongos returns one entry per shard holding a collection
+        client = FakeClient(catalog=[{"db": "app", "name": "orders", "shard": shard, "md": {"indexes": specs}}
+                                     for shard in ("shard_a", "shard_b")])
+        catalog = get_mongo_catalog_from_list_catalog(client, ["app"])
+        self.assertEqual([(collection.name, [index.name for index in collection.indexes])
+                          for collection in catalog["app"]], [("orders", ["customer_1"])])
+
+    def test_sharded_flag_in_config(self):
+        cluster = self.create_cluster()
+        config = datamodel_to_config([cluster])
+        self.assertTrue(config["clusters"][0]["sharded"])
+        self.assertTrue(parse_config(config)[0].sharded)
+        self.assertTrue(cluster_from_cache_data(cluster_to_cache_data(cluster)).sharded)
+        self.assertNotIn("sharded", datamodel_to_config([self.create_cluster(sharded=False)])["clusters"][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
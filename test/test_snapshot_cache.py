@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+
+from bson import Timestamp
+from pydantic import SecretStr
+
+from src.mongo_data_model import MongoCluster, MongoDatabase, MongoCollection, MongoIndex, MongoUser
+from src.snapshot_cache import SnapshotCache, apply_change_event
+
+
+def event(operation_type, db, coll=None, **description):
+    namespace = {"db": db} if coll is None else {"db": db, "coll": coll}
+    return {"operationType": operation_type, "ns": namespace, "operationDescription": description}
+
+
+class TestSnapshotCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cluster = MongoCluster(
+            name="test_cluster", host="localhost", port=27017, username="user", password=SecretStr("pass"),
+            authentication_database="admin",
+            databases=[MongoDatabase(
+                name="app",
+                users=[MongoUser(username="app_user", password=SecretStr("secret"), roles=["readWrite"])],
+                collections=[MongoCollection(name="orders", indexes=[
+                    MongoIndex(name="customer_1", fields={"customer": 1}, unique=False)])]
+            )]
+        )
+
+    def collection(self, db_name, collection_name):
+        db = next(db for db in self.cluster.databases if db.name == db_name)
+        return next(collection for collection in db.collections if collection.name == collection_name)
+
+    def test_index_events(self):
+        database_fingerprint = self.cluster.databases[0].fingerprint
+        spec = {"v": 2, "key": {"created": -1}, "name": "created_-1", "unique": True}
+        self.assertTrue(apply_change_event(self.cluster, event("createIndexes", "app", "orders", indexes=[spec])))
+        # Replaying an event leaves the snapshot unchanged
+        apply_change_event(self.cluster, event("createIndexes", "app", "orders", indexes=[spec]))
+        orders = self.collection("app", "orders")
+        self.assertEqual([index.name for index in orders.indexes], ["customer_1", "created_-1"])
+        self.assertTrue(orders.indexes[1].unique)
+        self.assertNotEqual(self.cluster.databases[0].fingerprint, database_fingerprint)
+
+        apply_change_event(self.cluster, event("dropIndexes", "app", "orders", indexes=[spec]))
+        self.assertEqual([index.name for index in orders.indexes], ["customer_1"])
+        self.assertEqual(self.cluster.databases[0].fingerprint, database_fingerprint)
+
+    def test_collection_events(self):
+        apply_change_event(self.cluster, event("create", "reports", "daily"))
+        apply_change_event(self.cluster, event("create", "reports", "daily_view", viewOn="daily"))
+        self.assertEqual([db.name for db in self.cluster.databases], ["app", "reports"])
+        self.assertEqual([collection.name for collection in self.cluster.databases[1].collections], ["daily"])
+
+        apply_change_event(self.cluster, event("rename", "app", "orders", to={"db": "app", "coll": "archive"}))
+        self.assertEqual(self.collection("app", "archive").indexes[0].name, "customer_1")
+        self.assertEqual([collection.name for collection in self.cluster.databases[0].collections], ["archive"])
+
+        # Dropping the last collection drops the database with it
+        apply_change_event(self.cluster, event("drop", "reports", "daily"))
+        self.assertEqual([db.name for db in self.cluster.databases], ["app"])
+        apply_change_event(self.cluster, event("dropDatabase", "app"))
+        self.assertEqual(self.cluster.databases, [])
+
+    def test_system_namespaces_are_ignored(self):
+        self.assertFalse(apply_change_event(self.cluster, event("create", "admin", "settings")))
+        self.assertFalse(apply_change_event(self.cluster, event("create", "app", "system.views")))
+        self.assertEqual([db.name for db in self.cluster.databases], ["app"])
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "snapshot.json")
+            cache = SnapshotCache(path)
+            self.assertFalse(cache.load())
+            cache.cluster = self.cluster
+            cache.resume_token = {"_data": "8265", "clusterTime": Timestamp(1700000000, 1)}
+            cache.save()
+            with open(path) as file:
+                self.assertNotIn("secret", file.read())
+
+            loaded = SnapshotCache(path)
+            self.assertTrue(loaded.load())
+            self.assertEqual(loaded.resume_token, cache.resume_token)
+            self.assertEqual(loaded.cluster.databases[0].collections, self.cluster.databases[0].collections)
+            self.assertEqual(loaded.cluster.databases[0].users[0].roles, ["readWrite"])
+            self.assertEqual(loaded.cluster.password.get_secret_value(), "")
+
+
+if __name__ == '__main__':
+    unittest.main()